@@ -3,24 +3,79 @@ from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
-from config import get_settings, get_environment
+from config import settings
 from flask_mail import Mail
 from flask_socketio import SocketIO
+from app.database import engine_options, set_sqlite_pragmas
+from app.channels import channels_manager
 
-flask_configs = get_settings()
-env = get_environment()
-
-app = Flask(__name__)
-app.config.update(
-    SQLALCHEMY_DATABASE_URI=flask_configs['SQLALCHEMY_DATABASE_URI'][env],
-    SQLALCHEMY_TRACK_MODIFICATIONS=flask_configs['SQLALCHEMY_TRACK_MODIFICATIONS'][env]
-)
-CORS(app,resources={r"/*":{"origins":"*"}})
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-login = LoginManager(app)
+# extensions are bound to application in create_app
+db = SQLAlchemy()
+migrate = Migrate()
+login = LoginManager()
 login.login_view = 'login'
-mail = Mail(app)
-socketio = SocketIO(app, cors_allowed_origins="*", logger=True, engineio_logger=True)
+mail = Mail()
+socketio = SocketIO()
 
-from app import routes, models, socket
+
+def socketio_options(socketio_cfg):
+    # with message queue (redis://...) every worker publishes its emits to the queue channel
+    # and delivers emits of other workers to own sockets, so broadcasts reach all workers
+    options = {
+        'cors_allowed_origins': '*',
+        'logger': socketio_cfg.get('LOGGER', False),                   # verbose socket logs are for debugging only
+        'engineio_logger': socketio_cfg.get('ENGINEIO_LOGGER', False)
+    }
+    if socketio_cfg.get('MESSAGE_QUEUE'):
+        # queue manager also delivers channel membership changes to the worker of the socket (see app.channels)
+        options['client_manager'] = channels_manager(socketio_cfg['MESSAGE_QUEUE'], socketio_cfg.get('CHANNEL') or 'nigels-app')
+    return options
+
+
+def create_app(config=None):
+    # config (dict) overrides flask settings resolved from config.yml, e.g. {'SQLALCHEMY_DATABASE_URI': 'sqlite://'}
+    flask_cfg = settings().FLASK
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=flask_cfg['SQLALCHEMY_DATABASE_URI'],
+        SQLALCHEMY_TRACK_MODIFICATIONS=flask_cfg['SQLALCHEMY_TRACK_MODIFICATIONS']
+    )
+    if config:
+        app.config.update(config)
+    database_cfg = settings().resolved.get('DATABASE', {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI'], database_cfg))
+    app.config.setdefault('CORS_EXPOSE_HEADERS', ['ETag', 'X-Next-Cursor', 'X-Query-Count', 'Server-Timing'])     # readable by browser clients (conditional polling, paging, profiling)
+    CORS(app, resources={r"/*": {"origins": "*"}})
+    db.init_app(app)
+    with app.app_context():
+        set_sqlite_pragmas(db.engine, database_cfg.get('SQLITE_PRAGMAS'))
+    migrate.init_app(app, db, render_as_batch=app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'))     # sqlite alters tables by copy and move
+    login.init_app(app)
+    mail.init_app(app)
+
+    from app import routes, models, socket, cli     # socket handlers are collected before socketio is bound
+    socketio.init_app(app, **socketio_options(settings().resolved.get('SOCKETIO', {})))
+    routes.init_app(app)
+    cli.init_app(app)
+    app.config.setdefault('PROFILING', settings().resolved.get('PROFILING', {}))
+    if app.config['PROFILING'].get('ENABLED'):
+        from app import profiling
+        profiling.init_app(app, app.config['PROFILING'])
+    app.config.setdefault('METRICS', settings().resolved.get('METRICS', {}))
+    if app.config['METRICS'].get('ENABLED'):
+        from app import metrics
+        metrics.init_app(app, app.config['METRICS'])
+    return app
+
+
+_app = None
+
+
+def __getattr__(name):
+    # `from app import app` - default application, created on first use
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(name)
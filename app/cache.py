@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from threading import RLock
+from time import monotonic
+
+
+class TTLCache(object):
+    # bounded in-process cache: entries expire after ttl seconds, least recently used entries are evicted first
+
+    def __init__(self, maxsize=128, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = RLock()
+        self._entries = OrderedDict()       # key -> (expires, value)
+
+    def __repr__(self):
+        return '<TTLCache of {} entries (ttl {}s)>'.format(len(self._entries), self.ttl)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self._entries[key] = (monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            entry = self._entries.pop(key, None)
+            return entry[1] if entry else None
+
+    def items(self):
+        with self.lock:
+            return [(key, entry[1]) for key, entry in self._entries.items()]
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+
+
+ratings_cache = TTLCache(maxsize=64, ttl=30)       # ratings pages, cleared on every stats change
+auth_cache = TTLCache(maxsize=4096, ttl=300)      # token hash -> user identity, dropped on every user change
+lobby_cache = TTLCache(maxsize=4, ttl=5)           # lobby rows, cleared on room/game commit (ttl bounds staleness of other workers)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+# Compact card encoding: every card is an integer 0..51 = suit index * 13 + grade index.
+# Grades and suits are the same 1-character codes as stored in DealtCards/TurnCard
+# (card_id and card_suit), so encode/decode is the only conversion needed at db and api boundaries.
+
+GRADES = '23456789tjqka'                # normal hierarchy (lowest to highest)
+TRUMP_GRADES = '2345678tqka9j'          # trump hierarchy (lowest to highest)
+SUITS = 'schd'                          # s for spades, c for clubs, h for hearts, d for diamonds
+NO_TRUMP = len(SUITS)                   # trump index of hands without trump
+
+DECK = tuple(range(len(SUITS) * len(GRADES)))
+
+_CODES = tuple(grade + suit for suit in SUITS for grade in GRADES)
+_INDEX = dict((code, card) for card, code in enumerate(_CODES))
+
+
+def encode(code):
+    return _INDEX.get(str(code).casefold())
+
+
+def decode(card):
+    return _CODES[card]
+
+
+def grade(card):
+    return GRADES[card % 13]
+
+
+def suit(card):
+    return SUITS[card // 13]
+
+
+def suit_index(suit_code):
+    if suit_code is None:
+        return None
+    return SUITS.index(suit_code.casefold())
+
+
+def trump_index(trump):
+    if not trump:
+        return NO_TRUMP
+    return SUITS.index(trump.casefold())
+
+
+def _build_ranks(trump):
+    # rank of every card within its own suit regarding trump
+    ranks = []
+    for card in DECK:
+        if card // 13 == trump:
+            ranks.append(TRUMP_GRADES.index(GRADES[card % 13]))
+        else:
+            ranks.append(card % 13)
+    return tuple(ranks)
+
+
+def _build_sort_keys(trump):
+    # hand ordering: spades, clubs, hearts, diamonds with trump suit moved to the end, then by rank within suit
+    suits_ordered = [s for s in range(len(SUITS)) if s != trump] + ([trump] if trump != NO_TRUMP else [])
+    ranks = RANKS[trump]
+    return tuple(suits_ordered.index(card // 13) * 13 + ranks[card] for card in DECK)
+
+
+RANKS = tuple(_build_ranks(trump) for trump in range(len(SUITS) + 1))
+SORT_KEYS = tuple(_build_sort_keys(trump) for trump in range(len(SUITS) + 1))
+
+
+def rank(card, trump=NO_TRUMP):
+    return RANKS[trump][card]
+
+
+def strength(card, lead_suit, trump=NO_TRUMP):
+    # trumps beat cards of turn (lead) suit, which beat all other suits
+    card_suit = card // 13
+    if card_suit == trump:
+        return 26 + RANKS[trump][card]
+    if card_suit == lead_suit:
+        return 13 + RANKS[trump][card]
+    return RANKS[trump][card]
+
+
+def beats(card, other, lead_suit, trump=NO_TRUMP):
+    return strength(card, lead_suit, trump) > strength(other, lead_suit, trump)
+
+
+def highest(turn_cards, trump=NO_TRUMP):
+    # highest of cards put in turn (first card defines turn suit)
+    if not turn_cards:
+        return None
+    lead_suit = turn_cards[0] // 13
+    return max(turn_cards, key=lambda card: strength(card, lead_suit, trump))
+
+
+def sort_cards(hand_cards, trump=NO_TRUMP):
+    return sorted(hand_cards, key=SORT_KEYS[trump].__getitem__)
+
+
+# Hand masks: a set of cards is an integer with bit <card> set for every card in it.
+
+SUIT_MASKS = tuple(((1 << 13) - 1) << (13 * s) for s in range(len(SUITS))) + (0,)
+JACKS = tuple(1 << (13 * s + GRADES.index('j')) for s in range(len(SUITS))) + (0,)
+
+
+def _build_higher_trumps(trump):
+    # HIGHER_TRUMPS[trump][rank] is mask of trump suit cards ranked higher than rank
+    if trump == NO_TRUMP:
+        return tuple(0 for r in range(13))
+    masks = []
+    for r in range(13):
+        higher = 0
+        for card in range(13 * trump, 13 * trump + 13):
+            if RANKS[trump][card] > r:
+                higher |= 1 << card
+        masks.append(higher)
+    return tuple(masks)
+
+
+HIGHER_TRUMPS = tuple(_build_higher_trumps(trump) for trump in range(len(SUITS) + 1))
+
+
+def mask(card):
+    return 1 << card
+
+
+def to_mask(hand_cards):
+    hand_mask = 0
+    for card in hand_cards:
+        hand_mask |= 1 << card
+    return hand_mask
+
+
+def from_mask(hand_mask):
+    hand_cards = []
+    while hand_mask:
+        lowest = hand_mask & -hand_mask
+        hand_cards.append(lowest.bit_length() - 1)
+        hand_mask ^= lowest
+    return hand_cards
+
+
+def count(hand_mask):
+    return bin(hand_mask).count('1')
+
+
+def legal_moves(hand_mask, trick, trump=NO_TRUMP):
+    # mask of cards from hand_mask allowed to be put in turn with cards already put (trick) (schematically described in https://drive.google.com/file/d/15X_s6eI3ouRcgYh_IWEoDF0dOTr7VPvo/view?usp=sharing )
+    if not trick or count(hand_mask) <= 1:
+        return hand_mask                                    # any card can start turn, last card on hand can always be put
+    lead_suit = trick[0] // 13
+    lead_cards = hand_mask & SUIT_MASKS[lead_suit]
+    trumps = hand_mask & SUIT_MASKS[trump]
+    other_cards = hand_mask & ~SUIT_MASKS[lead_suit] & ~SUIT_MASKS[trump]
+    legal = lead_cards                                      # putting card of current suit is allowed always
+    if trumps and lead_suit != trump:
+        jack = trumps & JACKS[trump]
+        highest_card = highest(trick, trump)
+        legal |= jack                                       # putting J trump is allowed always
+        if highest_card // 13 != trump:
+            legal |= trumps                                 # putting first trump is allowed always
+        else:
+            higher_trumps = trumps & HIGHER_TRUMPS[trump][RANKS[trump][highest_card]]
+            legal |= higher_trumps                          # putting higher trump is allowed always
+            if hand_mask == trumps and not higher_trumps & ~jack:
+                legal |= trumps                             # leaking lower trump if player has no other option is allowed
+    if not lead_cards or (lead_suit == trump and lead_cards == JACKS[trump]):
+        legal |= other_cards                                # no turn suited cards on hand (or the only trump on hand is J in trump suited turn)
+    return legal
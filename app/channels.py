@@ -0,0 +1,53 @@
+# Channel (socketio room) membership of user sockets across workers.
+# Every authenticated socket is in the channel of its user (user-<id>) within its namespace. With message queue the sockets
+# of a user may be connected to other workers, so membership change is emitted as control event to the user channel:
+# the queue delivers it to every worker like any emit, and each worker applies it to its own sockets instead of sending it.
+import socketio
+
+ENTER_CHANNEL = 'nigels:enter_channel'
+LEAVE_CHANNEL = 'nigels:leave_channel'
+
+
+def user_channel(user_id):
+    return 'user-{}'.format(user_id)
+
+
+def apply_channel_change(manager, change, namespace, user_room, channel):
+    # moves sockets of user room connected to this worker
+    for sid, eio_sid in list(manager.get_participants(namespace, user_room)):
+        if change == ENTER_CHANNEL:
+            manager.enter_room(sid, namespace, channel)
+        else:
+            manager.leave_room(sid, namespace, channel)
+
+
+def change_user_channel(manager, change, user_id, channel, namespace):
+    if isinstance(manager, socketio.PubSubManager):
+        # applied by every worker (this one included) on delivery, see ChannelsMixin
+        manager.emit(change, channel, namespace=namespace, room=user_channel(user_id))
+    else:
+        apply_channel_change(manager, change, namespace, user_channel(user_id), channel)
+
+
+class ChannelsMixin(object):
+    # message queue manager which applies channel changes instead of sending them to clients
+
+    def _handle_emit(self, message):
+        if message['event'] in (ENTER_CHANNEL, LEAVE_CHANNEL):
+            apply_channel_change(self, message['event'], message['namespace'], message['room'], message['data'][0])
+        else:
+            super(ChannelsMixin, self)._handle_emit(message)
+
+
+def channels_manager(url, channel):
+    # client manager for message queue url, of the same backend flask_socketio would choose
+    if url.startswith(('redis://', 'rediss://')):
+        queue_class = socketio.RedisManager
+    elif url.startswith('kafka://'):
+        queue_class = socketio.KafkaManager
+    elif url.startswith('zmq'):
+        queue_class = socketio.ZmqManager
+    else:
+        queue_class = socketio.KombuManager
+    manager_class = type('Channels' + queue_class.__name__, (ChannelsMixin, queue_class), {})
+    return manager_class(url, channel=channel)
@@ -0,0 +1,43 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from app import db
+from app.models import Game, Stats
+
+
+@click.group(cls=AppGroup)
+def scores():
+    """Game scoreboard commands."""
+    pass
+
+
+@scores.command()
+@click.argument('game_id', required=False, type=int)
+def rebuild(game_id):
+    """Rebuild scoreboard of game GAME_ID (of all games by default) from hand scores."""
+    games = Game.query.filter_by(id=game_id).all() if game_id else Game.query.order_by(Game.id).all()
+    for g in games:
+        scoreboard = g.rebuild_scores()
+        db.session.commit()
+        if current_app.debug:
+            print('Rebuilt scoreboard of game #' + str(g.id) + ': ' + str(len(scoreboard)) + ' players')
+    print('Scoreboards rebuilt: ' + str(len(games)))
+
+
+@click.group(cls=AppGroup)
+def stats():
+    """Players stats commands."""
+    pass
+
+
+@stats.command('rebuild')
+def rebuild_stats():
+    """Recalculate stats of all players from finished games history."""
+    Stats.rebuild()
+    db.session.commit()
+    print('Stats rebuilt: ' + str(Stats.query.count()) + ' players')
+
+
+def init_app(app):
+    app.cli.add_command(scores)
+    app.cli.add_command(stats)
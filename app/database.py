@@ -0,0 +1,38 @@
+from sqlalchemy import event
+
+POOL_SIZE_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+SQLITE_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000}     # used unless configured
+
+
+def is_memory_sqlite(uri):
+    return uri in ('sqlite://', 'sqlite:///:memory:') or (uri.startswith('sqlite') and 'mode=memory' in uri)
+
+
+def engine_options(uri, database_cfg):
+    # SQLALCHEMY_ENGINE_OPTIONS from DATABASE section of config.yml (ENGINE_OPTIONS are passed to create_engine as is)
+    options = dict(database_cfg.get('ENGINE_OPTIONS', {}))
+    if 'connect_args' in options:
+        options['connect_args'] = dict(options['connect_args'])
+    if is_memory_sqlite(uri):
+        # in-memory database lives in a single shared connection (StaticPool) which has no size
+        for option in POOL_SIZE_OPTIONS:
+            options.pop(option, None)
+    statement_timeout = database_cfg.get('STATEMENT_TIMEOUT')      # milliseconds
+    if statement_timeout and uri.startswith('postgres'):
+        connect_args = options.setdefault('connect_args', {})
+        connect_args['options'] = (connect_args.get('options', '') + ' -c statement_timeout={}'.format(int(statement_timeout))).strip()
+    return options
+
+
+def set_sqlite_pragmas(engine, pragmas=None):
+    # applied to every new connection of sqlite engine
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {name}={value}'.format(name=name, value=value))
+        cursor.close()
@@ -1,7 +1,7 @@
 from threading import Thread
-from flask import render_template
+from flask import render_template, current_app
 from flask_mail import Message
-from app import app, mail
+from app import mail
 from config import get_settings, get_environment
 
 auth = get_settings('AUTH')
@@ -9,18 +9,18 @@ mail_settings = get_settings('MAIL')
 env = get_environment()
 
 def send_async_email(app, msg):
-    #if app.config['ENVIRONMENT'] != 'TEST':  # no sending mails within auto-tests
+    #if current_app.config['ENVIRONMENT'] != 'TEST':  # no sending mails within auto-tests
     with app.app_context():
         mail.send(msg)
 
 
 def send_email(subject, sender, recipients, text_body, html_body):
-    if app.debug:
+    if current_app.debug:
         print('Sending message with subject "' + str(subject) + '" from sender ' + str(sender) + ' to emails ' + str(recipients) + ')...')
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
-    Thread(target=send_async_email, args=(app, msg)).start()
+    Thread(target=send_async_email, args=(current_app._get_current_object(), msg)).start()
 
 
 def send_password_reset_email(user):
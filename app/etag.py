@@ -0,0 +1,24 @@
+# Conditional responses for polled status endpoints.
+# Entity tag is derived from cheap mutation counter of the resource (game or room state_version), so that
+# If-None-Match is answered with 304 before status json is built.
+from flask import current_app, request
+
+
+def resource_etag(version, *parts):
+    # e.g. resource_etag(5, 'game', 12, 'user', 3) -> 'game-12-user-3-v5'
+    return '-'.join(str(part) for part in parts) + '-v' + str(version)
+
+
+def is_fresh(etag):
+    # client already has representation with this tag
+    return etag in request.if_none_match
+
+
+def not_modified(etag):
+    return conditional(current_app.response_class(status=304), etag)
+
+
+def conditional(response, etag):
+    response.set_etag(etag)
+    response.cache_control.no_cache = True      # browsers should always revalidate polled status
+    return response
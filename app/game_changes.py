@@ -0,0 +1,70 @@
+# Long-poll waiters of game state changes (see resources/game.py wait).
+# Parked requests sleep on per-game event, which is set once transaction advancing game state version
+# (Game.advance_state_version) is committed in this process. Changes committed by other workers are
+# noticed by rechecking the version in db every GAME LONG_POLL_RECHECK seconds.
+# Under gevent (monkey patched threading) waiting parks the greenlet only.
+from threading import Event, Lock
+from time import monotonic
+from app import db
+from app.models import Game
+from config import settings
+
+LONG_POLL_TIMEOUT = 25      # seconds, default and upper bound of wait timeout
+LONG_POLL_RECHECK = 2       # seconds
+
+
+class GameChanges(object):
+
+    def __init__(self):
+        self.lock = Lock()
+        self._events = {}       # game id (str) -> [event, listeners count]
+
+    def __repr__(self):
+        return '<GameChanges of {} games>'.format(len(self._events))
+
+    def listen(self, game_id):
+        with self.lock:
+            entry = self._events.setdefault(game_id, [Event(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def unlisten(self, game_id, event):
+        with self.lock:
+            entry = self._events.get(game_id)
+            if entry and entry[0] is event:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._events[game_id]
+
+    def notify(self, game_ids):
+        # wakes all current listeners of games, later listeners get new event
+        with self.lock:
+            for game_id in game_ids:
+                entry = self._events.pop(game_id, None)
+                if entry:
+                    entry[0].set()
+
+
+game_changes = GameChanges()
+
+
+def long_poll_settings():
+    game_cfg = settings().GAME
+    return game_cfg.get('LONG_POLL_TIMEOUT', LONG_POLL_TIMEOUT), game_cfg.get('LONG_POLL_RECHECK', LONG_POLL_RECHECK)
+
+
+def wait_for_change(game_id, since, timeout, recheck=LONG_POLL_RECHECK):
+    # parks caller until game state version is greater than since or timeout expires,
+    # returns current version (None for unknown game)
+    deadline = monotonic() + timeout
+    while True:
+        event = game_changes.listen(str(game_id))     # listening before version is read, so no commit is missed
+        try:
+            version = Game.get_state_version(game_id)
+            db.session.close()      # parked request holds no db connection
+            remaining = deadline - monotonic()
+            if version is None or version > since or remaining <= 0:
+                return version
+            event.wait(min(remaining, recheck))
+        finally:
+            game_changes.unlisten(str(game_id), event)
@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from threading import RLock
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from app import db, cards
+from app.models import User, Room, Game, Player, Hand, HandScore, GameScore, Turn, TurnCard
+
+
+# In-memory table state of dealt hands. Every hand is loaded from db once (fixed number of queries),
+# then bets and cards are applied both to db (write-through) and to the cached state, so game loop
+# endpoints do not re-derive the whole table from db on every request.
+
+MAX_CACHED_HANDS = 1024
+
+
+class StateConflict(Exception):
+    # game state was changed by other process since the hand state was loaded
+    pass
+
+
+_states = OrderedDict()
+_registry_lock = RLock()
+
+
+class TurnState(object):
+
+    def __init__(self, turn_id, serial_no, took_user_id=None):
+        self.id = turn_id
+        self.serial_no = serial_no
+        self.took_user_id = took_user_id
+        self.cards = []                 # list of (player_id, card) tuples in order of putting
+
+    def __repr__(self):
+        return '<TurnState #{} {}>'.format(self.serial_no, self.cards)
+
+    def get_starting_suit(self):
+        if self.cards:
+            return cards.suit(self.cards[0][1])
+        return None
+
+    def if_put_card(self, user_id):
+        for player_id, card in self.cards:
+            if player_id == user_id:
+                return True
+        return False
+
+    def card_player(self, card):
+        for player_id, turn_card in self.cards:
+            if turn_card == card:
+                return player_id
+        return None
+
+    def highest_card(self, trump=cards.NO_TRUMP):
+        return cards.highest([card for player_id, card in self.cards], trump)
+
+
+class HandState(object):
+
+    def __init__(self, hand):
+        self.lock = RLock()
+        self.id = hand.id
+        self.game_id = hand.game_id
+        self.serial_no = hand.serial_no
+        self.trump = hand.trump.casefold() if hand.trump else None
+        self.trump_index = cards.trump_index(self.trump)
+        self.cards_per_player = hand.cards_per_player
+        self.starting_player = hand.starting_player
+        self.is_closed = hand.is_closed
+        self.finishes_game = False      # closing of this hand finished the game
+        self.version = hand.game.state_version     # game state version the hand state corresponds to
+        self.seats = {}                 # game position -> user id
+        self.positions = {}             # user id -> game position
+        self.usernames = {}             # user id -> username
+        self.played_hands = 0           # closed hands in game before this one
+        self.dealt = {}                 # user id -> initially dealt cards (see app.cards encoding)
+        self.hands = {}                 # user id -> mask of cards currently on hand
+        self.bets = {}                  # user id -> bet size
+        self.turns = []
+
+    def __repr__(self):
+        return '<HandState {} (hand #{} in game {})>'.format(self.id, self.serial_no, self.game_id)
+
+    @staticmethod
+    def load(hand, game_players=None, played_hands=None):
+        # hand is expected to be loaded with dealt cards, scores and turns (see load_hand)
+        # game players ((user_id, position, username) tuples) and count of played hands can be passed if already known
+        state = HandState(hand)
+        if game_players is None:
+            game_players = db.session.query(Player.user_id, Player.position, User.username).join(
+                User, User.id == Player.user_id).filter(Player.game_id == hand.game_id).all()
+        for user_id, position, username in game_players:
+            state.seats[position] = user_id
+            state.positions[user_id] = position
+            state.usernames[user_id] = username
+            state.dealt[user_id] = []
+            state.hands[user_id] = 0
+        if played_hands is None:
+            played_hands = Hand.query.filter(
+                Hand.game_id == hand.game_id, Hand.is_closed == 1, Hand.serial_no < hand.serial_no).count()
+        state.played_hands = played_hands
+        for dc in hand.dealt_cards:
+            card = cards.encode(str(dc.card_id) + dc.card_suit)
+            state.dealt.setdefault(dc.player_id, []).append(card)
+            state.hands[dc.player_id] = state.hands.get(dc.player_id, 0) | cards.mask(card)
+        for hs in hand.scores:
+            state.bets[hs.player_id] = hs.bet_size
+        for t in hand.turns:
+            turn_state = TurnState(t.id, t.serial_no, t.took_user_id)
+            for tc in t.cards:
+                card = cards.encode(str(tc.card_id) + tc.card_suit)
+                turn_state.cards.append((tc.player_id, card))
+                state.hands[tc.player_id] = state.hands.get(tc.player_id, 0) & ~cards.mask(card)
+            state.turns.append(turn_state)
+        return state
+
+    @property
+    def players_count(self):
+        return len(self.seats)
+
+    def username(self, user_id):
+        return self.usernames.get(user_id)
+
+    def is_registered(self, user_id):
+        return user_id in self.positions
+
+    def get_position(self, user_id):
+        return ((self.positions[user_id] - self.serial_no) % self.players_count) + 1
+
+    def get_relative_position(self, source_user_id, required_user_id):
+        source_position = self.positions.get(source_user_id)
+        required_position = self.positions.get(required_user_id)
+        if not source_position or not required_position:
+            return None
+        return (required_position - source_position) % self.players_count
+
+    def get_turn_position(self, user_id):
+        last_turn = self.get_last_turn()
+        if last_turn:
+            return (self.get_position(user_id) + self.get_position(last_turn.took_user_id)) % self.players_count
+        return self.get_position(user_id)
+
+    def is_betting_last(self, user_id):
+        return self.players_count > 0 and self.get_position(user_id) % self.players_count == 0
+
+    def get_sum_of_bets(self):
+        return sum(bet for bet in self.bets.values() if bet)
+
+    def all_bets_made(self):
+        if len(self.bets) != self.players_count:
+            return False
+        for bet in self.bets.values():
+            if bet is None:
+                return False
+        return True
+
+    def finished_turns(self):
+        return [t for t in self.turns if t.took_user_id is not None]
+
+    def all_turns_made(self):
+        return len(self.finished_turns()) >= self.cards_per_player
+
+    def took_turns(self, user_id):
+        return len([t for t in self.turns if t.took_user_id == user_id])
+
+    def get_current_turn(self, closed=False):
+        if not self.turns:
+            return None
+        if closed:
+            return self.turns[-1]
+        for t in reversed(self.turns):
+            if t.took_user_id is None:
+                return t
+        return None
+
+    def get_last_turn(self):
+        for t in reversed(self.turns):
+            if t.took_user_id is not None:
+                return t
+        return None
+
+    def next_acting_player(self):
+        if self.is_closed or self.players_count == 0:
+            return None
+
+        # next acting player defining logic (schematically described in https://drive.google.com/file/d/1ApaKjPUeCXoCUVF_v5ui6uddn8flp85i/view?usp=sharing
+        source_position = 1
+        made_bets = len(self.bets)
+        if made_bets == 0:
+            position_shift = self.played_hands
+        elif made_bets != self.players_count:
+            position_shift = made_bets + self.played_hands
+        else:
+            current_turn = self.get_current_turn()
+            put_cards = len(current_turn.cards) if current_turn else 0
+            last_turn = self.get_last_turn()
+            if last_turn is None:
+                position_shift = put_cards + self.played_hands
+            else:
+                source_position = self.positions.get(last_turn.took_user_id)
+                if source_position is None:
+                    return None
+                position_shift = put_cards
+
+        shifted_position = (source_position + position_shift) % self.players_count
+        if shifted_position == 0:
+            shifted_position = self.players_count
+        return self.seats.get(shifted_position)
+
+    def get_user_cards(self, user_id):
+        return cards.from_mask(self.hands.get(user_id, 0))
+
+    def legal_cards(self, user_id):
+        # mask of cards user is allowed to put in current turn
+        current_turn = self.get_current_turn()
+        trick = [card for player_id, card in current_turn.cards] if current_turn else []
+        return cards.legal_moves(self.hands.get(user_id, 0), trick, self.trump_index)
+
+    def get_user_initial_hand(self, user_id, trump=None):
+        return [cards.decode(card) for card in cards.sort_cards(self.dealt.get(user_id, []), cards.trump_index(trump))]
+
+    def get_user_current_hand(self, user_id, trump=None):
+        return [cards.decode(card) for card in cards.sort_cards(self.get_user_cards(user_id), cards.trump_index(trump))]
+
+    def cards_on_hand(self, user_id):
+        return cards.count(self.hands.get(user_id, 0))
+
+    def place_bet(self, user_id, bet_size):
+        hs = HandScore(player_id=user_id, hand_id=self.id, bet_size=bet_size)
+        db.session.add(hs)
+        with db.session.no_autoflush:
+            version = self._advance()       # stale state conflicts before its bet can hit unique bet of player in hand
+        self._commit()
+        self.bets[user_id] = bet_size
+        self.version = version
+
+    def put_card(self, user_id, card):
+        # returns turn the card was put in
+        try:
+            return self._put_card(user_id, card)
+        except IntegrityError as error:
+            # turn or card of stale state collides with the one saved by other process before version is checked
+            self._conflict('Game {} state was changed ({})!'.format(self.game_id, error.orig))
+
+    def _put_card(self, user_id, card):
+        current_turn = self.get_current_turn()
+        if current_turn is None:
+            last_turn = self.get_last_turn()
+            t = Turn(hand_id=self.id, serial_no=last_turn.serial_no + 1 if last_turn else 1)
+            db.session.add(t)
+            db.session.flush()
+            current_turn = TurnState(t.id, t.serial_no)
+            new_turn = True
+        else:
+            new_turn = False
+        db.session.add(TurnCard(player_id=user_id, card_id=cards.grade(card), card_suit=cards.suit(card), turn_id=current_turn.id, hand_id=self.id))
+
+        turn_cards = current_turn.cards + [(user_id, card)]
+        took_user_id = None
+        hand_is_closed = False
+        if len(turn_cards) == self.players_count:
+            highest_card = cards.highest([turn_card for player_id, turn_card in turn_cards], self.trump_index)
+            took_user_id = [player_id for player_id, turn_card in turn_cards if turn_card == highest_card][0]
+            Turn.query.filter_by(id=current_turn.id).update({'took_user_id': took_user_id})
+            hand_is_closed = len(self.turns) + (1 if new_turn else 0) == self.cards_per_player
+
+        if hand_is_closed:
+            Hand.query.filter_by(id=self.id).update({'is_closed': 1})
+            took_turns = {}
+            for t in self.turns + ([current_turn] if new_turn else []):
+                taker = took_user_id if t is current_turn else t.took_user_id
+                took_turns[taker] = took_turns.get(taker, 0) + 1
+            hand_scores = []
+            for hs in HandScore.query.filter_by(hand_id=self.id).all():
+                if hs.player_id in self.positions:
+                    hs.score = took_turns.get(hs.player_id, 0)
+                    hs.bonus = 1 if hs.score == hs.bet_size else 0
+                    if hs.bonus:
+                        hs.score = hs.score + 10
+                    hand_scores.append(hs)
+            GameScore.add_hand_scores(self.game_id, hand_scores)     # scoreboard is updated in the same transaction
+            game = Game.query.filter_by(id=self.game_id).first()
+            finishes_game = game.finished is None and game.all_hands_played()
+            if finishes_game:
+                game.finish()           # last hand closes the game in the same transaction, so game cannot stay active
+        else:
+            finishes_game = False
+        version = self._advance((2 if took_user_id else 1) + (1 if finishes_game else 0))      # card played (trick taken, game finished)
+        self._commit()
+        self.version = version
+        self.finishes_game = finishes_game
+
+        if new_turn:
+            self.turns.append(current_turn)
+        current_turn.cards.append((user_id, card))
+        current_turn.took_user_id = took_user_id
+        self.hands[user_id] = self.hands.get(user_id, 0) & ~cards.mask(card)
+        if hand_is_closed:
+            self.is_closed = 1
+        return current_turn
+
+    def _advance(self, steps=1):
+        version = Game.advance_state_version(self.game_id, steps)
+        if version != self.version + steps:
+            self._conflict('Game {} state was changed (version {} instead of {})!'.format(self.game_id, version - steps, self.version))
+        return version
+
+    def _commit(self):
+        try:
+            db.session.commit()
+        except IntegrityError as error:
+            # concurrent move passed the version check as well, unique bet, turn or card of the hand rejects it
+            self._conflict('Game {} state was changed ({})!'.format(self.game_id, error.orig))
+        except Exception:
+            db.session.rollback()
+            forget_hand_state(self.id)
+            raise
+
+    def _conflict(self, message):
+        db.session.rollback()
+        forget_hand_state(self.id)
+        raise StateConflict(message)
+
+
+class GameSnapshot(object):
+
+    def __init__(self, game):
+        self.game = game
+        self.room = game.room
+        self.players = []               # Player entries ordered by position
+        self.usernames = {}             # user id -> username
+        self.positions = {}             # user id -> game position
+        self.game_users = []            # users connected to game (scores table columns)
+        self.hands = []                 # game hands with scores
+        self.current_hand = None        # state of open hand
+        self.version = game.state_version
+
+    def __repr__(self):
+        return '<GameSnapshot of game {}>'.format(self.game.id)
+
+    @staticmethod
+    def load(game_id, attempts=3):
+        # snapshot is consistent with its version: reloaded if game state was changed while loading
+        snapshot = None
+        for attempt in range(attempts):
+            snapshot = GameSnapshot._load(game_id)
+            if snapshot is None or Game.get_state_version(game_id) == snapshot.version:
+                break
+        return snapshot
+
+    @staticmethod
+    def _load(game_id):
+        # fixed number of queries regardless of players, hands and turns count
+        game = Game.query.options(joinedload(Game.room).joinedload(Room.host), selectinload(Game.scoreboard)).filter_by(id=game_id).execution_options(populate_existing=True).first()
+        if game is None:
+            return None
+        snapshot = GameSnapshot(game)
+        for player, username in db.session.query(Player, User.username).join(
+                User, User.id == Player.user_id).filter(Player.game_id == game.id).order_by(Player.position).all():
+            snapshot.players.append(player)
+            snapshot.usernames[player.user_id] = username
+            snapshot.positions[player.user_id] = player.position
+        snapshot.game_users = game.players.all()
+        snapshot.hands = Hand.query.options(selectinload(Hand.scores)).filter_by(game_id=game.id).order_by(Hand.serial_no).all()
+        open_hands = [h for h in snapshot.hands if h.is_closed == 0]
+        if open_hands:
+            open_hand = open_hands[-1]
+            snapshot.current_hand = get_hand_state(
+                open_hand.id,
+                version=game.state_version,
+                game_players=[(player.user_id, player.position, snapshot.usernames[player.user_id]) for player in snapshot.players],
+                played_hands=len([h for h in snapshot.hands if h.is_closed == 1 and h.serial_no < open_hand.serial_no])
+            )
+        return snapshot
+
+    @property
+    def positions_defined(self):
+        for player in self.players:
+            if player.position is None:
+                return False
+        return True
+
+    @property
+    def played_hands_count(self):
+        return len([h for h in self.hands if h.is_closed == 1])
+
+    def is_player(self, user_id):
+        return user_id in self.positions
+
+    def get_relative_position(self, source_user_id, required_user_id):
+        source_position = self.positions.get(source_user_id)
+        required_position = self.positions.get(required_user_id)
+        if not source_position or not required_position:
+            return None
+        return (required_position - source_position) % len(self.players)
+
+    def get_scores(self):
+        return self.game.get_scores(played_hands=self.hands, players=self.game_users)
+
+
+def load_hand(hand_id):
+    return Hand.query.options(
+        selectinload(Hand.dealt_cards),
+        selectinload(Hand.scores),
+        selectinload(Hand.turns).selectinload(Turn.cards),
+        joinedload(Hand.game)
+    ).filter_by(id=hand_id).execution_options(populate_existing=True).first()
+
+
+def get_hand_state(hand_id, version=None, game_players=None, played_hands=None):
+    # cached state is reloaded if game state version (read from db unless passed) was changed by other process
+    try:
+        hand_id = int(hand_id)
+    except (TypeError, ValueError):
+        return None
+    with _registry_lock:
+        state = _states.get(hand_id)
+    if state is not None:
+        if version is None:
+            version = Game.get_state_version(state.game_id)
+        if state.version == version:
+            with _registry_lock:
+                _states.move_to_end(hand_id)
+            return state
+        forget_hand_state(hand_id)
+    hand = load_hand(hand_id)
+    if hand is None:
+        return None
+    state = HandState.load(hand, game_players, played_hands)
+    with _registry_lock:
+        cached = _states.get(hand_id)
+        if cached is None or cached.version < state.version:
+            _states[hand_id] = cached = state
+        state = cached
+        while len(_states) > MAX_CACHED_HANDS:
+            _states.popitem(last=False)
+    return state
+
+
+def forget_hand_state(hand_id):
+    with _registry_lock:
+        _states.pop(int(hand_id), None)
+
+
+def reset_hand_states():
+    with _registry_lock:
+        _states.clear()
@@ -0,0 +1,34 @@
+# Shared sql timing of api requests: one pair of engine cursor events (registered on first use) times every statement
+# and passes it to observers of the request being served, profiling and metrics register their observers here.
+from hmac import compare_digest
+from time import perf_counter
+from flask import has_request_context, request
+from sqlalchemy import event
+from app import db
+
+
+def observe_queries(app, observer):
+    # observer(statement, duration) is called for every statement executed while serving a request, duration in seconds
+    observers = app.extensions.get('query_observers')
+    if observers is None:
+        observers = app.extensions['query_observers'] = []
+        with app.app_context():
+            engine = db.engine
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def start_query(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('query_started', []).append(perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def finish_query(conn, cursor, statement, parameters, context, executemany):
+            duration = perf_counter() - conn.info['query_started'].pop()
+            if has_request_context():
+                for request_observer in observers:
+                    request_observer(statement, duration)
+
+    observers.append(observer)
+
+
+def authorized(token):
+    # reports of profiling and metrics are protected by optional bearer token of their config section
+    return not token or compare_digest(request.headers.get('Authorization', '').encode(), 'Bearer {}'.format(token).encode())
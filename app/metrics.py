@@ -0,0 +1,205 @@
+# Built-in metrics registry, served in Prometheus text exposition format by GET /metrics (opt-in METRICS section of config.yml, see README).
+# Instruments are in-process counters and histograms (one lock per update), gauges of current state (active games,
+# connected sockets) are computed on scrape. Every worker process keeps and serves its own metrics.
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from flask import current_app, g, request
+from sqlalchemy import func, select
+from app import db, socketio
+from app.instrumentation import authorized, observe_queries
+from app.models import Game
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)        # seconds
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)     # recipients of socket emit
+
+
+def format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = Lock()
+        self._values = {}       # label values tuple -> value
+
+    def __repr__(self):
+        return '<{} {} of {} series>'.format(self.__class__.__name__, self.name, len(self._values))
+
+    def exposition(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.kind)]
+        with self.lock:
+            series = sorted((labelvalues, self.copy_value(value)) for labelvalues, value in self._values.items())
+        for labelvalues, value in series:
+            lines.extend(self.series_lines(labelvalues, value))
+        return lines
+
+    def copy_value(self, value):
+        return value
+
+    def series_lines(self, labelvalues, value):
+        return ['{}{} {}'.format(self.name, format_labels(self.labelnames, labelvalues), format_value(value))]
+
+    def clear(self):
+        with self.lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labelvalues=(), amount=1):
+        with self.lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labelvalues=()):
+        bucket = bisect_left(self.buckets, value)       # first bucket with upper bound >= value (len(buckets) is +Inf)
+        with self.lock:
+            series = self._values.get(labelvalues)
+            if series is None:
+                series = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]       # bucket counts, sum, count
+            series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    def series_lines(self, labelvalues, value):
+        bucket_counts, total, count = value
+        lines = []
+        cumulative = 0
+        for upper_bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+            cumulative += bucket_count
+            lines.append('{}_bucket{} {}'.format(self.name, format_labels(self.labelnames, labelvalues, [('le', format_value(upper_bound))]), cumulative))
+        lines.append('{}_sum{} {}'.format(self.name, format_labels(self.labelnames, labelvalues), format_value(total)))
+        lines.append('{}_count{} {}'.format(self.name, format_labels(self.labelnames, labelvalues), count))
+        return lines
+
+    def copy_value(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+
+class Gauge(Metric):
+    # current value is read by collect function on scrape: collect() -> {label values tuple: value}
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.collect = collect
+
+    def exposition(self):
+        with self.lock:
+            self._values = dict(self.collect())
+        return Metric.exposition(self)
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def __repr__(self):
+        return '<Registry of {} metrics>'.format(len(self.metrics))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.exposition())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+
+def count_active_games():
+    return {(): db.session.execute(select(func.count(Game.id)).where(Game.finished.is_(None))).scalar()}
+
+
+def count_connected_sockets():
+    # sockets connected to this process by namespace (room None of socketio manager holds all sockets of namespace)
+    rooms = socketio.server.manager.rooms if socketio.server else {}
+    return {(namespace,): len(namespace_rooms.get(None, ())) for namespace, namespace_rooms in list(rooms.items())}
+
+
+registry = Registry()
+request_duration = registry.register(Histogram(
+    'nigels_http_request_duration_seconds', 'Api request latency by blueprint (user, room, game, hand, turn, general, app).',
+    ['blueprint', 'method', 'status']))
+request_db_duration = registry.register(Histogram(
+    'nigels_http_request_db_duration_seconds', 'Time spent in sql statements per api request by blueprint.', ['blueprint']))
+socket_emits = registry.register(Counter(
+    'nigels_socketio_emits_total', 'Socket.IO events emitted by this process.', ['namespace', 'event']))
+socket_fanout = registry.register(Histogram(
+    'nigels_socketio_emit_fanout', 'Sockets of this process receiving emitted Socket.IO event.', ['namespace', 'event'], FANOUT_BUCKETS))
+active_games = registry.register(Gauge(
+    'nigels_active_games', 'Started and not finished games.', collect=count_active_games))
+connected_sockets = registry.register(Gauge(
+    'nigels_connected_sockets', 'Sockets connected to this process by namespace.', ['namespace'], collect=count_connected_sockets))
+
+
+def count_emit(event_name, namespace, to=None):
+    # to is room (channel or sid) of emit, None for broadcast to whole namespace
+    if 'metrics' not in current_app.extensions:
+        return
+    rooms = socketio.server.manager.rooms.get(namespace, {}) if socketio.server else {}
+    socket_emits.inc((namespace, event_name))
+    socket_fanout.observe(len(rooms.get(to, ())), (namespace, event_name))
+
+
+def init_app(app, metrics_cfg):
+    token = metrics_cfg.get('TOKEN')
+    app.extensions['metrics'] = registry
+
+    def observe_query(statement, duration):
+        if 'metrics_db_time' in g:
+            g.metrics_db_time += duration
+
+    observe_queries(app, observe_query)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = perf_counter()
+        g.metrics_db_time = 0.0
+
+    @app.after_request
+    def observe_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        blueprint = request.blueprint or 'app'
+        request_duration.observe(perf_counter() - started, (blueprint, request.method, str(response.status_code)))
+        request_db_duration.observe(g.pop('metrics_db_time', 0.0), (blueprint,))
+        return response
+
+    def metrics():
+        if not authorized(token):
+            return current_app.response_class('Unauthorized\n', status=401, mimetype='text/plain')
+        return current_app.response_class(registry.exposition(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
@@ -1,12 +1,15 @@
 from datetime import datetime
-from app import db, login, app
+from app import db, login, cards
+from app.cache import ratings_cache, auth_cache, lobby_cache
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 # from itsdangerous import (TimedJSONWebSignatureSerializer as Serializer, BadSignature, SignatureExpired)
-from flask import url_for, jsonify
+from flask import url_for, jsonify, request, has_request_context, current_app
+from hashlib import sha256
 from time import time
 import jwt
-from sqlalchemy import text
+from sqlalchemy import text, select, insert, update, delete, func, case, and_, distinct, event, inspect
+from sqlalchemy.orm import Session, selectinload, make_transient_to_detached, object_session
 from config import get_settings, get_environment
 
 
@@ -90,18 +93,46 @@ class User(UserMixin, db.Model):
 
     @staticmethod
     def verify_auth_token(token):
-        # s = Serializer(auth['SECRET_KEY'][env])
-        try:
-            data = jwt.decode(token, auth['SECRET_KEY'][env], algorithms=['HS256'])
-        except jwt.ExpiredSignatureError:
-            return None
-        except jwt.InvalidIssuerError:
-            return None
-        except jwt.InvalidTokenError:
-            return None
-        user = User.query.filter_by(username=data['username']).first()
+        # resolved users are memoized per request and cached per process by token hash (see forget_user)
+        resolved = request.environ.setdefault('nigels.auth_users', {}) if has_request_context() else {}
+        if token in resolved:
+            return resolved[token]
+        token_hash = sha256(str(token).encode()).hexdigest()
+        identity = auth_cache.get(token_hash)
+        if identity is not None:
+            user = User.from_identity(identity)
+        else:
+            # s = Serializer(auth['SECRET_KEY'][env])
+            try:
+                data = jwt.decode(token, auth['SECRET_KEY'][env], algorithms=['HS256'])
+            except jwt.ExpiredSignatureError:
+                return None
+            except jwt.InvalidIssuerError:
+                return None
+            except jwt.InvalidTokenError:
+                return None
+            user = User.query.filter_by(username=data['username']).first()
+            if user:
+                auth_cache.set(token_hash, user.identity())
+        resolved[token] = user
         return user
 
+    def identity(self):
+        # column values of user, enough to restore it in any session without querying db
+        return dict((attr.key, getattr(self, attr.key)) for attr in inspect(User).column_attrs)
+
+    @staticmethod
+    def from_identity(identity):
+        user = User(**identity)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    @staticmethod
+    def forget_user(user_id):
+        for token_hash, identity in auth_cache.items():
+            if identity['id'] == user_id:
+                auth_cache.pop(token_hash)
+
     def get_reset_password_token(self, expires_in=600):
         new_token = jwt.encode(
             {'reset_password': self.id, 'exp': time() + expires_in},
@@ -163,7 +194,7 @@ class User(UserMixin, db.Model):
         total_score = 0
         bonuses = 0
         for entry in player_entries:
-            if app.debug:
+            if current_app.debug:
                 print('Building user stats: checking game #' + str(entry.game_id))
             game = Game.query.filter_by(id=entry.game_id).first()
             if game:
@@ -212,6 +243,15 @@ class User(UserMixin, db.Model):
         }
 
 
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def forget_changed_user(mapper, connection, target):
+    # cached identities of changed user are dropped once the change is committed
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_users', set()).add(target.id)
+
+
 @login.user_loader
 def load_user(id):
     return User.query.get(int(id))
@@ -224,6 +264,7 @@ class Room(db.Model):
     created = db.Column(db.DateTime, default=datetime.utcnow)
     games = db.relationship('Game', backref='room', lazy='dynamic')
     closed = db.Column(db.DateTime)
+    state_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     connected_users_bad = db.relationship(
         'User',
         secondary=connections,
@@ -236,12 +277,23 @@ class Room(db.Model):
 
     def connect(self, user):
         self.connected_users.append(user)
+        Room.advance_state_version(self.id)
         db.session.commit()
 
     def disconnect(self, user):
         self.connected_users.remove(user)
+        Room.advance_state_version(self.id)
         db.session.commit()
 
+    @staticmethod
+    def get_state_version(room_id):
+        return db.session.execute(select(Room.state_version).where(Room.id == room_id)).scalar()
+
+    @staticmethod
+    def advance_state_version(room_id):
+        # every committed change of room status (connections, readiness, games) increments its version (within caller's transaction)
+        db.session.execute(update(Room).where(Room.id == room_id).values(state_version=Room.state_version + 1))
+
     def is_connected(self, user):
         return self.connected_users.filter(
             connections.c.user_id == user.id).count() > 0
@@ -249,11 +301,13 @@ class Room(db.Model):
     def ready(self, user):
         sql = text("UPDATE connections SET ready = 1 WHERE room_id= " + str(self.id) + " AND user_id = " + str(user.id))
         db.session.execute(sql)
+        Room.advance_state_version(self.id)
         db.session.commit()
 
     def not_ready(self, user):
         sql = text("UPDATE connections SET ready = 0 WHERE room_id= " + str(self.id) + " AND user_id = " + str(user.id))
         db.session.execute(sql)
+        Room.advance_state_version(self.id)
         db.session.commit()
 
     def if_user_is_ready(self, user):
@@ -271,6 +325,31 @@ class Room(db.Model):
             return 'started'
         return 'open'
 
+    @staticmethod
+    def get_lobby(include_closed=False):
+        # lobby rows of all rooms (open only by default) with single grouped query
+        connected = select(connections.c.room_id, func.count(connections.c.user_id).label('connected_users')).group_by(connections.c.room_id).subquery()
+        open_games = select(Game.room_id, func.count(Game.id).label('open_games')).where(Game.finished.is_(None)).group_by(Game.room_id).subquery()
+        query = select(
+            Room.id, Room.room_name, Room.created, Room.closed, User.username,
+            func.coalesce(connected.c.connected_users, 0), func.coalesce(open_games.c.open_games, 0)
+        ).outerjoin(User, User.id == Room.user_id).outerjoin(
+            connected, connected.c.room_id == Room.id).outerjoin(open_games, open_games.c.room_id == Room.id).order_by(Room.id)
+        if not include_closed:
+            query = query.where(Room.closed.is_(None))
+        lobby = []
+        for room_id, room_name, created, closed, host, connected_users, open_games_count in db.session.execute(query):
+            lobby.append({
+                'roomId': room_id,
+                'roomName': room_name,
+                'host': host,
+                'status': 'closed' if closed else 'started' if open_games_count > 0 else 'open',
+                'created': created,
+                'closed': closed,
+                'connectedUsers': connected_users
+            })
+        return lobby
+
 
 class Game(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -279,7 +358,10 @@ class Game(db.Model):
     finished = db.Column(db.DateTime, nullable=True, default=None)
     winner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
     autodeal = db.Column(db.Integer, default=0)
+    state_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    seed = db.Column(db.BigInteger, nullable=True, default=None)      # deals and seating seed in seeded rng mode (see app.rng)
     hands = db.relationship('Hand', backref='game', lazy='dynamic')
+    scoreboard = db.relationship('GameScore', viewonly=True)
 
     def __repr__(self):
         return '<Game {}, room {}, started on {}>'.format(self.id, self.room_id, self.started)
@@ -287,6 +369,17 @@ class Game(db.Model):
     def connect(self, user):
         self.players.append(user)
 
+    @staticmethod
+    def get_state_version(game_id):
+        return db.session.execute(select(Game.state_version).where(Game.id == game_id)).scalar()
+
+    @staticmethod
+    def advance_state_version(game_id, steps=1):
+        # every committed change of game table state increments its version (within caller's transaction)
+        db.session.execute(update(Game).where(Game.id == game_id).values(state_version=Game.state_version + steps))
+        db.session.info.setdefault('advanced_games', set()).add(str(game_id))
+        return Game.get_state_version(game_id)
+
     def get_starter(self):
         player = Player.query.filter_by(game_id=self.id, position=1).first()
         return User.query.filter_by(id=player.user_id).first()
@@ -316,15 +409,34 @@ class Game(db.Model):
             all_games_played = True
         return all_games_played
 
-    def get_scores(self):
-        played_hands = Hand.query.filter_by(game_id=self.id).all()
-        players = self.players.all()
+    def finish(self, whole_room=False):
+        # closes game, defines winner by scoreboard and folds game results into players stats (committed by caller in one transaction)
+        # readiness of players (of every connected user with whole_room) is reset with a single room version step
+        scoreboard = GameScore.query.filter_by(game_id=self.id).order_by(GameScore.total_score.desc(), GameScore.player_id).all()
+        self.finished = datetime.utcnow()
+        self.winner_id = scoreboard[0].player_id if scoreboard else None
+        Stats.add_game_results(self, scoreboard)
+        if whole_room:
+            db.session.execute(connections.update().where(connections.c.room_id == self.room_id).values(ready=0))
+        else:
+            player_ids = [user.id for user in self.players]
+            if player_ids:
+                db.session.execute(connections.update().where(
+                    connections.c.room_id == self.room_id, connections.c.user_id.in_(player_ids)).values(ready=0))
+        Room.advance_state_version(self.room_id)
+
+    def get_scores(self, played_hands=None, players=None):
+        if played_hands is None:
+            played_hands = Hand.query.options(selectinload(Hand.scores)).filter_by(game_id=self.id).all()
+        if players is None:
+            players = self.players.all()
         headers = ['']
         rows = []
         total_score = {}
         data_array = [{}]
+        totals = {gs.player_id: gs.total_score for gs in self.scoreboard}
         for player in players:
-            total_score[player.username] = 0
+            total_score[player.username] = totals.get(player.id, 0)
             headers.append(str(player.username))
             data_array.append({
                 'type': 'scores subtitle'
@@ -339,8 +451,9 @@ class Game(db.Model):
                 'cards': str(hand.cards_per_player),
                 'trump': str(hand.trump) if hand.trump else 'x'
             }]
+            hand_scores = {hs.player_id: hs for hs in hand.scores}
             for player in players:
-                hand_score = HandScore.query.filter_by(hand_id=hand.id, player_id=player.id).first()
+                hand_score = hand_scores.get(player.id)
                 if hand_score:
                     data_array.append({
                         'type': 'score',
@@ -349,7 +462,6 @@ class Game(db.Model):
                         'bonus': hand_score.bonus,
                         'score': hand_score.score
                     })
-                    total_score[player.username] += hand_score.score if hand_score.score else 0
                 else:
                     data_array.append({
                         'type': 'score',
@@ -379,32 +491,26 @@ class Game(db.Model):
         }
 
     def get_user_score(self, user_id):
-        player_entry = Player.query.filter_by(game_id=self.id, user_id=user_id).first()
-        if not player_entry:
-            return None
-        played_hands = Hand.query.filter_by(game_id=self.id).all()
-        if not played_hands:
+        game_score = GameScore.query.filter_by(game_id=self.id, player_id=user_id).first()
+        if not game_score:
             return None
-        hands_played = len(played_hands)
-        sum_of_bets = 0
-        total_score = 0
-        bonuses = 0
-        for hand in played_hands:
-            hand_score = HandScore.query.filter_by(hand_id=hand.id, player_id=player_entry.user_id).first()
-            if hand_score:
-                if hand_score.bet_size:
-                    sum_of_bets += hand_score.bet_size
-                if hand_score.bonus:
-                    bonuses += 1
-                if hand_score.score:
-                    total_score += hand_score.score
         return {
-            'hands_played': hands_played,
-            'sum_of_bets': sum_of_bets,
-            'bonuses': bonuses,
-            'total_score': total_score
+            'hands_played': game_score.hands_played,
+            'sum_of_bets': game_score.sum_of_bets,
+            'bonuses': game_score.bonuses,
+            'total_score': game_score.total_score
         }
 
+    def rebuild_scores(self):
+        # recalculates scoreboard from scores of closed hands (backfill for games played before scoreboard existed)
+        GameScore.query.filter_by(game_id=self.id).delete()
+        closed_hands = Hand.query.options(selectinload(Hand.scores)).filter_by(game_id=self.id, is_closed=1).all()
+        player_ids = [player.user_id for player in Player.query.filter_by(game_id=self.id).all()]
+        scoreboard = {}
+        for hand in closed_hands:
+            GameScore.add_hand_scores(self.id, [hs for hs in hand.scores if hs.player_id in player_ids], scoreboard)
+        return list(scoreboard.values())
+
     def get_player_relative_positions(self, source_player_id, required_player_id):
         source_player = Player.query.filter_by(game_id=self.id, user_id=source_player_id).first()
         if not source_player:
@@ -423,23 +529,38 @@ class Player(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, primary_key=True)
     game_id = db.Column(db.Integer, nullable=False, index=True, primary_key=True)
     position = db.Column(db.Integer, nullable=True, default=None, index=True)
+    __table_args__ = (
+        db.Index('ix_player_game_position', 'game_id', 'position'),
+    )
 
     def __repr__(self):
         return '<Player {} on position {} in game {}>'.format(User.query.filter_by(id=self.user_id).first().username, self.position, self.game_id)
 
 
 class Hand(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    game_id = db.Column(db.Integer, db.ForeignKey('game.id'), nullable=False, index=True, primary_key=True)
-    serial_no = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'), nullable=False, index=True)
+    serial_no = db.Column(db.Integer, nullable=False)
     trump = db.Column(db.String(1), nullable=True)
     cards_per_player = db.Column(db.Integer, nullable=True)
     starting_player = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     is_closed = db.Column(db.Integer, nullable=False, default=0)
+    scores = db.relationship('HandScore', viewonly=True)
+    dealt_cards = db.relationship('DealtCards', viewonly=True, order_by='DealtCards.id')
+    turns = db.relationship('Turn', viewonly=True, order_by='Turn.serial_no')
+    __table_args__ = (
+        db.UniqueConstraint('game_id', 'serial_no', name='uq_hand_game_serial_no'),      # concurrent deals of the same hand collide here
+    )
 
     def __repr__(self):
         return '<Hand {} (hand #{} in game {}): {}{}, starter {}>'.format(self.id, self.serial_no, self.game_id, self.trump if self.trump is not None else '-', self.cards_per_player, self.get_starter().username)
 
+    @staticmethod
+    def is_serial_no_conflict(error):
+        # IntegrityError of uq_hand_game_serial_no: constraint is named by postgres and mysql, sqlite lists its columns
+        message = str(error.orig)
+        return 'uq_hand_game_serial_no' in message or 'UNIQUE constraint failed: hand.game_id, hand.serial_no' in message
+
     def get_starter(self):
         return User.query.filter_by(id=self.starting_player).first()
 
@@ -459,61 +580,16 @@ class Hand(db.Model):
         else:
             return None
 
-    def get_user_initial_hand(self, user, trump=None):
-        possible_suits_ordered = ['s', 'c', 'h', 'd']
-        if trump:
-            if app.debug:
-                print('updating possible suits regarding trump (' + str(trump) + ')')
-            possible_suits_ordered.remove(trump)
-            possible_suits_ordered.append(trump)
-        if app.debug:
-            print(possible_suits_ordered)
-        initial_hand = []
-        for suit in possible_suits_ordered:
-            suit_cards = list()
-            player_cards_suited = DealtCards.query.filter_by(hand_id=self.id, player_id=user.id, card_suit=suit).all()
-            for card in player_cards_suited:
-                if card.card_id == 'j':
-                    if card.card_suit == trump:
-                        card_index = 14
-                    else:
-                        card_index=11
-                elif card.card_id == 'q':
-                    if card.card_suit == trump:
-                        card_index = 10
-                    else:
-                        card_index = 12
-                elif card.card_id == 'k':
-                    if card.card_suit == trump:
-                        card_index = 11
-                    else:
-                        card_index = 13
-                elif card.card_id == 'a':
-                    if card.card_suit == trump:
-                        card_index = 12
-                    else:
-                        card_index = 14
-                elif card.card_id == 't':
-                    if card.card_suit == trump:
-                        card_index = 9
-                    else:
-                        card_index = 10
-                elif card.card_id == '9':
-                    if card.card_suit == trump:
-                        card_index = 13
-                    else:
-                        card_index = 9
-                else:
-                    card_index = int(card.card_id)
-
-                suit_cards.append({
-                    'card_index': card_index,
-                    'card': str(card.card_id) + card.card_suit
-                })
-            for card in sorted(suit_cards, key=lambda c: c['card_index']):
-                initial_hand.append(card['card'])
+    def get_seats(self):
+        # position in hand (as in get_player_by_pos) -> user id, resolved with single query
+        game_positions = dict((position, user_id) for user_id, position in db.session.query(Player.user_id, Player.position).filter(Player.game_id == self.game_id))
+        players_count = len(game_positions)
+        return dict((position, game_positions.get(players_count - ((position - self.serial_no) % players_count))) for position in range(1, players_count + 1))
 
-        return initial_hand
+    def get_user_initial_hand(self, user, trump=None):
+        dealt_cards = DealtCards.query.filter_by(hand_id=self.id, player_id=user.id).all()
+        initial_hand = cards.sort_cards([cards.encode(str(dc.card_id) + dc.card_suit) for dc in dealt_cards], cards.trump_index(trump))
+        return [cards.decode(card) for card in initial_hand]
 
     def get_user_current_hand(self, user, trump=None):
         initial_cards = self.get_user_initial_hand(user, trump)
@@ -593,7 +669,7 @@ class Hand(db.Model):
         for hand_turn in hand_turns:
             if hand_turn.took_user_id is not None:
                 finished_hand_turns =+ 1
-        if app.debug:
+        if current_app.debug:
             print('Hand turns: ' + str(hand_turns))
             print('Finished hand turns: ' + str(finished_hand_turns))
             print('All turns are made? - ' + str(finished_hand_turns >= self.cards_per_player))
@@ -642,22 +718,22 @@ class Hand(db.Model):
         game_players_cnt = Player.query.filter_by(game_id=self.game_id).count()
         if game_players_cnt == 0:
             # Error: no players in the game
-            if app.debug:
+            if current_app.debug:
                 print('no players in the game')
             return None
 
         # if bets are not made in hand position shift is defined with made bets
         if hand_made_bets == 0:
-            if app.debug:
+            if current_app.debug:
                 print('No bets are made in hand: shift is defined with played hands')
             position_shift = played_hands
         elif hand_made_bets != game_players_cnt:
-            if app.debug:
+            if current_app.debug:
                 print('Bets are not made in hand: shift is defined with both made bets and played hands')
             position_shift = hand_made_bets + played_hands
         # if bets are made in hand position shift is defined with put cards in turn
         else:
-            if app.debug:
+            if current_app.debug:
                 print('Bets are made in hand: shift is defined with put cards in turn and/or last turn taker')
             turns_in_hand = Turn.query.filter_by(hand_id=self.id).all()
             finished_turns_in_hand = 0
@@ -665,21 +741,21 @@ class Hand(db.Model):
                 if turn_in_hand.took_user_id:
                     finished_turns_in_hand = + 1
             if finished_turns_in_hand == 0:
-                if app.debug:
+                if current_app.debug:
                     print('This is first turn in hand: position shift is defined with put cards and played hands')
                 position_shift = turn_put_cards + played_hands
             else:
-                if app.debug:
+                if current_app.debug:
                     print('This is NOT first turn in game: position shift is defined with put cards, starter position is last turn taker position')
                 last_turn = self.get_last_turn()
                 if not last_turn:
-                    if app.debug:
+                    if current_app.debug:
                         print('Something went wrong: last turn not found but should be...')
                     return None
                 last_turn_taker = User.query.filter_by(id=last_turn.took_user_id).first()
                 source_position_player = Player.query.filter_by(game_id=self.game_id, user_id=last_turn_taker.id).first()
                 if not source_position_player:
-                    if app.debug:
+                    if current_app.debug:
                         print('Something went wrong: last turn taker position not found but should be...')
                     return None
                 source_position = source_position_player.position
@@ -689,7 +765,7 @@ class Hand(db.Model):
         shifted_position = (source_position + position_shift) % game_players_cnt
         if shifted_position == 0:
             shifted_position = game_players_cnt
-        if app.debug:
+        if current_app.debug:
             print('position_shift: ' + str(position_shift))
             print('source_position: ' + str(source_position))
             print(' player "' + str(User.query.filter_by(id=Player.query.filter_by(position=source_position, game_id=self.game_id).first().user_id).first().username) + '")')
@@ -698,7 +774,7 @@ class Hand(db.Model):
         next_player = Player.query.filter_by(game_id=self.game_id, position=shifted_position).first()
         if not next_player:
             # Error: player at calculated position not found
-            if app.debug:
+            if current_app.debug:
                 print('player at calculated position (' + str(shifted_position) + ') not found')
             return None
         return User.query.filter_by(id=next_player.user_id).first()
@@ -707,16 +783,16 @@ class Hand(db.Model):
     def next_card_putting_user(self):
         curr_turn = self.get_current_turn()
         last_turn = self.get_last_turn()
-        if app.debug:
+        if current_app.debug:
             print('Current turn is ' + str(curr_turn))
             print('Last turn is ' + str(last_turn))
         if last_turn and curr_turn:         # This is ongoing and not last turn
-            if app.debug:
+            if current_app.debug:
                 print('This is ongoing and not last turn')
             turn_players_sorted = self.get_players_relative_positions()
             for turn_player in turn_players_sorted:
                 player_card = TurnCard.query.filter_by(turn_id=curr_turn.id, player_id=turn_player['player_id']).first()
-                if app.debug:
+                if current_app.debug:
                     card_string = 'no card'
                     if player_card:
                         card_string = 'card "' + str(player_card.card_id) + str(player_card.card_suit) + '"'
@@ -725,27 +801,27 @@ class Hand(db.Model):
                     return User.query.filter_by(id=turn_player['player_id']).first()
             return User.query.filter_by(id=last_turn.took_user_id).first()
         elif curr_turn:                     # if this is first turn in hand
-            if app.debug:
+            if current_app.debug:
                 print('This is first ongoing turn in hand')
             turn_players_sorted = self.get_players_relative_positions()
-            if app.debug:
+            if current_app.debug:
                 print("Players' cards in turn:")
             for turn_player in turn_players_sorted:
                 player_card = TurnCard.query.filter_by(turn_id=curr_turn.id, player_id=turn_player['player_id']).first()
-                if app.debug:
+                if current_app.debug:
                     card_string = 'no card'
                     if player_card:
                         card_string = 'card "' + str(player_card.card_id) + str(player_card.card_suit) + '"'
                     print('Player "' + str(User.query.filter_by(id=turn_player['player_id']).first().username) + '" on position #' + str(turn_player['turn_position'] + 1) + ' has ' + card_string)
-                if app.debug:
+                if current_app.debug:
                     print(str(player_card))
                 if not player_card:
                     return User.query.filter_by(id=turn_player['player_id']).first()
         elif last_turn:                     # if this is last turn in hand
-            if app.debug:
+            if current_app.debug:
                 print('Now starting new turn in hand (last turn #' + str(last_turn.id) + ' was taken by player with #' + str(last_turn.took_user_id) + ')')
             return User.query.filter_by(id=last_turn.took_user_id).first()
-        if app.debug:
+        if current_app.debug:
             print('This is first turn of hand')
         return self.get_starter()           # if this is first turn of whole game
 
@@ -758,7 +834,7 @@ class Hand(db.Model):
         last_turn_took_player_pos = 0
         if last_turn:
             last_turn_took_player_pos = self.get_position(User.query.filter_by(id=last_turn.took_user_id).first())
-        if app.debug:
+        if current_app.debug:
             print("Players' unsorted positions: ")
         for player in game_players:
             if last_turn:
@@ -767,15 +843,15 @@ class Hand(db.Model):
             else:
                 turn_position = self.get_position(User.query.filter_by(id=player.user_id).first())
             turn_players.append({'turn_position': turn_position, 'player_id': player.user_id})
-            if app.debug:
+            if current_app.debug:
                 print('Player "' + str(
                     User.query.filter_by(id=player.user_id).first().username) + "'s position is " + str(turn_position))
-        if app.debug:
+        if current_app.debug:
             print("Players' sorted positions in turn #" + str(self.id) + ":")
         if len(turn_players) == 0:
             return []
         result = sorted(turn_players, key = lambda tp: tp['turn_position'])
-        if app.debug:
+        if current_app.debug:
             print(result)
         if user_id:
             for player in result:
@@ -790,6 +866,9 @@ class DealtCards(db.Model):
     player_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     card_id = db.Column(db.String(1), nullable=False)
     card_suit = db.Column(db.String(1), nullable=False)
+    __table_args__ = (
+        db.Index('ix_dealt_cards_hand_player_suit', 'hand_id', 'player_id', 'card_suit'),
+    )
 
     def __repr__(self):
         return '<Card {} dealt to player {} in hand {}>'.format(self.card_id, User.query.filter_by(id=self.player_id).first().username, self.hand_id)
@@ -802,6 +881,9 @@ class HandScore(db.Model):
     player_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     score = db.Column(db.Integer, default=None)
     bonus = db.Column(db.Integer, default=None)
+    __table_args__ = (
+        db.Index('ix_hand_score_hand_player', 'hand_id', 'player_id', unique=True),      # one bet per player in hand
+    )
 
     def __repr__(self):
         return "<Player {}'s score in hand {}>".format(User.query.filter_by(id=self.player_id).first().username, self.hand_id)
@@ -827,6 +909,11 @@ class Turn(db.Model):
     hand_id = db.Column(db.Integer, db.ForeignKey('hand.id'), nullable=False)
     serial_no = db.Column(db.Integer)
     took_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    cards = db.relationship('TurnCard', viewonly=True, order_by='TurnCard.id')
+    __table_args__ = (
+        db.Index('ix_turn_hand_serial_no', 'hand_id', 'serial_no', unique=True),
+        db.Index('ix_turn_hand_took_user', 'hand_id', 'took_user_id'),
+    )
 
     def get_starting_suit(self):
         first_card = TurnCard.query.filter_by(turn_id=self.id).order_by(TurnCard.id).first()
@@ -842,38 +929,14 @@ class Turn(db.Model):
 
     def highest_card(self):
         turn_cards = TurnCard.query.filter_by(turn_id=self.id).order_by(TurnCard.id).all()
-        turn_suit = self.get_starting_suit()
         trump = Hand.query.filter_by(id=self.hand_id).first().trump
-        if trump:
-            trump = trump.casefold()
-        highest_card = {}
-        cards_hierarchy = ['2', '3', '4', '5', '6', '7', '8', '9', 't', 'j', 'q', 'k', 'a']
-        trump_hierarchy = ['2', '3', '4', '5', '6', '7', '8', 't', 'q', 'k', 'a', '9', 'j']
-        for card in turn_cards:
-            if not highest_card:
-                # if card is first to be checked it becomes highest automatically
-                if app.debug:
-                    print(str(card) + ' is first to analyze - it becomes highest')
-                highest_card['id'] = card.card_id.casefold()
-                highest_card['suit'] = card.card_suit.casefold()
-            else:
-                card_suit = str(card.card_suit).casefold()
-                card_score = str(card.card_id).casefold()
-                if card_suit == trump:
-                    if highest_card['suit'] != trump or trump_hierarchy.index(str(highest_card['id'])) < trump_hierarchy.index(str(card_score)):
-                        if app.debug:
-                            print(str(card) + ' is trump and is higher than ' + str(highest_card['id']) + str(highest_card['suit']))
-                        highest_card['id'] = card_score
-                        highest_card['suit'] = card_suit
-                elif turn_suit == card_suit and cards_hierarchy.index(str(highest_card['id'])) < cards_hierarchy.index(card_score) and highest_card['suit'] != trump:
-                    # if card is in the same suit with turn and is higher than the highest card within analyzed it becomes highest in turn within analyzed
-                    if app.debug:
-                        print(str(card) + ' is same suit as turn starting card and is higher than ' + str(highest_card['id']) + str(highest_card['suit']))
-                    highest_card['id'] = card_score
-                    highest_card['suit'] = card_suit
-            if app.debug:
-                print('Highest turn card within analyzed ones is ' + str(highest_card))
-        return highest_card
+        highest_card = cards.highest([cards.encode(str(tc.card_id) + tc.card_suit) for tc in turn_cards], cards.trump_index(trump))
+        if highest_card is None:
+            return {}
+        return {
+            'id': cards.grade(highest_card),
+            'suit': cards.suit(highest_card)
+        }
 
     def __repr__(self):
         return "<Turn #{} in hand {}>".format(self.serial_no, self.hand_id)
@@ -886,6 +949,10 @@ class TurnCard(db.Model):
     card_id = db.Column(db.String(1), nullable=False)
     card_suit = db.Column(db.String(1), nullable=False)
     player_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    __table_args__ = (
+        db.Index('ix_turn_card_turn_player', 'turn_id', 'player_id', unique=True),      # one card per player in turn, also serves turn_id lookups
+        db.Index('ix_turn_card_hand_player', 'hand_id', 'player_id'),
+    )
 
     def __repr__(self):
         return "<Card {}{} in hand {} put by player {}>".format(self.card_id, self.card_suit, self.hand_id, User.query.filter_by(id=self.player_id).first().username)
@@ -906,4 +973,126 @@ class Stats(db.Model):
     games_won = db.Column(db.Integer, default=None)
     total_score = db.Column(db.Integer, default=None)
     sum_of_bets = db.Column(db.Integer, default=0)
-    bonuses = db.Column(db.Integer, default=0)
\ No newline at end of file
+    bonuses = db.Column(db.Integer, default=0)
+
+    @staticmethod
+    def add_game_results(game, scoreboard):
+        # folds scoreboard of finished game into players stats (once per game, on game finishing)
+        player_ids = [gs.player_id for gs in scoreboard]
+        stats = {s.user_id: s for s in Stats.query.filter(Stats.user_id.in_(player_ids)).all()} if player_ids else {}
+        for gs in scoreboard:
+            s = stats.get(gs.player_id)
+            if not s:
+                s = Stats(user_id=gs.player_id, games_played=0, games_won=0, sum_of_bets=0, bonuses=0, total_score=0)
+                db.session.add(s)
+            s.games_played = (s.games_played or 0) + 1
+            s.games_won = (s.games_won or 0) + (1 if gs.player_id == game.winner_id else 0)
+            s.sum_of_bets = (s.sum_of_bets or 0) + gs.sum_of_bets
+            s.bonuses = (s.bonuses or 0) + gs.bonuses
+            s.total_score = (s.total_score or 0) + gs.total_score
+        db.session.info['ratings_changed'] = True
+
+    @staticmethod
+    def rebuild():
+        # recalculates stats of all users from hand scores of finished games in one set based statement
+        game_won = case((Game.winner_id == HandScore.player_id, Game.id), else_=None)
+        history = select(
+            HandScore.player_id,
+            func.count(distinct(Game.id)),
+            func.count(distinct(game_won)),
+            func.coalesce(func.sum(HandScore.score), 0),
+            func.coalesce(func.sum(HandScore.bet_size), 0),
+            func.coalesce(func.sum(HandScore.bonus), 0)
+        ).select_from(HandScore).join(
+            Hand, Hand.id == HandScore.hand_id
+        ).join(
+            Game, Game.id == Hand.game_id
+        ).join(
+            Player, and_(Player.game_id == Game.id, Player.user_id == HandScore.player_id)
+        ).where(
+            Game.finished.isnot(None), Game.winner_id.isnot(None), Hand.is_closed == 1
+        ).group_by(HandScore.player_id)
+        db.session.execute(delete(Stats))
+        db.session.execute(insert(Stats).from_select(
+            ['user_id', 'games_played', 'games_won', 'total_score', 'sum_of_bets', 'bonuses'], history))
+        db.session.info['ratings_changed'] = True
+
+
+class GameScore(db.Model):
+    # scoreboard of game: player totals over closed hands, updated on every hand closing
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'), primary_key=True)
+    player_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    hands_played = db.Column(db.Integer, nullable=False, default=0)
+    sum_of_bets = db.Column(db.Integer, nullable=False, default=0)
+    bonuses = db.Column(db.Integer, nullable=False, default=0)
+    total_score = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<Player {}'s score in game {}>".format(self.player_id, self.game_id)
+
+    @staticmethod
+    def add_hand_scores(game_id, hand_scores, scoreboard=None):
+        # adds scores of closed hand to game scoreboard (scoreboard dict caches player_id -> GameScore entries)
+        if scoreboard is None:
+            scoreboard = {gs.player_id: gs for gs in GameScore.query.filter_by(game_id=game_id).all()}
+        for hs in hand_scores:
+            gs = scoreboard.get(hs.player_id)
+            if not gs:
+                gs = GameScore(game_id=game_id, player_id=hs.player_id, hands_played=0, sum_of_bets=0, bonuses=0, total_score=0)
+                db.session.add(gs)
+                scoreboard[hs.player_id] = gs
+            gs.hands_played += 1
+            gs.sum_of_bets += hs.bet_size or 0
+            gs.bonuses += 1 if hs.bonus else 0
+            gs.total_score += hs.score or 0
+        return scoreboard
+
+
+@event.listens_for(Room, 'after_insert')
+@event.listens_for(Room, 'after_update')
+@event.listens_for(Room, 'after_delete')
+@event.listens_for(Game, 'after_insert')
+@event.listens_for(Game, 'after_update')
+@event.listens_for(Game, 'after_delete')
+def mark_lobby_changed(mapper, connection, target):
+    # connections, start and finish of games change the lobby: cached lobby is dropped once the change is committed
+    session = object_session(target)
+    if session is not None:
+        session.info['lobby_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def drop_changed_lobby(session):
+    if session.info.pop('lobby_changed', False):
+        lobby_cache.clear()
+
+
+@event.listens_for(Session, 'after_commit')
+def drop_changed_users(session):
+    for user_id in session.info.pop('changed_users', ()):
+        User.forget_user(user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def drop_changed_ratings(session):
+    if session.info.pop('ratings_changed', False):
+        ratings_cache.clear()
+
+
+@event.listens_for(Session, 'after_commit')
+def wake_game_waiters(session):
+    # long-poll requests parked on advanced games are woken once the new state version is committed
+    advanced_games = session.info.pop('advanced_games', None)
+    if advanced_games:
+        from app.game_changes import game_changes       # imports models
+        game_changes.notify(advanced_games)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_rolled_back_changes(session):
+    session.info.pop('lobby_changed', None)
+    session.info.pop('advanced_games', None)
+    session.info.pop('ratings_changed', None)
+    # identities of changed users could be cached from the rolled back transaction
+    for user_id in session.info.pop('changed_users', ()):
+        User.forget_user(user_id)
@@ -0,0 +1,132 @@
+# Opt-in sql instrumentation of api requests (PROFILING section of config.yml, see README).
+# Statements are timed by engine cursor events shared with metrics (see instrumentation) and attributed to the request
+# being served: every response gets X-Query-Count and Server-Timing headers, per-endpoint totals with slowest statements
+# are kept in process memory, served by GET <API_BASE_PATH>/profiling and dropped by POST <API_BASE_PATH>/profiling/reset.
+from threading import Lock
+from time import perf_counter
+from flask import current_app, g, jsonify, request
+from app.instrumentation import authorized, observe_queries
+from config import get_settings, get_environment
+
+SLOW_QUERY_MS = 100         # slower statements are logged
+SLOWEST_QUERIES = 5         # slowest statements kept per endpoint
+STATEMENT_LENGTH = 300      # symbols of statement kept in report
+
+
+class RequestProfile(object):
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0      # seconds
+        self.slowest = []       # (duration, statement) tuples
+
+    def __repr__(self):
+        return '<RequestProfile of {} queries ({:.1f} ms)>'.format(self.queries, self.db_time * 1000)
+
+
+class EndpointProfiles(object):
+    # per-endpoint totals of this process
+
+    def __init__(self, slowest_count=SLOWEST_QUERIES):
+        self.slowest_count = slowest_count
+        self.lock = Lock()
+        self._endpoints = {}
+
+    def __repr__(self):
+        return '<EndpointProfiles of {} endpoints>'.format(len(self._endpoints))
+
+    def add(self, endpoint, profile, request_time):
+        with self.lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {
+                    'requests': 0, 'queries': 0, 'maxQueries': 0, 'dbTime': 0.0, 'requestTime': 0.0, 'slowest': []
+                }
+            stats['requests'] += 1
+            stats['queries'] += profile.queries
+            stats['maxQueries'] = max(stats['maxQueries'], profile.queries)
+            stats['dbTime'] += profile.db_time
+            stats['requestTime'] += request_time
+            stats['slowest'] = sorted(stats['slowest'] + profile.slowest, key=lambda query: -query[0])[:self.slowest_count]
+
+    def report(self):
+        # endpoints sorted by total db time, times in milliseconds
+        with self.lock:
+            endpoints = [(endpoint, dict(stats)) for endpoint, stats in self._endpoints.items()]
+        report = []
+        for endpoint, stats in sorted(endpoints, key=lambda item: -item[1]['dbTime']):
+            report.append({
+                'endpoint': endpoint,
+                'requests': stats['requests'],
+                'queriesPerRequest': round(stats['queries'] / stats['requests'], 1),
+                'maxQueries': stats['maxQueries'],
+                'dbTimePerRequest': round(stats['dbTime'] * 1000 / stats['requests'], 2),
+                'requestTimePerRequest': round(stats['requestTime'] * 1000 / stats['requests'], 2),
+                'slowestQueries': [{'duration': round(duration * 1000, 2), 'statement': statement} for duration, statement in stats['slowest']]
+            })
+        return report
+
+    def clear(self):
+        with self.lock:
+            self._endpoints.clear()
+
+
+def init_app(app, profiling_cfg):
+    slow_query = profiling_cfg.get('SLOW_QUERY_MS', SLOW_QUERY_MS) / 1000
+    profiles = EndpointProfiles(profiling_cfg.get('SLOWEST_QUERIES', SLOWEST_QUERIES))
+    app.extensions['profiling'] = profiles
+
+    def observe_query(statement, duration):
+        if 'profile' not in g:
+            return
+        profile = g.profile
+        profile.queries += 1
+        profile.db_time += duration
+        if len(profile.slowest) < profiles.slowest_count or duration > profile.slowest[-1][0]:
+            profile.slowest = sorted(profile.slowest + [(duration, statement[:STATEMENT_LENGTH])], key=lambda query: -query[0])[:profiles.slowest_count]
+        if duration >= slow_query:
+            current_app.logger.warning('Slow query ({:.1f} ms) in {} {}: {}'.format(duration * 1000, request.method, request.path, statement[:STATEMENT_LENGTH]))
+
+    observe_queries(app, observe_query)
+
+    @app.before_request
+    def start_profile():
+        g.profile = RequestProfile()
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        request_time = perf_counter() - profile.started
+        response.headers['X-Query-Count'] = str(profile.queries)
+        response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries"'.format(profile.db_time * 1000, profile.queries))
+        response.headers.add('Server-Timing', 'app;dur={:.2f}'.format(request_time * 1000))
+        if request.url_rule is not None and request.endpoint not in ('profiling', 'profiling_reset'):
+            profiles.add('{} {}'.format(request.method, request.url_rule.rule), profile, request_time)
+        return response
+
+    base_path = get_settings('API_BASE_PATH')[get_environment()]
+    app.add_url_rule('{base_path}/profiling'.format(base_path=base_path), 'profiling', profiling_report, methods=['GET'])
+    app.add_url_rule('{base_path}/profiling/reset'.format(base_path=base_path), 'profiling_reset', profiling_reset, methods=['POST'])
+
+
+def profiling_report():
+    # per-endpoint sql profile of this process
+    if not authorized(current_app.config['PROFILING'].get('TOKEN')):
+        return jsonify({'errors': [{'message': 'Profiling report requires valid bearer token!'}]}), 401
+    return jsonify({'endpoints': current_app.extensions['profiling'].report()}), 200
+
+
+def profiling_reset():
+    # drops collected profile of this process, returns it for the last time
+    token = current_app.config['PROFILING'].get('TOKEN')
+    if not token:
+        return jsonify({'errors': [{'message': 'Profiling reset requires TOKEN in PROFILING section of config!'}]}), 403
+    if not authorized(token):
+        return jsonify({'errors': [{'message': 'Profiling reset requires valid bearer token!'}]}), 401
+    profiles = current_app.extensions['profiling']
+    report = profiles.report()
+    profiles.clear()
+    return jsonify({'endpoints': report}), 200
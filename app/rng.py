@@ -0,0 +1,41 @@
+# Deck and seat shuffling.
+# GAME RNG setting of config.yml selects the mode:
+#   system (default) - cryptographically strong os randomness, games cannot be replayed
+#   seeded - every game gets a seed (game.seed), its deals and seating are derived from the seed, so a recorded
+#            game can be re-simulated exactly; with GAME RNG_SEED game seeds are deterministic as well (benchmarks, load tests)
+# Every shuffle uses its own generator, no random state is shared between requests (greenlets).
+import random
+import secrets
+from hashlib import sha256
+from config import settings
+
+SYSTEM = 'system'
+SEEDED = 'seeded'
+
+_system_random = random.SystemRandom()
+
+
+def rng_mode():
+    return settings().GAME.get('RNG', SYSTEM)
+
+
+def derive_seed(*parts):
+    # stable 63-bit seed (fits signed bigint column) for any sequence of seed parts
+    digest = sha256(':'.join(str(part) for part in parts).encode()).digest()
+    return int.from_bytes(digest[:8], 'big') >> 1
+
+
+def new_game_seed(game_id):
+    if rng_mode() != SEEDED:
+        return None
+    base_seed = settings().GAME.get('RNG_SEED')
+    if base_seed is None:
+        return secrets.randbits(63)
+    return derive_seed(base_seed, 'game', game_id)
+
+
+def game_random(seed, *stream):
+    # generator for one shuffle of the game, stream names its purpose, e.g. game_random(game.seed, 'deck', serial_no)
+    if seed is None:
+        return _system_random
+    return random.Random(derive_seed(seed, *stream))
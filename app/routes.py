@@ -3,7 +3,7 @@
 from flask import render_template, flash, redirect, url_for, request
 from flask_login import login_user, logout_user, current_user
 from werkzeug.urls import url_parse
-from app import app, db
+from app import db
 from app.forms import LoginForm, RegistrationForm
 from app.models import User
 from app.social_login import OAuthSignIn
@@ -16,22 +16,10 @@ from resources.turn import turn
 from resources.general import general
 
 
-# announcing api resources
-app.register_blueprint(user)
-app.register_blueprint(game)
-app.register_blueprint(room)
-app.register_blueprint(hand)
-app.register_blueprint(turn)
-app.register_blueprint(general)
-
-
-@app.route('/', methods=['GET'])
-@app.route('/index', methods=['GET'])
 def index():
     return 'This is Nigels App Service Home! Work In Progress!'
 
 
-@app.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -52,7 +40,6 @@ def register():
     return render_template('register.html', title='Register', form=form)
 
 
-@app.before_request
 def before_request():
     if current_user.is_authenticated:
         current_user.last_seen = datetime.utcnow()
@@ -60,7 +47,6 @@ def before_request():
 
 
 # social login oauth
-@app.route('/authorize/<provider>')
 def oauth_authorize(provider):
     if not current_user.is_anonymous:
         return redirect(url_for('index'))
@@ -69,7 +55,6 @@ def oauth_authorize(provider):
 
 
 # social login callback oauth
-@app.route('/callback/<provider>')
 def oauth_callback(provider):
     if not current_user.is_anonymous:
         return redirect(url_for('index'))
@@ -92,7 +77,6 @@ def oauth_callback(provider):
     return redirect(url_for('index'))
 
 
-@app.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -110,7 +94,25 @@ def login():
     return render_template('login.html', title='Sign In', form=form)
 
 
-@app.route('/logout')
 def logout():
     logout_user()
     return redirect(url_for('index'))
+
+
+def init_app(app):
+    # announcing api resources
+    app.register_blueprint(user)
+    app.register_blueprint(game)
+    app.register_blueprint(room)
+    app.register_blueprint(hand)
+    app.register_blueprint(turn)
+    app.register_blueprint(general)
+
+    app.add_url_rule('/', 'index', index, methods=['GET'])
+    app.add_url_rule('/index', 'index', index, methods=['GET'])
+    app.add_url_rule('/register', 'register', register, methods=['GET', 'POST'])
+    app.before_request(before_request)
+    app.add_url_rule('/authorize/<provider>', 'oauth_authorize', oauth_authorize)
+    app.add_url_rule('/callback/<provider>', 'oauth_callback', oauth_callback)
+    app.add_url_rule('/login', 'login', login, methods=['GET', 'POST'])
+    app.add_url_rule('/logout', 'logout', logout)
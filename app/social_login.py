@@ -1,7 +1,7 @@
 from flask import url_for, redirect, request
 from rauth import OAuth2Service
 import json
-from config import get_settings, get_environment
+from config import settings
 
 
 class OAuthSignIn(object):
@@ -9,7 +9,7 @@ class OAuthSignIn(object):
 
     def __init__(self, provider_name):
         self.provider_name = provider_name
-        credentials = get_settings('AUTH')[get_environment()]['OAUTH_CREDENTIALS'][provider_name]
+        credentials = settings().AUTH['OAUTH_CREDENTIALS'][provider_name]
         self.consumer_id = credentials['ID']
         self.consumer_secret = credentials['SECRET']
 
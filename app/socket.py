@@ -1,17 +1,154 @@
-from app import socketio, app
-from flask_socketio import emit #, join_room, leave_room
+from flask import request, current_app
+from app import socketio
+from app.models import User, Room, Game
+from app.metrics import count_emit
+from app.channels import user_channel, change_user_channel, ENTER_CHANNEL, LEAVE_CHANNEL
+from flask_socketio import emit as socket_emit, join_room, leave_room
+
+
+def room_channel(room_id):
+    return 'room-{}'.format(room_id)
+
+
+def game_channel(game_id):
+    return 'game-{}'.format(game_id)
+
+
+def emit(event, *args, **kwargs):
+    # flask_socketio emit of socket handlers, counted with its fan-out in socket metrics
+    to = kwargs.get('to') or kwargs.get('room')
+    if to is None and not kwargs.get('broadcast'):
+        to = request.sid        # reply to sender only
+    count_emit(event, kwargs.get('namespace', request.namespace), to)
+    socket_emit(event, *args, **kwargs)
+
+
+def register_socket(auth):
+    # sockets pass {'token': ...} as auth on connection, sockets of authenticated user join user channel
+    token = auth.get('token') if isinstance(auth, dict) else None
+    user = User.verify_auth_token(token) if token else None
+    if user:
+        join_room(user_channel(user.id))
+    return user
+
+
+def enter_channel(user_id, channel, namespace):
+    # subscribes sockets of user connected to any worker (called from REST handlers)
+    change_user_channel(socketio.server.manager, ENTER_CHANNEL, user_id, channel, namespace)
+
+
+def exit_channel(user_id, channel, namespace):
+    change_user_channel(socketio.server.manager, LEAVE_CHANNEL, user_id, channel, namespace)
+
+
+def join_room_channel(user_id, room_id):
+    enter_channel(user_id, room_channel(room_id), '/room')
+
+
+def leave_room_channel(user_id, room_id):
+    exit_channel(user_id, room_channel(room_id), '/room')
+
+
+def join_game_channel(user_id, game_id):
+    enter_channel(user_id, game_channel(game_id), '/game')
+
+
+def close_room_channels(room_id, game_ids):
+    socketio.close_room(room_channel(room_id), namespace='/room')
+    for game_id in game_ids:
+        socketio.close_room(game_channel(game_id), namespace='/game')
+
+
+def publish_game_event(game_id, event, version=None, **delta):
+    # authoritative game state change, emitted by REST handlers after commit to the game table subscribers
+    # version is game state version after the change: client applies deltas in order and resyncs on a gap
+    payload = {'eventCategory': 'game', 'event': event, 'gameId': int(game_id), 'version': version, 'source': 'server'}
+    payload.update(delta)
+    count_emit('refresh_game_table', '/game', game_channel(game_id))
+    socketio.emit('refresh_game_table', payload, namespace='/game', to=game_channel(game_id))
+
+
+def publish_room_event(room_id, socket_event, event, **delta):
+    payload = {'eventCategory': 'game', 'event': event, 'roomId': int(room_id), 'source': 'server'}
+    payload.update(delta)
+    count_emit(socket_event, '/room', room_channel(room_id))
+    socketio.emit(socket_event, payload, namespace='/room', to=room_channel(room_id))
+
+
+def publish_lobby_event(room_id, event, **delta):
+    payload = {'eventCategory': 'lobby', 'event': event, 'roomId': int(room_id), 'source': 'server'}
+    payload.update(delta)
+    count_emit('update_lobby', '/lobby')
+    socketio.emit('update_lobby', payload, namespace='/lobby')
+
+
+def publish_game_start(game_id, room_id, actor):
+    publish_room_event(room_id, 'start_game', 'start', gameId=int(game_id), actor=actor)
+    publish_lobby_event(room_id, 'start', newStatus='started')
+
+
+def publish_game_finish(game_id, room_id, actor, version=None):
+    publish_game_event(game_id, 'finish', version, roomId=int(room_id), actor=actor)
+    publish_room_event(room_id, 'finish_game', 'finish', gameId=int(game_id), actor=actor)
+    publish_lobby_event(room_id, 'finish', newStatus='open')
 
 
 @socketio.on('connect', namespace='/lobby')
-def connect():
-    if app.debug:
+def connect(auth=None):
+    if current_app.debug:
         print('New socket connection established')
+    register_socket(auth)
     # emit("connect", {'eventCategory': 'service_events', 'event': 'server connection established'})
 
 
+@socketio.on('connect', namespace='/room')
+def connect_room_socket(auth=None):
+    user = register_socket(auth)
+    if user:
+        room_id = user.get_connected_room_id()
+        if room_id:
+            join_room(room_channel(room_id))
+
+
+@socketio.on('connect', namespace='/game')
+def connect_game_socket(auth=None):
+    user = register_socket(auth)
+    if user:
+        room_id = user.get_connected_room_id()
+        if room_id:
+            for g in Game.query.filter_by(room_id=room_id, finished=None).all():
+                join_room(game_channel(g.id))
+
+
+@socketio.on('join_room', namespace='/room')
+def subscribe_room(token, room_id):
+    user = User.verify_auth_token(token)
+    target_room = Room.query.filter_by(id=room_id).first()
+    if user and target_room and target_room.is_connected(user):
+        join_room(room_channel(room_id))
+
+
+@socketio.on('leave_room', namespace='/room')
+def unsubscribe_room(room_id):
+    leave_room(room_channel(room_id))
+
+
+@socketio.on('join_game', namespace='/game')
+def subscribe_game(token, game_id):
+    user = User.verify_auth_token(token)
+    g = Game.query.filter_by(id=game_id).first()
+    if user and g and g.room.is_connected(user):
+        join_room(game_channel(game_id))
+
+
+@socketio.on('leave_game', namespace='/game')
+def unsubscribe_game(game_id):
+    leave_room(game_channel(game_id))
+
+
 @socketio.on('create_room', namespace='/lobby')
 def create_room(room_id, room_name, host, created):
-    if app.debug:
+    if current_app.debug:
         print('New room "' + str(room_name) + '" was created')
     emit(
         'update_lobby',
@@ -24,14 +161,14 @@ def create_room(room_id, room_name, host, created):
             'created': created
         },
         json=True,
-        # to=room_id,
+        namespace='/lobby',
         broadcast=True
     )
 
 
 @socketio.on('remove_room_from_lobby', namespace='/lobby')
 def remove_room_from_lobby(room_id):
-    if app.debug:
+    if current_app.debug:
         print('Room #' + str(room_id) + ' was closed')
     emit(
         'update_lobby',
@@ -41,15 +178,14 @@ def remove_room_from_lobby(room_id):
             'roomId': room_id
         },
         json=True,
-        # to=room_id,
+        namespace='/lobby',
         broadcast=True
     )
 
 
 @socketio.on('increase_room_players', namespace='/lobby')
 def connect_to_room(username, room_id, room_name, connected_users):
-    # join_room(room_id)
-    if app.debug:
+    if current_app.debug:
         print('User ' + str(username) + ' connected to Room "' + str(room_name) + '" (now connected ' + str(connected_users) + ' players).')
     emit(
         'update_lobby',
@@ -62,7 +198,6 @@ def connect_to_room(username, room_id, room_name, connected_users):
             'actor': username
         },
         namespace='/lobby',
-        # to=room_id,
         broadcast=True
     )
 
@@ -81,15 +216,14 @@ def connect_to_room(username, room_id, room_name, connected_users):
             'actor': username
         },
         json=True,
-        # to=room_id,
-        broadcast=True
+        namespace='/room',
+        to=room_channel(room_id)
     )
 
 
 @socketio.on('decrease_room_players', namespace='/lobby')
 def disconnect_from_room(actor, username, room_id, room_name, connected_users):
-    # leave_room(room_id)
-    if app.debug:
+    if current_app.debug:
         print('User ' + str(username) + ' disconnected from Room "' + str(room_name) + '" (now connected ' + str(connected_users) + ' players).')
     emit(
         'update_lobby',
@@ -102,7 +236,6 @@ def disconnect_from_room(actor, username, room_id, room_name, connected_users):
             'actor': actor
         },
         namespace='/lobby',
-        # to=room_id,
         broadcast=True
     )
 
@@ -121,8 +254,8 @@ def disconnect_from_room(actor, username, room_id, room_name, connected_users):
             'actor': actor
         },
         json=True,
-        # to=room_id,
-        broadcast=True
+        namespace='/room',
+        to=room_channel(room_id)
     )
     emit(
         'update_lobby',
@@ -135,14 +268,13 @@ def disconnect_from_room(actor, username, room_id, room_name, connected_users):
             'actor': actor
         },
         namespace='/lobby',
-        # to=room_id,
         broadcast=True
     )
 
 
 @socketio.on('ready', namespace='/room')
 def ready(actor, username, room_id):
-    if app.debug:
+    if current_app.debug:
         print('User ' + str(username) + ' is ready to start in Room #' + str(room_id))
     emit(
         "update_room",
@@ -153,16 +285,15 @@ def ready(actor, username, room_id):
             'username': username,
             'actor': actor
         },
-        namespace='/room',
         # json=True,
-        # to=room_id,
-        broadcast=True
+        namespace='/room',
+        to=room_channel(room_id)
     )
 
 
 @socketio.on('not_ready', namespace='/room')
 def not_ready(actor, username, room_id):
-    if app.debug:
+    if current_app.debug:
         print('User ' + str(username) + ' is NOT ready to start in Room #' + str(room_id))
     emit(
         "update_room",
@@ -173,16 +304,15 @@ def not_ready(actor, username, room_id):
             'username': username,
             'actor': actor
         },
-        namespace='/room',
         # json=True,
-        # to=room_id,
-        broadcast=True
+        namespace='/room',
+        to=room_channel(room_id)
     )
 
 
 @socketio.on('close_room', namespace='/room')
 def close_room(actor, room_id):
-    if app.debug:
+    if current_app.debug:
         print('Host has closed Room #' + str(room_id))
     emit(
         "exit_room",
@@ -193,9 +323,8 @@ def close_room(actor, room_id):
             'username': 0,
             'actor': actor
         },
-        # to=room_id,
         namespace='/room',
-        broadcast=True
+        to=room_channel(room_id)
     )
     emit(
         'update_lobby',
@@ -204,7 +333,6 @@ def close_room(actor, room_id):
             'event': 'close',
             'roomId': room_id
         },
-        # to=room_id,
         namespace='/lobby',
         broadcast=True
     )
@@ -220,166 +348,19 @@ def remove_room_from_lobby (room_id):
             'roomId': room_id
         },
         json=True,
-        # to=room_id,
-        broadcast=True
-    )
-
-
-@socketio.on('start_game_in_room', namespace='/room')
-def start_game(actor, game_id, room_id):
-    if app.debug:
-        print('Game #' + str(game_id) + ' started in room #' + str(room_id))
-    emit(
-        "start_game",
-        {
-            "eventCategory": "game",
-            "event": "start",
-            "gameId": game_id,
-            "roomId": int(room_id),
-            'actor': actor
-        },
-        json=True,
-        # to=room_id,
-        broadcast=True,
-        namespace='/room'
-    )
-    emit(
-        'update_lobby',
-        {
-            'eventCategory': 'lobby',
-            'event': 'start',
-            'roomId': room_id,
-            'newStatus': 'started'
-        },
-        json=True,
-        # to=room_id,
-        broadcast=True,
-        namespace='/room'
-    )
-
-
-@socketio.on('define_positions', namespace='/game')
-def define_positions(game_id, players_array):
-    if app.debug:
-        print('Defined positions in game #' + str(game_id))
-    emit(
-        "refresh_game_table",
-        {
-            'eventCategory': 'game',
-            'event': 'define positions',
-            'gameId': game_id,
-            'players': players_array
-        },
-        json=True,
-        namespase='/game',
-        # to=room_id,
-        broadcast=True
-    )
-
-
-@socketio.on('deal_cards', namespace='/game')
-def deal_cards(game_id):
-    if app.debug:
-        print('Dealt cards in game #' + str(game_id))
-    emit(
-        "refresh_game_table",
-        {
-            'eventCategory': 'game',
-            'event': 'deal cards',
-            'gameId': game_id
-        },
-        json=True,
-        # to=room_id,
-        broadcast=True
-    )
-
-
-@socketio.on('make_bet', namespace='/game')
-def make_bet(game_id, hand_id, actor, bet_size, is_last_bet, next_acting_player):
-    if app.debug:
-        print('Player "' + str(actor) + '" made bet of size: ' + str(bet_size) + ' in hand #' + str(hand_id) + ' of game #' + str(game_id))
-    emit(
-        "refresh_game_table",
-        {
-            'eventCategory': 'game',
-            'event': 'make bet',
-            'gameId': game_id,
-            'handId': hand_id,
-            'actor': actor,
-            'betSize': bet_size,
-            'nextActingPlayer': next_acting_player,
-            'isLastPlayerToBet': is_last_bet
-        },
-        json=True,
-        # to=room_id,
+        namespace='/lobby',
         broadcast=True
     )
 
 
-@socketio.on('put_card', namespace='/game')
-def next_turn(game_id, hand_id, actor, cards_on_table, took_player, next_player, is_last_card_in_hand):
-    if app.debug:
-        print('Next turn in game #' + str(game_id))
-    emit(
-        "refresh_game_table",
-        {
-            'eventCategory': 'game',
-            'event': 'put card',
-            'gameId': game_id,
-            'actor': actor,
-            'cardsOnTable': cards_on_table,
-            'tookPlayer': took_player,
-            'nextActingPlayer': next_player,
-            'isLastCardInHand': is_last_card_in_hand
-        },
-        json=True,
-        # to=room_id,
-        broadcast=True
-    )
+def ignore_client_move(event, namespace):
+    # game moves used to be relayed from client payloads, now REST handlers publish them with state version after commit
+    # (see publish_game_event); relays are ignored, so table members do not get every move twice, once unversioned
+    def ignore(*args):
+        current_app.logger.warning('Ignored deprecated "{}" socket event, game events are published by the server'.format(event))
+    socketio.on_event(event, ignore, namespace=namespace)
 
 
-@socketio.on('finish_game_in_room', namespace='/game')
-def finish_game(actor, game_id, room_id):
-    if app.debug:
-        print('Game #' + str(game_id) + ' finished in room #' + str(room_id))
-    emit(
-        "refresh_game_table",
-        {
-            "eventCategory": "game",
-            "event": "finish",
-            "gameId": game_id,
-            "roomId": room_id,
-            'actor': actor
-        },
-        json=True,
-        # to=room_id,
-        broadcast=True,
-        namespace='/game'
-    )
-    emit(
-        "finish_game",
-        {
-            "eventCategory": "game",
-            "event": "finish",
-            "gameId": game_id,
-            "roomId": room_id,
-            'actor': actor
-        },
-        json=True,
-        # to=room_id,
-        broadcast=True,
-        namespace='/room'
-    )
-    emit(
-        'update_lobby',
-        {
-            'eventCategory': 'lobby',
-            'event': 'finish',
-            'roomId': room_id,
-            'newStatus': 'started'
-        },
-        json=True,
-        # to=room_id,
-        broadcast=True,
-        namespace='/lobby'
-    )
\ No newline at end of file
+for client_move, client_namespace in [('start_game_in_room', '/room'), ('define_positions', '/game'), ('deal_cards', '/game'),
+                                      ('make_bet', '/game'), ('put_card', '/game'), ('finish_game_in_room', '/game')]:
+    ignore_client_move(client_move, client_namespace)
@@ -0,0 +1,60 @@
+# deal endpoint latency and query count by number of players
+# $ python benchmarks/deal.py [DEALS]      (run from repository root, uses in-memory sqlite database)
+import os
+import sys
+from statistics import median
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db
+from app.models import User, Room, Game, Player, Hand
+from config import get_settings, get_environment
+
+
+def seed_game(players_count):
+    users = []
+    for i in range(players_count):
+        username = 'dealer{}of{}'.format(i, players_count)
+        u = User(email=username + '@prostokvashino.ussr', username=username)
+        db.session.add(u)
+        users.append(u)
+    db.session.commit()
+    r = Room(room_name='Room of {}'.format(players_count), host=users[0])
+    db.session.add(r)
+    db.session.commit()
+    g = Game(room=r)
+    db.session.add(g)
+    db.session.commit()
+    for position, u in enumerate(users, start=1):
+        g.connect(u)
+        db.session.add(Player(game_id=g.id, user_id=u.id, position=position))
+    db.session.commit()
+    return g.id, users[0].generate_auth_token()
+
+
+def measure(client, game_id, token, deals):
+    url = '{base_path}/game/{game_id}/hand/deal'.format(base_path=get_settings('API_BASE_PATH')[get_environment()], game_id=game_id)
+    timings, queries = [], []
+    for i in range(deals):
+        started = perf_counter()
+        response = client.post(url, json={'token': token})
+        timings.append(perf_counter() - started)
+        assert response.status_code == 200, response.get_json()
+        queries.append(int(response.headers['X-Query-Count']))
+        Hand.query.filter_by(game_id=game_id).update({'is_closed': 1})      # next deal needs previous hand closed
+        db.session.commit()
+    return timings, queries
+
+
+if __name__ == '__main__':
+    deals = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'PROFILING': {'ENABLED': True}})      # queries are counted by profiling
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        for players_count in range(3, 11):
+            game_id, token = seed_game(players_count)
+            timings, queries = measure(client, game_id, token, deals)
+            print('{players} players: median {median:.1f} ms per deal, {queries} queries ({deals} deals)'.format(
+                players=players_count, median=median(timings) * 1000, queries=max(queries), deals=deals))
@@ -0,0 +1,105 @@
+# game loop lookups on seeded database without and with composite indexes
+# $ python benchmarks/queries.py [GAMES]      (run from repository root, uses temporary sqlite database)
+import os
+import random
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, text
+from app import create_app, db
+from app.models import User, Room, Game, Player, Hand, DealtCards, HandScore, Turn, TurnCard
+
+PLAYERS = 4
+HANDS = 10
+CARDS_PER_PLAYER = 5
+LOOKUPS = 2000
+
+QUERIES = [
+    ('hand_score by hand, player', 'SELECT * FROM hand_score WHERE hand_id = :hand_id AND player_id = :player_id'),
+    ('turn_card by turn', 'SELECT * FROM turn_card WHERE turn_id = :turn_id'),
+    ('turn_card by hand, player', 'SELECT * FROM turn_card WHERE hand_id = :hand_id AND player_id = :player_id'),
+    ('turn_card by turn, player', 'SELECT * FROM turn_card WHERE turn_id = :turn_id AND player_id = :player_id'),
+    ('dealt_cards by hand, player, suit', 'SELECT * FROM dealt_cards WHERE hand_id = :hand_id AND player_id = :player_id AND card_suit = :card_suit'),
+    ('turn by hand, serial_no', 'SELECT * FROM turn WHERE hand_id = :hand_id AND serial_no = :serial_no'),
+    ('turn by hand, took_user', 'SELECT * FROM turn WHERE hand_id = :hand_id AND took_user_id = :player_id'),
+    ('player by game, position', 'SELECT * FROM player WHERE game_id = :game_id AND position = :position')
+]
+
+
+def seed(games):
+    users = [{'id': i, 'username': 'player{}'.format(i), 'email': 'player{}@prostokvashino.ussr'.format(i)} for i in range(1, PLAYERS * 10 + 1)]
+    rooms, game_rows, players, hands, dealt_cards, hand_scores, turns, turn_cards = [], [], [], [], [], [], [], []
+    generator = random.Random(42)
+    for game_id in range(1, games + 1):
+        game_users = generator.sample(users, PLAYERS)
+        rooms.append({'id': game_id, 'room_name': 'Room {}'.format(game_id), 'user_id': game_users[0]['id']})
+        game_rows.append({'id': game_id, 'room_id': game_id})
+        for position, u in enumerate(game_users, start=1):
+            players.append({'game_id': game_id, 'user_id': u['id'], 'position': position})
+        for serial_no in range(1, HANDS + 1):
+            hand_id = len(hands) + 1
+            hands.append({'id': hand_id, 'game_id': game_id, 'serial_no': serial_no, 'trump': 'd', 'cards_per_player': CARDS_PER_PLAYER, 'is_closed': 1})
+            deck = generator.sample([grade + suit for grade in '23456789tjqka' for suit in 'dhcs'], PLAYERS * CARDS_PER_PLAYER)
+            for i, card in enumerate(deck):
+                dealt_cards.append({'hand_id': hand_id, 'player_id': game_users[i % PLAYERS]['id'], 'card_id': card[0], 'card_suit': card[1]})
+            for u in game_users:
+                hand_scores.append({'hand_id': hand_id, 'player_id': u['id'], 'bet_size': 1, 'score': 11})
+            for turn_no in range(1, CARDS_PER_PLAYER + 1):
+                turn_id = len(turns) + 1
+                turns.append({'id': turn_id, 'hand_id': hand_id, 'serial_no': turn_no, 'took_user_id': generator.choice(game_users)['id']})
+                for i, u in enumerate(game_users):
+                    card = deck[(turn_no - 1) * PLAYERS + i]
+                    turn_cards.append({'hand_id': hand_id, 'turn_id': turn_id, 'player_id': u['id'], 'card_id': card[0], 'card_suit': card[1]})
+    for model, rows in [(User, users), (Room, rooms), (Game, game_rows), (Player, players), (Hand, hands), (DealtCards, dealt_cards),
+                        (HandScore, hand_scores), (Turn, turns), (TurnCard, turn_cards)]:
+        db.session.execute(insert(model), rows)
+    db.session.commit()
+    return hand_scores, turn_cards, dealt_cards, turns, players
+
+
+def lookup_params(games, count):
+    generator = random.Random(7)
+    hand_id = lambda: generator.randint(1, games * HANDS)
+    params = []
+    for i in range(count):
+        params.append({
+            'hand_id': hand_id(),
+            'turn_id': generator.randint(1, games * HANDS * CARDS_PER_PLAYER),
+            'player_id': generator.randint(1, PLAYERS * 10),
+            'card_suit': generator.choice('dhcs'),
+            'serial_no': generator.randint(1, CARDS_PER_PLAYER),
+            'game_id': generator.randint(1, games),
+            'position': generator.randint(1, PLAYERS)
+        })
+    return params
+
+
+def run(label, params):
+    print('\n' + label)
+    for name, sql in QUERIES:
+        plan = ' | '.join(row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql), params[0]))
+        started = perf_counter()
+        for p in params:
+            db.session.execute(text(sql), p).fetchall()
+        elapsed = perf_counter() - started
+        print('  {name:<34} {per_lookup:>8.1f} us/lookup   {plan}'.format(name=name, per_lookup=elapsed / len(params) * 1e6, plan=plan))
+
+
+if __name__ == '__main__':
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')})
+    with app.app_context():
+        db.create_all()
+        seed(games)
+        params = lookup_params(games, LOOKUPS)
+        composite_indexes = [index for table in db.metadata.sorted_tables for index in table.indexes if len(index.columns) > 1]
+        for index in composite_indexes:
+            index.drop(bind=db.engine)
+        run('without composite indexes ({} games)'.format(games), params)
+        for index in composite_indexes:
+            index.create(bind=db.engine)
+        db.session.execute(text('ANALYZE'))
+        run('with composite indexes ({} games)'.format(games), params)
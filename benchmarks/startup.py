@@ -0,0 +1,39 @@
+# application startup benchmark
+# $ python benchmarks/startup.py [RUNS]      (run from repository root, uses config.yml of current environment)
+import os
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLD_START = 'from time import perf_counter; s = perf_counter(); from app import create_app; create_app(); print(perf_counter() - s)'
+
+
+def cold_start(runs):
+    # new interpreter per run: imports, config parsing, extensions and blueprints registration
+    timings = []
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', COLD_START], cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT))
+        timings.append(float(output.decode().strip().splitlines()[-1]))
+    return timings
+
+
+def warm_start(runs):
+    # modules already imported: cost of one more application instance (e.g. per test case)
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    create_app()
+    timings = []
+    for i in range(runs):
+        started = perf_counter()
+        create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+        timings.append(perf_counter() - started)
+    return timings
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for name, timings in [('cold start', cold_start(runs)), ('create_app', warm_start(runs))]:
+        print('{name:>12}: median {median:.1f} ms, min {min:.1f} ms, max {max:.1f} ms ({runs} runs)'.format(
+            name=name, median=median(timings) * 1000, min=min(timings) * 1000, max=max(timings) * 1000, runs=runs))
@@ -1,13 +1,94 @@
 import yaml
+import signal
+from types import MappingProxyType
+
+CONFIG_FILE = 'config.yml'
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType(dict((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _environments(value, env, names=None):
+    # names of environments: keys of {ENV: value} mappings holding plain values
+    names = set() if names is None else names
+    if isinstance(value, dict):
+        if env in value and not isinstance(value[env], dict):
+            names.update(value.keys())
+        for item in value.values():
+            _environments(item, env, names)
+    return names
+
+
+def _resolve(value, env, names):
+    # picks value of current environment from every {ENV: value} mapping on any nesting level
+    if isinstance(value, dict):
+        if env in value and not isinstance(value[env], dict):
+            return _resolve(value[env], env, names)
+        resolved = dict((key, _resolve(item, env, names)) for key, item in value.items() if key not in names)
+        if env in value:
+            resolved.update(_resolve(value[env], env, names))
+        return resolved
+    if isinstance(value, list):
+        return [_resolve(item, env, names) for item in value]
+    return value
+
+
+class Settings(object):
+    # read-only view of config.yml parsed once per process
+    # settings.raw['GAME']['MAX_PLAYERS']['PROD'] - as stored in file, settings.GAME['MAX_PLAYERS'] - resolved for current environment
+
+    def __init__(self, cfg):
+        self.environment = cfg['ENVIRONMENT']
+        self.raw = _freeze(cfg)
+        self.resolved = _freeze(_resolve(cfg, self.environment, _environments(cfg, self.environment) | {self.environment}))
+
+    def __repr__(self):
+        return '<Settings of {} environment>'.format(self.environment)
+
+    def __getattr__(self, section):
+        try:
+            return self.resolved[section]
+        except KeyError:
+            raise AttributeError(section)
+
+    @staticmethod
+    def load(path=CONFIG_FILE):
+        with open(path, 'r') as configfile:
+            return Settings(yaml.load(configfile, Loader=yaml.FullLoader))
+
+
+_settings = None
+
+
+def settings():
+    global _settings
+    if _settings is None:
+        _settings = Settings.load()
+    return _settings
+
+
+def reload_settings(*args):
+    # explicit reload hook (values captured at import time, e.g. route paths, are not affected)
+    global _settings
+    _settings = Settings.load()
+    return _settings
+
+
+def install_reload_handler(signum=getattr(signal, 'SIGHUP', None)):
+    if signum is not None:
+        signal.signal(signum, reload_settings)
+
 
 def get_settings(section=None):
-    with open("config.yml", "r") as configfile:
-        cfg = yaml.load(configfile, Loader=yaml.FullLoader)
-        if section:
-            return cfg[section]
-        return cfg['FLASK']
+    if section:
+        return settings().raw[section]
+    return settings().raw['FLASK']
 
 
 def get_environment():
-    with open("config.yml", "r") as configfile:
-        return yaml.load(configfile, Loader=yaml.FullLoader)['ENVIRONMENT']
+    return settings().environment
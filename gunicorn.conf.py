@@ -0,0 +1,16 @@
+# gunicorn settings, resolved from FLASK section of config.yml for current environment
+import os
+from config import settings
+
+flask_cfg = settings().FLASK
+
+bind = '{host}:{port}'.format(host=flask_cfg.get('HOST', '0.0.0.0'), port=os.environ.get('PORT', flask_cfg['PORT']))
+worker_class = 'gevent'                                         # one greenlet per connection, websockets included
+# Socket.IO clients must stick to one worker: keep 1 worker per gunicorn instance unless
+# load balancer in front routes clients by worker (see "Running several workers" in README)
+workers = int(os.environ.get('WORKERS', flask_cfg.get('WORKERS', 1)))
+worker_connections = int(flask_cfg.get('WORKER_CONNECTIONS', 1000))  # concurrent connections (greenlets) per worker
+timeout = int(flask_cfg.get('WORKER_TIMEOUT', 30))
+graceful_timeout = int(flask_cfg.get('WORKER_TIMEOUT', 30))
+keepalive = 5
+accesslog = '-' if flask_cfg.get('ACCESS_LOG', False) else None
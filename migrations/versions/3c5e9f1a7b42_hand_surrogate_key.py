@@ -0,0 +1,67 @@
+"""hand surrogate key
+
+Hand.id becomes the only (autoincrement) primary key, (game_id, serial_no) is unique instead.
+Autogenerate does not detect primary key changes, so hand is rebuilt here in batch mode
+(copy and move, existing ids are kept) and foreign keys to hand.id are recreated on it.
+
+Revision ID: 3c5e9f1a7b42
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5e9f1a7b42'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def hand_table(surrogate_key):
+    # structure of hand table with surrogate key (after upgrade) or composite key (before)
+    return sa.Table(
+        'hand', sa.MetaData(),
+        sa.Column('id', sa.Integer, primary_key=True, autoincrement=surrogate_key),
+        sa.Column('game_id', sa.Integer, sa.ForeignKey('game.id'), nullable=False, index=True, primary_key=not surrogate_key),
+        sa.Column('serial_no', sa.Integer, nullable=False, primary_key=not surrogate_key),
+        sa.Column('trump', sa.String(1), nullable=True),
+        sa.Column('cards_per_player', sa.Integer, nullable=True),
+        sa.Column('starting_player', sa.Integer, sa.ForeignKey('user.id'), nullable=True),
+        sa.Column('is_closed', sa.Integer, nullable=False),
+        *([sa.UniqueConstraint('game_id', 'serial_no', name='uq_hand_game_serial_no')] if surrogate_key else [])
+    )
+
+
+def rebuild_hand(surrogate_key):
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    referencing = [(table, fk) for table in inspector.get_table_names() for fk in inspector.get_foreign_keys(table)
+                   if fk['referred_table'] == 'hand' and table != 'hand']
+    if bind.dialect.name != 'sqlite':
+        # hand cannot be dropped while other tables reference it (sqlite references are by name and survive the rebuild)
+        for table, fk in referencing:
+            op.drop_constraint(fk['name'], table, type_='foreignkey')
+
+    with op.batch_alter_table('hand', recreate='always', copy_from=hand_table(surrogate_key)):
+        pass
+
+    if bind.dialect.name == 'postgresql' and surrogate_key:
+        # copied ids were inserted explicitly, sequence of new serial column continues after them
+        op.execute("SELECT setval(pg_get_serial_sequence('hand', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM hand")
+    if bind.dialect.name != 'sqlite':
+        for table, fk in referencing:
+            op.create_foreign_key(fk['name'], table, 'hand', fk['constrained_columns'], fk['referred_columns'])
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'hand' not in inspector.get_table_names() or inspector.get_pk_constraint('hand')['constrained_columns'] == ['id']:
+        return      # new database, or created by db.create_all() with the surrogate key already
+    rebuild_hand(surrogate_key=True)
+
+
+def downgrade():
+    rebuild_hand(surrogate_key=False)
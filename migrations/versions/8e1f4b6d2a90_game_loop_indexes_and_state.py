@@ -0,0 +1,98 @@
+"""game loop indexes and state
+
+Composite indexes of game loop lookups (unique ones guard one bet per player in hand, one turn per serial number
+in hand and one card per player in turn), state versions of room and game, seed of game and game scoreboard.
+Rows duplicating a new unique key are removed first (the first one is kept), scoreboards of existing games are
+filled from scores of their closed hands. Tables, columns and indexes that already exist are left as they are.
+
+Revision ID: 8e1f4b6d2a90
+Revises: 3c5e9f1a7b42
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e1f4b6d2a90'
+down_revision = '3c5e9f1a7b42'
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    ('room', lambda: sa.Column('state_version', sa.Integer(), nullable=False, server_default='0')),
+    ('game', lambda: sa.Column('state_version', sa.Integer(), nullable=False, server_default='0')),
+    ('game', lambda: sa.Column('seed', sa.BigInteger(), nullable=True))
+]
+
+INDEXES = [
+    ('player', 'ix_player_game_position', ['game_id', 'position'], False),
+    ('dealt_cards', 'ix_dealt_cards_hand_player_suit', ['hand_id', 'player_id', 'card_suit'], False),
+    ('hand_score', 'ix_hand_score_hand_player', ['hand_id', 'player_id'], True),
+    ('turn', 'ix_turn_hand_serial_no', ['hand_id', 'serial_no'], True),
+    ('turn', 'ix_turn_hand_took_user', ['hand_id', 'took_user_id'], False),
+    ('turn_card', 'ix_turn_card_turn_player', ['turn_id', 'player_id'], True),
+    ('turn_card', 'ix_turn_card_hand_player', ['hand_id', 'player_id'], False)
+]
+
+
+def delete_duplicates(table, columns):
+    # keeps row with lowest id of every group duplicating unique key (rows with null key columns do not collide)
+    key = ' AND '.join('{} IS NOT NULL'.format(column) for column in columns)
+    op.execute('DELETE FROM {table} WHERE {key} AND id NOT IN '
+               '(SELECT id FROM (SELECT MIN(id) AS id FROM {table} WHERE {key} GROUP BY {columns}) kept)'.format(
+                   table=table, key=key, columns=', '.join(columns)))
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+    if 'game' not in tables:
+        return      # new database, tables are created by autogenerated revision
+
+    for table, column in COLUMNS:
+        if column().name not in [c['name'] for c in inspector.get_columns(table)]:
+            with op.batch_alter_table(table) as batch_op:
+                batch_op.add_column(column())
+
+    # cards of duplicate turns move to the first turn of the same serial number before duplicates are removed
+    op.execute('UPDATE turn_card SET turn_id = (SELECT MIN(kept.id) FROM turn kept, turn duplicate '
+               'WHERE duplicate.id = turn_card.turn_id AND kept.hand_id = duplicate.hand_id AND kept.serial_no = duplicate.serial_no) '
+               'WHERE turn_id IN (SELECT id FROM turn WHERE serial_no IS NOT NULL)')
+    delete_duplicates('turn', ['hand_id', 'serial_no'])
+    delete_duplicates('turn_card', ['turn_id', 'player_id'])
+    delete_duplicates('hand_score', ['hand_id', 'player_id'])
+    for table, name, columns, unique in INDEXES:
+        if name not in [index['name'] for index in inspector.get_indexes(table)]:
+            op.create_index(name, table, columns, unique=unique)
+
+    if 'game_score' not in tables:
+        op.create_table(
+            'game_score',
+            sa.Column('game_id', sa.Integer(), nullable=False),
+            sa.Column('player_id', sa.Integer(), nullable=False),
+            sa.Column('hands_played', sa.Integer(), nullable=False),
+            sa.Column('sum_of_bets', sa.Integer(), nullable=False),
+            sa.Column('bonuses', sa.Integer(), nullable=False),
+            sa.Column('total_score', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['game_id'], ['game.id']),
+            sa.ForeignKeyConstraint(['player_id'], ['user.id']),
+            sa.PrimaryKeyConstraint('game_id', 'player_id')
+        )
+        # same totals as `flask scores rebuild`: scores of closed hands of game players
+        op.execute('INSERT INTO game_score (game_id, player_id, hands_played, sum_of_bets, bonuses, total_score) '
+                   'SELECT hand.game_id, hand_score.player_id, COUNT(*), COALESCE(SUM(hand_score.bet_size), 0), '
+                   'SUM(CASE WHEN hand_score.bonus <> 0 THEN 1 ELSE 0 END), COALESCE(SUM(hand_score.score), 0) '
+                   'FROM hand_score JOIN hand ON hand.id = hand_score.hand_id '
+                   'JOIN player ON player.game_id = hand.game_id AND player.user_id = hand_score.player_id '
+                   'WHERE hand.is_closed = 1 GROUP BY hand.game_id, hand_score.player_id')
+
+
+def downgrade():
+    op.drop_table('game_score')
+    for table, name, columns, unique in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+    for table, column in reversed(COLUMNS):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column(column().name)
@@ -1,16 +1,20 @@
-from app import app, db, socketio
-from app.models import User, Room, Game, Hand, Turn, Player, TurnCard, DealtCards, HandScore
 from gevent import monkey
-from config import get_settings, get_environment
-monkey.patch_all()
+monkey.patch_all()      # before anything else imports socket/threading (required by redis message queue)
+
+import os
+from app import app, db, socketio
+from app.models import User, Room, Game, Hand, Turn, Player, TurnCard, DealtCards, HandScore, GameScore
+from config import get_settings, get_environment, settings, install_reload_handler
 
 env = get_environment()
 
 @app.shell_context_processor
 def make_shell_context():
-    return {'db': db, 'User': User, 'Room': Room, 'Game': Game, 'Hand': Hand, 'Turn': Turn, 'Player': Player, 'TurnCard': TurnCard, 'DealtCards': DealtCards, 'HandScore': HandScore}
+    return {'db': db, 'User': User, 'Room': Room, 'Game': Game, 'Hand': Hand, 'Turn': Turn, 'Player': Player, 'TurnCard': TurnCard, 'DealtCards': DealtCards, 'HandScore': HandScore, 'GameScore': GameScore}
 
 
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True, port=get_settings('FLASK')['PORT'][env])
\ No newline at end of file
+    install_reload_handler()      # kill -HUP <pid> re-reads config.yml
+    # development server (see wsgi.py for production), PORT overrides configured port
+    socketio.run(app, debug=settings().FLASK.get('DEBUG', False), port=int(os.environ.get('PORT', get_settings('FLASK')['PORT'][env])))
@@ -2,10 +2,14 @@
 
 from flask import url_for, request, jsonify, Blueprint
 from flask_cors import cross_origin
-from app import db
-from app.models import User, Room, Game, Player, Hand, HandScore, TurnCard
-from datetime import datetime
-import random
+from app import db, cards
+from app.models import User, Room, Game, Player
+from app.game_state import GameSnapshot
+from app.socket import join_game_channel, publish_game_event, publish_game_start, publish_game_finish
+from math import isfinite
+from app.rng import new_game_seed, game_random, rng_mode, SEEDED
+from app.etag import resource_etag, is_fresh, not_modified, conditional
+from app.game_changes import wait_for_change, long_poll_settings
 from config import get_settings, get_environment
 
 
@@ -14,10 +18,31 @@ game_cfg = get_settings('GAME')
 env = get_environment()
 
 
+def table_card_json(hand_state, player_id, card, requesting_user=None):
+    player_position = None
+    player_relative_position = None
+    if hand_state.is_registered(player_id):
+        player_position = hand_state.get_position(player_id)
+        player_relative_position = player_position
+        if requesting_user:
+            player_relative_position = hand_state.get_relative_position(requesting_user.id, player_id)
+    return {
+        'cardId': cards.decode(card),
+        'playerId': player_id,
+        'playerPosition': player_position,
+        'playerRelativePosition': player_relative_position
+    }
+
+
 @game.route('{base_path}/game/<game_id>/score'.format(base_path=get_settings('API_BASE_PATH')[env]), methods=['GET'])
 @cross_origin()
 def game_score(game_id):
 
+    version = Game.get_state_version(game_id)
+    etag = resource_etag(version, 'game', game_id, 'score')
+    if version is not None and is_fresh(etag):
+        return not_modified(etag)
+
     g = Game.query.filter_by(id=game_id).first()
     if not g:
         return jsonify({
@@ -30,10 +55,10 @@ def game_score(game_id):
 
     game_scores = g.get_scores()
 
-    return jsonify({
+    return conditional(jsonify({
         'gameId': game_id,
         'gameScores': game_scores
-    }), 200
+    }), etag), 200
 
 
 @game.route('{base_path}/game/start'.format(base_path=get_settings('API_BASE_PATH')[env]), methods=['POST'])
@@ -85,11 +110,23 @@ def start():
                     }
                 ]
             }), 403
+    seed = request.json.get('seed')     # replay of recorded game (seed from finished game status), seeded rng mode only
+    if seed is not None and (rng_mode() != SEEDED or not str(seed).isdigit() or int(seed) >= 2 ** 63):
+        return jsonify({
+            'errors': [
+                {
+                    'message': 'Game seed can be set in seeded mode only and should be integer from 0 to 2^63-1!'
+                }
+            ]
+        }), 400
     autodeal = 0
     if request.json.get('autodeal'):
         autodeal=request.json.get('autodeal')
     g = Game(room=hosted_room, autodeal=autodeal)
     db.session.add(g)
+    db.session.flush()
+    g.seed = new_game_seed(g.id) if seed is None else int(seed)
+    Room.advance_state_version(hosted_room.id)
     db.session.commit()
 
     players_list = []
@@ -99,6 +136,9 @@ def start():
         db.session.add(p)
         players_list.append(player.username)
     db.session.commit()
+    for player in g.players:
+        join_game_channel(player.id, g.id)
+    publish_game_start(g.id, hosted_room.id, requesting_user.username)
 
     return jsonify({
         'gameId': g.id,
@@ -154,17 +194,15 @@ def finish():
         }), 403
 
     g = active_games[0]
-    g.finished = datetime.utcnow()
-    for player in hosted_room.connected_users:
-        user = User.query.filter_by(id=player.id).first()
-        hosted_room.not_ready(user)
+    g.finish(whole_room=True)       # winner and stats like game finished by its last hand, nobody in room stays ready
+    version = Game.advance_state_version(g.id)
     db.session.commit()
 
     players_list = []
     for player in hosted_room.connected_users.all():
         g.connect(player)
         players_list.append(player.username)
-
+    publish_game_finish(g.id, hosted_room.id, requesting_user.username, version)
 
 
     return jsonify({
@@ -224,15 +262,16 @@ def positions(game_id):
                 ]
             }), 403
 
-    players = Player.query.filter_by(game_id=game_id).all()
-    random.shuffle(players)
+    players = Player.query.filter_by(game_id=game_id).order_by(Player.user_id).all()
+    game_random(game.seed, 'positions').shuffle(players)
 
     players_list = []
     requesting_user_is_player = False
     for player in players:
         p = Player.query.filter_by(game_id=game_id, user_id=player.user_id).first()
         p.position = players.index(player) + 1
-        db.session.commit()
+    version = Game.advance_state_version(game_id)
+    db.session.commit()
     for player in players:
         if player.user_id == requesting_user.id:
             requesting_user_is_player = True
@@ -245,132 +284,77 @@ def positions(game_id):
                                                                        player.user_id) if requesting_user_is_player else player.position
             })
 
+    publish_game_event(
+        game_id, 'define positions', version,
+        players=[{'username': player['username'], 'position': player['position']} for player in players_list]
+    )
+
     return jsonify({
         'gameId': game_id,
         'players': players_list
     }), 200
 
 
-@game.route('{base_path}/game/<game_id>'.format(base_path=get_settings('API_BASE_PATH')[env]), methods=['POST'])
-@cross_origin()
-def status(game_id):
-
-    game = Game.query.filter_by(id=game_id).first()
-    if not game:
-        return jsonify({
-            'errors': [
-                {
-                    'message': 'Game #{game_id} is not found!'.format(game_id=game_id)
-                }
-            ]
-        }), 404
-
-    room = Room.query.filter_by(id=game.room_id).first()
-    if not room:
-        return jsonify({
-            'errors': [
-                {
-                    'message': 'Room #{room_id} not found in game #{game_id}'.format(room_id=game.room_id, game_id=game_id)
-                }
-            ]
-        }), 401
-
+def game_status_json(snapshot, requesting_user=None):
+    game = snapshot.game
+    room = snapshot.room
+    current_hand = snapshot.current_hand
     players_enriched = []
-    players = Player.query.filter_by(game_id=game_id).order_by(Player.position).all()
     positions_defined = True
-    requesting_user = None
-    requesting_user_is_player = False
+    requesting_user_is_player = requesting_user is not None and snapshot.is_player(requesting_user.id)
+    relative_to = requesting_user if requesting_user_is_player else None
 
-    current_hand = game.last_open_hand()
-
-    token = request.json.get('token')
     my_info = {}
     cards_on_table = []
     last_turn_cards = []
-    if token:
-        requesting_user = User.verify_api_auth_token(token)
-        if requesting_user:
-            for player in players:
-                if player.user_id == requesting_user.id:
-                    requesting_user_is_player = True
-                    my_info['username'] = requesting_user.username
-                    my_info['position'] = player.position
-                    if current_hand:
-                        my_scores = HandScore.query.filter_by(player_id=requesting_user.id, hand_id=current_hand.id).first()
-                        my_info['dealtCards'] = current_hand.get_user_current_hand(requesting_user, current_hand.trump)
-                        my_info['betSize'] = my_scores.bet_size if my_scores else None
-                        my_info['tookTurns'] = my_scores.took_turns() if my_scores else None
-                    else:
-                        my_info['dealtCards'] = []
+    if requesting_user_is_player:
+        my_info['username'] = requesting_user.username
+        my_info['position'] = snapshot.positions[requesting_user.id]
+        if current_hand:
+            my_info['dealtCards'] = current_hand.get_user_current_hand(requesting_user.id, current_hand.trump)
+            my_info['betSize'] = current_hand.bets.get(requesting_user.id)
+            my_info['tookTurns'] = current_hand.took_turns(requesting_user.id) if requesting_user.id in current_hand.bets else None
+            my_info['legalCards'] = []
+            if current_hand.all_bets_made() and current_hand.next_acting_player() == requesting_user.id:
+                legal_cards = cards.from_mask(current_hand.legal_cards(requesting_user.id))
+                my_info['legalCards'] = [cards.decode(card) for card in cards.sort_cards(legal_cards, current_hand.trump_index)]
+        else:
+            my_info['dealtCards'] = []
 
     next_player = None
     if current_hand:
         next_player = current_hand.next_acting_player()
-        for player in players:
-            user = User.query.filter_by(id=player.user_id).first()
-            if user:
-                user_scores = HandScore.query.filter_by(player_id=user.id, hand_id=current_hand.id).first()
+        for player in snapshot.players:
+            if current_hand.is_registered(player.user_id):
                 players_enriched.append({
-                    'username': user.username,
-                    'position': current_hand.get_position(user),
-                    'betSize': user_scores.bet_size if user_scores else None,
-                    'tookTurns': user_scores.took_turns() if user_scores else None,
-                    'cardsOnHand': len(current_hand.get_user_current_hand(user)),
-                    'relativePosition': game.get_player_relative_positions(requesting_user.id, player.user_id) if requesting_user_is_player else player.position
+                    'username': current_hand.username(player.user_id),
+                    'position': current_hand.get_position(player.user_id),
+                    'betSize': current_hand.bets.get(player.user_id),
+                    'tookTurns': current_hand.took_turns(player.user_id) if player.user_id in current_hand.bets else None,
+                    'cardsOnHand': current_hand.cards_on_hand(player.user_id),
+                    'relativePosition': snapshot.get_relative_position(requesting_user.id, player.user_id) if requesting_user_is_player else player.position
                 })
         current_turn = current_hand.get_current_turn(closed=True)
 
         if current_turn:
-            for card in current_turn.stroke_cards():
-                card_user = User.query.filter_by(id=card.player_id).first()
-                player_position = None
-                player_relative_position = None
-                if card_user:
-                    player_position = current_hand.get_position(card_user)
-                    player_relative_position = player_position
-                    if requesting_user_is_player:
-                        player_relative_position = game.get_player_relative_positions(requesting_user.id, card_user.id)
-                cards_on_table.append({
-                    'cardId': str(card.card_id) + card.card_suit,
-                    'playerId': card.player_id,
-                    'playerPosition': player_position,
-                    'playerRelativePosition': player_relative_position
-                })
+            for player_id, card in current_turn.cards:
+                cards_on_table.append(table_card_json(current_hand, player_id, card, relative_to))
 
         last_turn = current_hand.get_last_turn()
         if last_turn:
-            for card in TurnCard.query.filter_by(turn_id=last_turn.id).all():
-                card_user = User.query.filter_by(id=card.player_id).first()
-                player_position = None
-                player_relative_position = None
-                if card_user:
-                    player_position = current_hand.get_position(card_user)
-                    player_relative_position = player_position
-                    if requesting_user_is_player:
-                        player_relative_position = game.get_player_relative_positions(requesting_user.id, card_user.id)
-                last_turn_cards.append({
-                    'cardId': str(card.card_id) + card.card_suit,
-                    'playerId': card.player_id,
-                    'playerPosition': player_position,
-                    'playerRelativePosition': player_relative_position
-                })
-
+            for player_id, card in last_turn.cards:
+                last_turn_cards.append(table_card_json(current_hand, player_id, card, relative_to))
 
     else:
-        for player in players:
-            user = User.query.filter_by(id=player.user_id).first()
-            if player.position is None:
-                positions_defined = False
-            if user:
-                players_enriched.append({
-                    'username': user.username,
-                    'position': player.position,
-                    'relativePosition': game.get_player_relative_positions(requesting_user.id, player.user_id) if requesting_user_is_player else player.position
-                })
-
-    played_hands_count = Hand.query.filter_by(game_id=game_id, is_closed=1).count()
+        positions_defined = snapshot.positions_defined
+        for player in snapshot.players:
+            players_enriched.append({
+                'username': snapshot.usernames[player.user_id],
+                'position': player.position,
+                'relativePosition': snapshot.get_relative_position(requesting_user.id, player.user_id) if requesting_user_is_player else player.position
+            })
 
-    action_msg = 'Game #{game_id} started by {hostname}! Host is to shuffle positions.'.format(game_id=game_id, hostname=room.host.username)
+    action_msg = 'Game #{game_id} started by {hostname}! Host is to shuffle positions.'.format(game_id=game.id, hostname=room.host.username)
     can_deal = False
     if game.finished:
         action_msg = 'This game is closed!'
@@ -378,19 +362,18 @@ def status(game_id):
         if current_hand is None:                        # if hand is not started yet
             can_deal = True
             action_msg = 'Dealing cards...'
-        elif next_player == requesting_user:
+        elif requesting_user and next_player == requesting_user.id:
             action_msg = "It's your turn now"
         elif not current_hand.all_bets_made():          # if hand is started, but there are still bets to make
-            action_msg = '{username} is making bet...'.format(username=current_hand.next_acting_player().username)
+            action_msg = '{username} is making bet...'.format(username=current_hand.username(next_player))
         elif not current_hand.all_turns_made():         # if hand is not finished
-            action_msg = "{username}'s turn...".format(username=current_hand.next_acting_player().username)
+            action_msg = "{username}'s turn...".format(username=current_hand.username(next_player))
         else:                                           # if hand is just finished
             action_msg = 'Hand is finished'
 
-
-    response_json = {
+    return {
         'gameId': game.id,
-        'roomName': Room.query.filter_by(id=game.room_id).first().room_name,
+        'roomName': room.room_name,
         'roomId': game.room_id,
         'positionsDefined': positions_defined,
         'canDeal': can_deal,
@@ -399,22 +382,166 @@ def status(game_id):
         'currentHandSerialNo': current_hand.serial_no if current_hand else None,
         'trump': current_hand.trump if current_hand else None,
         'cardsPerPlayer': current_hand.cards_per_player if current_hand else None,
-        'currentHandLocation': url_for('hand.status', hand_id=current_hand.id, game_id=game_id) if current_hand else None,
-        'playedHandsCount': played_hands_count,
+        'currentHandLocation': url_for('hand.status', hand_id=current_hand.id, game_id=game.id) if current_hand else None,
+        'playedHandsCount': snapshot.played_hands_count,
         'started': game.started,
         'status': 'open' if game.finished is None else 'finished',
         'finished': game.finished,
         'players': players_enriched,
         'lastTurnCards': last_turn_cards,
-        'nextActingPlayer': next_player.username if next_player else None,
+        'nextActingPlayer': current_hand.username(next_player) if current_hand else None,
         'host': room.host.username,
         'startedHands': [],
         'autodeal': game.autodeal == 1,
-        'gameScores': game.get_scores(),
+        'gameScores': snapshot.get_scores(),
+        'version': snapshot.version,
+        'seed': str(game.seed) if game.finished and game.seed is not None else None,     # disclosed for replay once game is over
         'actionMessage': action_msg,
         'myInHandInfo': my_info,
         'cardsOnTable': cards_on_table
     }
 
 
-    return jsonify(response_json), 200
+@game.route('{base_path}/game/<game_id>'.format(base_path=get_settings('API_BASE_PATH')[env]), methods=['POST'])
+@cross_origin()
+def status(game_id):
+
+    requesting_user = None
+    token = request.json.get('token')
+    if token:
+        requesting_user = User.verify_auth_token(token)
+
+    # status is personal (dealt cards, relative positions), so is its tag
+    requesting_user_id = requesting_user.id if requesting_user else 0
+    version = Game.get_state_version(game_id)
+    etag = resource_etag(version, 'game', game_id, 'user', requesting_user_id)
+    if version is not None and is_fresh(etag):
+        return not_modified(etag)
+
+    snapshot = GameSnapshot.load(game_id)
+    if not snapshot:
+        return jsonify({
+            'errors': [
+                {
+                    'message': 'Game #{game_id} is not found!'.format(game_id=game_id)
+                }
+            ]
+        }), 404
+
+    if not snapshot.room:
+        return jsonify({
+            'errors': [
+                {
+                    'message': 'Room #{room_id} not found in game #{game_id}'.format(room_id=snapshot.game.room_id, game_id=game_id)
+                }
+            ]
+        }), 401
+
+    return conditional(jsonify(game_status_json(snapshot, requesting_user)),
+                       resource_etag(snapshot.version, 'game', game_id, 'user', requesting_user_id)), 200
+
+
+@game.route('{base_path}/game/<game_id>/sync'.format(base_path=get_settings('API_BASE_PATH')[env]), methods=['POST'])
+@cross_origin()
+def sync(game_id):
+    # resync point for socket clients: full game status unless client already has current state version
+
+    snapshot = GameSnapshot.load(game_id)
+    if not snapshot:
+        return jsonify({
+            'errors': [
+                {
+                    'message': 'Game #{game_id} is not found!'.format(game_id=game_id)
+                }
+            ]
+        }), 404
+
+    if not snapshot.room:
+        return jsonify({
+            'errors': [
+                {
+                    'message': 'Room #{room_id} not found in game #{game_id}'.format(room_id=snapshot.game.room_id, game_id=game_id)
+                }
+            ]
+        }), 401
+
+    requesting_user = None
+    token = request.json.get('token')
+    if token:
+        requesting_user = User.verify_auth_token(token)
+
+    up_to_date = request.json.get('version') == snapshot.version
+    return jsonify({
+        'gameId': snapshot.game.id,
+        'version': snapshot.version,
+        'upToDate': up_to_date,
+        'status': None if up_to_date else game_status_json(snapshot, requesting_user)
+    }), 200
+
+
+@game.route('{base_path}/game/<game_id>/wait'.format(base_path=get_settings('API_BASE_PATH')[env]), methods=['GET'])
+@cross_origin()
+def wait(game_id):
+    # long-poll alternative to game socket: request is parked until game state version is greater than `since`
+    # (full game status is returned) or timeout expires (client is up to date and should wait again)
+
+    max_timeout, recheck = long_poll_settings()
+    try:
+        since = int(request.args.get('since'))
+        timeout = float(request.args.get('timeout', max_timeout))
+    except (TypeError, ValueError):
+        timeout = None
+    if timeout is None or not isfinite(timeout):
+        return jsonify({
+            'errors': [
+                {
+                    'message': 'Integer game state version (since) and timeout in seconds are expected!'
+                }
+            ]
+        }), 400
+    timeout = max(0, min(timeout, max_timeout))
+
+    # token is never passed in url (urls end up in access logs): Authorization: Bearer <token> header or json body
+    requesting_user = None
+    token = None
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        token = authorization[len('Bearer '):]
+    elif request.is_json:
+        token = (request.get_json(silent=True) or {}).get('token')
+    if token:
+        requesting_user = User.verify_auth_token(token)
+
+    version = wait_for_change(game_id, since, timeout, recheck)
+    if version is None:
+        return jsonify({
+            'errors': [
+                {
+                    'message': 'Game #{game_id} is not found!'.format(game_id=game_id)
+                }
+            ]
+        }), 404
+    if version <= since:
+        return jsonify({
+            'gameId': int(game_id),
+            'version': version,
+            'upToDate': True,
+            'status': None
+        }), 200
+
+    snapshot = GameSnapshot.load(game_id)
+    if not snapshot or not snapshot.room:
+        return jsonify({
+            'errors': [
+                {
+                    'message': 'Game #{game_id} is not found!'.format(game_id=game_id)
+                }
+            ]
+        }), 404
+
+    return jsonify({
+        'gameId': snapshot.game.id,
+        'version': snapshot.version,
+        'upToDate': False,
+        'status': game_status_json(snapshot, requesting_user)
+    }), 200
@@ -1,13 +1,19 @@
 from flask import jsonify, Blueprint, request
 from flask_cors import cross_origin
+from sqlalchemy import cast, Float, and_, or_
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from app import db
 from app.email import send_feedback
 from app.models import Stats, User
-from config import get_settings, get_environment
+from app.cache import ratings_cache
+from config import get_settings, get_environment, settings
 
 
 general = Blueprint('general', __name__)
 env = get_environment()
 
+RATINGS_PAGE_SIZE = 100         # max ratings entries per response
+
 @general.route('{base_path}/rules'.format(base_path=get_settings('API_BASE_PATH')[env]), methods=['GET'])
 @cross_origin()
 def get_rules():
@@ -58,7 +64,7 @@ def feedback():
             }]
         })
 
-    if len(message)>get_settings('CONTENT')['MAX_SYMBOLS'][env]:
+    if len(message)>settings().CONTENT['MAX_SYMBOLS']:
         return jsonify({
             'errors': [{
                 'field': 'message',
@@ -73,22 +79,95 @@ def feedback():
 @general.route('{base_path}/ratings'.format(base_path=get_settings('API_BASE_PATH')[env]), methods=['GET'])
 @cross_origin()
 def ratings():
-    ratings = Stats.query.filter(Stats.games_played>0).all()
+    limit = request.args.get('limit', RATINGS_PAGE_SIZE)
+    cursor = request.args.get('cursor')
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if limit < 1 or limit > RATINGS_PAGE_SIZE:
+        return jsonify({
+            'errors': [
+                {
+                    'field': 'limit',
+                    'message': 'Limit should be a number from 1 to {max_limit}!'.format(max_limit=RATINGS_PAGE_SIZE)
+                }
+            ]
+        }), 400
+    after = None
+    if cursor:
+        after = decode_ratings_cursor(cursor)
+        if after is None:
+            return jsonify({
+                'errors': [
+                    {
+                        'field': 'cursor',
+                        'message': 'Invalid ratings cursor!'
+                    }
+                ]
+            }), 400
+
+    page = ratings_cache.get((limit, cursor))
+    if page is None:
+        page = get_ratings_page(limit, after)
+        ratings_cache.set((limit, cursor), page)
+    ratings_final, next_cursor = page
+
+    response = jsonify(ratings_final)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+def get_ratings_page(limit, after=None):
+    # one joined query ordered by total score, win ratio, average score (user id makes order stable for paging)
+    win_ratio = cast(Stats.games_won, Float) / Stats.games_played
+    avg_score = cast(Stats.total_score, Float) / Stats.games_played
+    query = db.session.query(Stats, User.username).join(User, User.id == Stats.user_id).filter(Stats.games_played > 0)
+    if after:
+        # rows following the cursor in that order, compared by cross multiplication to stay exact
+        total_score, games_won, games_played, user_id = after
+        query = query.filter(or_(
+            Stats.total_score < total_score,
+            and_(Stats.total_score == total_score, or_(
+                Stats.games_won * games_played < games_won * Stats.games_played,
+                and_(Stats.games_won * games_played == games_won * Stats.games_played, or_(
+                    Stats.total_score * games_played < total_score * Stats.games_played,
+                    and_(Stats.total_score * games_played == total_score * Stats.games_played, Stats.user_id < user_id)
+                ))
+            ))
+        ))
+    rows = query.order_by(Stats.total_score.desc(), win_ratio.desc(), avg_score.desc(), Stats.user_id.desc()).limit(limit + 1).all()
     ratings_final = []
-    if ratings:
-        for rating in ratings:
-            user = User.query.filter_by(id=rating.user_id).first()
-            if user:
-                ratings_final.append({
-                    'username': user.username,
-                    'gamesPlayed': rating.games_played,
-                    'gamesWon': rating.games_won,
-                    'winRatio': rating.games_won / rating.games_played,
-                    'sumOfBets': rating.sum_of_bets,
-                    'bonuses': rating.bonuses,
-                    'totalScore': rating.total_score,
-                    'avgScore': rating.total_score / rating.games_played,
-                    'avgBonuses': rating.bonuses / rating.games_played,
-                    'avgBetSize': rating.sum_of_bets / rating.games_played
-                })
-    return ratings_final
\ No newline at end of file
+    for rating, username in rows[:limit]:
+        ratings_final.append({
+            'username': username,
+            'gamesPlayed': rating.games_played,
+            'gamesWon': rating.games_won,
+            'winRatio': rating.games_won / rating.games_played,
+            'sumOfBets': rating.sum_of_bets,
+            'bonuses': rating.bonuses,
+            'totalScore': rating.total_score,
+            'avgScore': rating.total_score / rating.games_played,
+            'avgBonuses': rating.bonuses / rating.games_played,
+            'avgBetSize': rating.sum_of_bets / rating.games_played
+        })
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1][0]
+        next_cursor = encode_ratings_cursor(last.total_score, last.games_won, last.games_played, last.user_id)
+    return ratings_final, next_cursor
+
+
+def encode_ratings_cursor(total_score, games_won, games_played, user_id):
+    key = '{}:{}:{}:{}'.format(total_score, games_won, games_played, user_id)
+    return urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_ratings_cursor(cursor):
+    try:
+        key = urlsafe_b64decode(cursor.encode()).decode()
+        total_score, games_won, games_played, user_id = [int(value) for value in key.split(':')]
+    except ValueError:
+        return None
+    return total_score, games_won, games_played, user_id
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 
-from flask import url_for, request, jsonify, Blueprint
+from flask import url_for, request, jsonify, Blueprint, current_app
 from flask_cors import cross_origin
-from app import app, db
-from app.models import User, Room, Game, Player, Hand, DealtCards, HandScore
-import random
+from app import db, cards
+from app.models import User, Room, Game, Hand, DealtCards
+from app.game_state import get_hand_state
+from app.socket import publish_game_event
+from app.rng import game_random
+from app.etag import resource_etag, is_fresh, not_modified, conditional
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from math import floor
 from config import get_settings, get_environment
 
@@ -61,13 +66,8 @@ def deal_cards(game_id):
     trump = 'd'
     cards_per_player = min(floor(52/game.players.count()), 10)
     starting_player = game.get_starter()
-    if app.debug:
+    if current_app.debug:
         print('Game starter is ' + str(starting_player.username))
-    new_hand_id = 1
-    # FIXME: for some reason hand.id autoincrement does not work - it's temporary fix until autoincrement is restored
-    last_hand = Hand.query.order_by(Hand.id.desc()).first()
-    if last_hand:
-        new_hand_id = last_hand.id + 1
 
     # hand configuration based on previous hands configuration
     last_closed_hand = Hand.query.filter_by(game_id=game_id, is_closed=1).order_by(Hand.serial_no.desc()).first()
@@ -97,13 +97,26 @@ def deal_cards(game_id):
         elif len(single_card_closed_hands) == 2:
             cards_per_player = last_closed_hand.cards_per_player + 1
         else:
-            print('Cannot calculate cards per player count in hand #' + str(new_hand_id) + ' of game #' + str(game_id))
+            print('Cannot calculate cards per player count in hand ' + str(serial_no) + ' of game #' + str(game_id))
 
         # next starting player is the one who was second is previous hand
         starting_player = last_closed_hand.get_player_by_pos(2)
 
-    h = Hand(id=new_hand_id, game_id=int(game_id), serial_no=serial_no, trump=trump, cards_per_player=cards_per_player, starting_player=starting_player.id)
+    h = Hand(game_id=int(game_id), serial_no=serial_no, trump=trump, cards_per_player=cards_per_player, starting_player=starting_player.id)
     db.session.add(h)
+    try:
+        db.session.flush()      # hand id is generated by db
+    except IntegrityError as error:
+        db.session.rollback()
+        if not Hand.is_serial_no_conflict(error):
+            raise
+        return jsonify({
+            'errors': [
+                {
+                    'message': 'Hand {serial_no} of game {game_id} is already dealt!'.format(serial_no=serial_no, game_id=game_id)
+                }
+            ]
+        }), 409
 
     # creating and shuffling card deck
     deck = []
@@ -119,17 +132,15 @@ def deal_cards(game_id):
         for suit in suits:
             deck.append(str(grade) + str(suit))
 
-    random.shuffle(deck)
+    game_random(game.seed, 'deck', serial_no).shuffle(deck)
 
-    # deal (distribute) cards
-    i = 0
-    # dcs_json = {}
-    for card in deck:
-        i = i + 1
-        if i <= cards_per_player * game.players.count():
-            card_player = h.get_player_by_pos(deck.index(card) % game.players.count() + 1)
-            dc = DealtCards(hand_id=h.id, card_id=card[:1], card_suit=card[1:], player_id=card_player.id)
-            db.session.add(dc)
+    # deal (distribute) cards: seats are resolved once, dealt cards are written with single bulk insert
+    seats = h.get_seats()
+    players_count = len(seats)
+    dealt_cards = []
+    for i, card in enumerate(deck[:cards_per_player * players_count]):
+        dealt_cards.append({'hand_id': h.id, 'card_id': card[:1], 'card_suit': card[1:], 'player_id': seats[i % players_count + 1]})
+    db.session.execute(insert(DealtCards), dealt_cards)
 
     """players_cards = {}
     for player in game.players.all():
@@ -137,8 +148,18 @@ def deal_cards(game_id):
         player_cards = h.get_user_initial_hand(player_obj)
         players_cards[player_obj.username]=player_cards"""
 
+    version = Game.advance_state_version(h.game_id)
     db.session.commit()
 
+    publish_game_event(
+        game_id, 'deal cards', version,
+        handId=h.id,
+        handSerialNo=h.serial_no,
+        trump=h.trump,
+        cardsPerPlayer=h.cards_per_player,
+        startingPlayer=starting_player.username
+    )
+
     return jsonify(
         {
             'handId': h.id,
@@ -164,30 +185,29 @@ def get_hand_cards(game_id, hand_id):
         }), 401
     requesting_user = User.verify_api_auth_token(token)
 
-    p = Player.query.filter_by(game_id=game_id, user_id=requesting_user.id).first()
-    if p is None:
+    h = get_hand_state(hand_id)
+    if h is None or h.game_id != int(game_id) or h.is_closed == 1:
         return jsonify({
-            'errors':[
+            'errors': [
                 {
-                    'message': 'User {username} is not participating in game {game_id}!'.format(username=requesting_user.username, game_id=game_id)
+                    'message': 'Hand {hand_id} is closed or does not exist!'.format(hand_id=hand_id)
                 }
             ]
         }), 403
 
-    h = Hand.query.filter_by(id=hand_id).first()
-    if h is None or h.is_closed == 1:
+    if not h.is_registered(requesting_user.id):
         return jsonify({
-            'errors': [
+            'errors':[
                 {
-                    'message': 'Hand {hand_id} is closed or does not exist!'.format(hand_id=hand_id)
+                    'message': 'User {username} is not participating in game {game_id}!'.format(username=requesting_user.username, game_id=game_id)
                 }
             ]
         }), 403
 
     if str(request.args.get('burned')).lower() == 'y':
-        cards = h.get_user_initial_hand(requesting_user, h.trump)
+        cards_in_hand = h.get_user_initial_hand(requesting_user.id, h.trump)
     else:
-        cards = h.get_user_current_hand(requesting_user, h.trump)
+        cards_in_hand = h.get_user_current_hand(requesting_user.id, h.trump)
 
     return jsonify({
         'gameId': game_id,
@@ -195,8 +215,8 @@ def get_hand_cards(game_id, hand_id):
         'cardsPerPlayer': h.cards_per_player,
         'trump': h.trump,
         'player': requesting_user.username,
-        'cardsInHand': cards,
-        'myPosition': h.get_players_relative_positions(requesting_user.id)
+        'cardsInHand': cards_in_hand,
+        'myPosition': h.get_turn_position(requesting_user.id)
     }), 200
 
 
@@ -209,6 +229,13 @@ def status(game_id, hand_id):
     if token:
         requesting_user = User.verify_api_auth_token(token)
 
+    # every hand change advances its game state version, tag is personal like the status (myPosition)
+    requesting_user_id = requesting_user.id if requesting_user else 0
+    version = Game.get_state_version(game_id)
+    etag = resource_etag(version, 'game', game_id, 'hand', hand_id, 'user', requesting_user_id)
+    if version is not None and is_fresh(etag):
+        return not_modified(etag)
+
     game = Game.query.filter_by(id=game_id).first()
     if not game:
         return jsonify({
@@ -217,7 +244,7 @@ def status(game_id, hand_id):
             ]
         }), 404
 
-    hand = Hand.query.filter_by(id=hand_id).first()
+    hand = get_hand_state(hand_id, version)
     if not hand:
         return jsonify({
             'errors':[
@@ -231,34 +258,31 @@ def status(game_id, hand_id):
             ]
         }), 404
 
-    players = Player.query.filter_by(game_id=game_id).order_by(Player.position).all()
     players_enriched = []
-    for player in players:
-        user = User.query.filter_by(id=player.user_id).first()
-        if user == requesting_user:
-            my_position = hand.get_position(user)
-        if user:
-            user_scores = HandScore.query.filter_by(player_id=user.id, hand_id=hand_id).first()
-            players_enriched.append({
-                'username': user.username,
-                'position': hand.get_position(user),
-                'betSize': user_scores.bet_size if user_scores else None,
-                'tookTurns': user_scores.took_turns() if user_scores else 0,
-                'cardsOnHand': len(hand.get_user_current_hand(user))
-            })
+    for position in sorted(hand.seats):
+        user_id = hand.seats[position]
+        if requesting_user and user_id == requesting_user.id:
+            my_position = hand.get_position(user_id)
+        players_enriched.append({
+            'username': hand.username(user_id),
+            'position': hand.get_position(user_id),
+            'betSize': hand.bets.get(user_id),
+            'tookTurns': hand.took_turns(user_id) if user_id in hand.bets else 0,
+            'cardsOnHand': hand.cards_on_hand(user_id)
+        })
 
     current_turn = hand.get_current_turn(closed=True)
     next_player = hand.next_acting_player()
 
     cards_on_table = []
     if current_turn:
-        for card in current_turn.stroke_cards():
-            cards_on_table.append(str(card.card_id) + card.card_suit)
+        for player_id, card in current_turn.cards:
+            cards_on_table.append(cards.decode(card))
 
-    return jsonify({
+    return conditional(jsonify({
             'handId': hand.id,
             'betsAreMade': hand.all_bets_made(),
-            'nextActingPlayer': next_player.username if next_player else None,
+            'nextActingPlayer': hand.username(next_player),
             'gameId': game.id,
             'roomId': game.room_id,
             'handSerialNo': hand.serial_no,
@@ -270,4 +294,4 @@ def status(game_id, hand_id):
             'myPosition': my_position,
             'cardsOnTable': cards_on_table,
             'currentTurnSerialNo': current_turn.serial_no if current_turn else None
-    }), 200
+    }), resource_etag(hand.version, 'game', game_id, 'hand', hand_id, 'user', requesting_user_id)), 200
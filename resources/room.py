@@ -3,9 +3,12 @@
 from flask import url_for, request, jsonify, Blueprint
 from flask_cors import cross_origin
 from app import db
-from app.models import User, Room
+from app.models import User, Room, Game
+from app.cache import lobby_cache
+from app.socket import join_room_channel, leave_room_channel, close_room_channels
+from app.etag import resource_etag, is_fresh, not_modified, conditional
 from datetime import datetime
-from config import get_settings, get_environment
+from config import get_settings, get_environment, settings
 
 
 room = Blueprint('room', __name__)
@@ -47,6 +50,21 @@ def generate_games_json(target_room):
             games_json['ongoingGameId'] = game.id
     return games_json
 
+
+def time_ago(moment):
+    time_delta_from_now = (datetime.utcnow() - moment).total_seconds()
+    minutes_delta = round(time_delta_from_now / 60)
+    hours_delta = round(time_delta_from_now / 3600)
+    days_delta = round(time_delta_from_now / (3600 * 24))
+    if days_delta > 0:
+        return str(days_delta) + ' days ago'
+    elif hours_delta > 0:
+        return str(hours_delta) + ' hrs ago'
+    elif minutes_delta > 0:
+        return str(minutes_delta) + ' min ago'
+    return 'just now'
+
+
 @room.route('{base_path}/room/all'.format(base_path=get_settings('API_BASE_PATH')[env]), methods=['POST'])
 @cross_origin()
 def get_list():
@@ -56,32 +74,17 @@ def get_list():
         requesting_user = User.verify_auth_token(token)
         if requesting_user:
             connected_room = requesting_user.get_connected_room_id()
-    rooms = Room.query.filter_by(closed=None).all()
-    if str(request.args.get('closed')).lower() == 'y':
-        rooms = Room.query.all()
+    include_closed = str(request.args.get('closed')).lower() == 'y'
+    lobby = lobby_cache.get(include_closed)
+    if lobby is None:
+        lobby = Room.get_lobby(include_closed)
+        lobby_cache.set(include_closed, lobby)
     rooms_json = []
-    for room in rooms:
-        time_delta_from_now = (datetime.utcnow() - room.created).total_seconds()
-        minutes_delta = round(time_delta_from_now / 60)
-        hours_delta = round(time_delta_from_now / 3600)
-        days_delta = round(time_delta_from_now / (3600 * 24))
-        time_ago_string = 'just now'
-        if days_delta > 0:
-            time_ago_string = str(days_delta) + ' days ago'
-        elif hours_delta > 0:
-            time_ago_string = str(hours_delta) + ' hrs ago'
-        elif minutes_delta > 0:
-            time_ago_string = str(minutes_delta) + ' min ago'
-        rooms_json.append({
-            'roomId': room.id,
-            'roomName': room.room_name,
-            'host': room.host.username,
-            'status': room.current_status(),
-            'created': time_ago_string,
-            'closed': room.closed,
-            'connectedUsers': room.connected_users.count(),
-            'connect': url_for('room.connect', room_id=room.id)
-        })
+    for room_row in lobby:
+        room_json = dict(room_row)
+        room_json['created'] = time_ago(room_row['created'])
+        room_json['connect'] = url_for('room.connect', room_id=room_row['roomId'])
+        rooms_json.append(room_json)
 
     return jsonify({
         'rooms': rooms_json,
@@ -132,6 +135,7 @@ def create():
     db.session.add(new_room)
     new_room.connect(requesting_user)
     db.session.commit()
+    join_room_channel(requesting_user.id, new_room.id)
 
     return jsonify({
         'roomId': new_room.id,
@@ -180,13 +184,17 @@ def close(room_id):
         }), 403
 
     for game in target_room.games:
+        if game.finished is None:
+            Game.advance_state_version(game.id)
         game.finished = datetime.utcnow()
 
     for user in target_room.connected_users:
         target_room.disconnect(user)
 
     target_room.closed = datetime.utcnow()
+    Room.advance_state_version(target_room.id)
     db.session.commit()
+    close_room_channels(target_room.id, [game.id for game in target_room.games])
 
     return jsonify({
         'roomId': target_room.id,
@@ -242,7 +250,7 @@ def connect(room_id):
                 }
             ]
         }), 400
-    if target_room.connected_users.count() >= get_settings('GAME')['MAX_PLAYERS'][env]:
+    if target_room.connected_users.count() >= settings().GAME['MAX_PLAYERS']:
         return jsonify({
             'errors': [
                 {
@@ -253,6 +261,7 @@ def connect(room_id):
 
     target_room.connect(requesting_user)
     db.session.commit()
+    join_room_channel(requesting_user.id, target_room.id)
 
     return jsonify({
         'roomId': target_room.id,
@@ -320,6 +329,7 @@ def disconnect(room_id):
         }), 403
 
     target_room.disconnect(disconnecting_user)
+    leave_room_channel(disconnecting_user.id, target_room.id)
 
     return jsonify({
         'roomId': target_room.id,
@@ -336,6 +346,11 @@ def disconnect(room_id):
 @room.route('{base_path}/room/<room_id>'.format(base_path=get_settings('API_BASE_PATH')[env]), methods=['GET'])
 @cross_origin()
 def status(room_id):
+    version = Room.get_state_version(room_id)
+    etag = resource_etag(version, 'room', room_id)
+    if version is not None and is_fresh(etag):
+        return not_modified(etag)
+
     room = Room.query.filter_by(id=room_id).first()
     if not room:
         return jsonify({
@@ -350,7 +365,7 @@ def status(room_id):
     users_json = generate_users_json(room,connected_users)
     games_json = generate_games_json(room)
 
-    return jsonify({
+    return conditional(jsonify({
             'roomId': room.id,
             'roomName': room.room_name,
             'host': room.host.username,
@@ -360,7 +375,7 @@ def status(room_id):
             'connectedUserList': users_json,
             'connect': url_for('room.connect', room_id=room.id),
             'games': games_json
-    }), 200
+    }), resource_etag(room.state_version, 'room', room_id)), 200
 
 
 @room.route('{base_path}/room/<room_id>/ready'.format(base_path=get_settings('API_BASE_PATH')[env]), methods=['POST'])
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 
-from flask import url_for, request, jsonify, Blueprint
+from flask import url_for, request, jsonify, Blueprint, current_app
 from flask_cors import cross_origin
-from app import app, db
+from app import db
 from app.models import User, Token
 from datetime import datetime
 import re
@@ -222,7 +222,7 @@ def send_password_recovery():
 
     email = request.json.get('email')
     username = request.json.get('username')
-    if app.debug:
+    if current_app.debug:
         print(email)
         print(username)
     err = False
@@ -396,7 +396,7 @@ def new_password():
             'errors': errors
         }), 400
     else:
-        if app.debug:
+        if current_app.debug:
             print('setting new password')
             print(new_password)
         requesting_user.set_password(new_password)
@@ -448,7 +448,7 @@ def upload_profile_pic(username):
             ]
         }), 403'''
     file = request.files['avatar']
-    if app.debug:
+    if current_app.debug:
         print(file.filename)
     if file.filename == '':
         return jsonify({
@@ -479,7 +479,7 @@ def upload_profile_pic(username):
         return jsonify({
             'errors': [
                 {
-                    'message': 'File size exceeds limit of {limit}!'.format(limit = app.config('MAX_CONTENT_SIZE'))
+                    'message': 'File size exceeds limit of {limit}!'.format(limit = current_app.config('MAX_CONTENT_SIZE'))
                 }
             ]
         }), 403'''
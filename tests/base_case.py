@@ -1,12 +1,67 @@
 import unittest
+from contextlib import contextmanager
+from sqlalchemy import event
 from app import app, db
+from app.models import User, Room, Game, Player, Hand, DealtCards
+from app.game_state import reset_hand_states
+from app.cache import ratings_cache, auth_cache, lobby_cache
+
+
+@contextmanager
+def count_statements(engine=None):
+    # collects sql statements executed inside with block: with count_statements() as statements
+    engine = engine or db.engine
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+def seed_game(usernames=('matroskin', 'pechkin', 'sharik'), seed=None):
+    # started game of given users (first one hosts the room), players are seated in order of usernames
+    users = []
+    for username in usernames:
+        u = User(email=username + '@prostokvashino.ussr', username=username)
+        db.session.add(u)
+        users.append(u)
+    db.session.commit()
+    r = Room(room_name='Prostokvashino', host=users[0])
+    db.session.add(r)
+    db.session.commit()
+    g = Game(room=r, seed=seed)
+    db.session.add(g)
+    db.session.commit()
+    for position, u in enumerate(users, start=1):
+        g.connect(u)
+        db.session.add(Player(game_id=g.id, user_id=u.id, position=position))
+    db.session.commit()
+    return r, g, users
+
+
+def seed_hand(g, users, cards=None, trump='d'):
+    # first hand of game, cards of each player are given or dealt from unshuffled deck (5 per player)
+    if cards is None:
+        deck = [grade + suit for grade in '23456789tjqka' for suit in 'dhcs']
+        cards = [deck[position:5 * len(users):len(users)] for position in range(len(users))]
+    h = Hand(game_id=g.id, serial_no=1, trump=trump, cards_per_player=len(cards[0]), starting_player=users[0].id)
+    db.session.add(h)
+    db.session.flush()
+    for i in range(len(cards[0])):
+        for u, user_cards in zip(users, cards):
+            db.session.add(DealtCards(hand_id=h.id, player_id=u.id, card_id=user_cards[i][:1], card_suit=user_cards[i][1:]))
+    db.session.commit()
+    return h
 
 
 class BaseCase(unittest.TestCase):
     def setUp(self):
         with app.app_context():
-            app.config['ENVIRONMENT'] = 'TEST'
-            app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
             self.app = app.test_client()
             self.db = db.create_all()
 
@@ -14,3 +69,7 @@ class BaseCase(unittest.TestCase):
         with app.app_context():
             db.session.remove()
             db.drop_all()
+            reset_hand_states()
+            ratings_cache.clear()
+            auth_cache.clear()
+            lobby_cache.clear()
@@ -0,0 +1,91 @@
+import unittest
+from app import app
+from app.game_state import get_hand_state
+from tests.base_case import BaseCase, count_statements, seed_game, seed_hand
+from config import get_settings, get_environment
+
+
+class ConditionalStatusCase(BaseCase):
+
+    def request(self, method, url, etag=None, json=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        with count_statements() as statements:
+            response = self.app.open('{base_path}{url}'.format(base_path=get_settings('API_BASE_PATH')[get_environment()], url=url),
+                                     method=method, headers=headers, json=json)
+        return response, len(statements)
+
+    def test_game_status(self):
+        with app.app_context():
+            # Given
+            r, g, users = seed_game()
+            h = seed_hand(g, users)
+            token = users[0].generate_auth_token()
+            status, status_queries = self.request('POST', '/game/{}'.format(g.id), json={'token': token})
+
+            # When
+            not_modified, not_modified_queries = self.request('POST', '/game/{}'.format(g.id), status.headers['ETag'], json={'token': token})
+            other_user_status, _ = self.request('POST', '/game/{}'.format(g.id), status.headers['ETag'], json={'token': users[1].generate_auth_token()})
+
+            # Then
+            self.assertEqual(200, status.status_code, msg='Failed to get game status! Response code is {}'.format(status.status_code))
+            self.assertEqual(304, not_modified.status_code, msg='Unchanged game status should not be sent again!')
+            self.assertEqual(b'', not_modified.data, msg='Not modified response should have no body!')
+            self.assertEqual(status.headers['ETag'], not_modified.headers['ETag'], msg='Not modified response should repeat tag!')
+            self.assertEqual(1, not_modified_queries, msg='Not modified game status should cost single query ({} queries)!'.format(not_modified_queries))
+            self.assertLess(not_modified_queries, status_queries, msg='Not modified game status should be cheaper than full one!')
+            self.assertEqual(200, other_user_status.status_code, msg='Game status tag should be personal!')
+
+            # When
+            get_hand_state(h.id).place_bet(users[0].id, 1)
+            changed, _ = self.request('POST', '/game/{}'.format(g.id), status.headers['ETag'], json={'token': token})
+
+            # Then
+            self.assertEqual(200, changed.status_code, msg='Game status should be sent again after bet!')
+            self.assertNotEqual(status.headers['ETag'], changed.headers['ETag'], msg='Game status tag should change after bet!')
+            self.assertEqual(1, changed.get_json()['players'][0]['betSize'], msg='Game status should contain placed bet!')
+
+    def test_hand_status_and_score(self):
+        with app.app_context():
+            # Given
+            r, g, users = seed_game()
+            h = seed_hand(g, users)
+            token = users[0].generate_auth_token()
+            hand_status, _ = self.request('POST', '/game/{}/hand/{}'.format(g.id, h.id), json={'token': token})
+            score, _ = self.request('GET', '/game/{}/score'.format(g.id))
+
+            # When
+            hand_not_modified, _ = self.request('POST', '/game/{}/hand/{}'.format(g.id, h.id), hand_status.headers['ETag'], json={'token': token})
+            score_not_modified, _ = self.request('GET', '/game/{}/score'.format(g.id), score.headers['ETag'])
+            get_hand_state(h.id).place_bet(users[0].id, 1)
+            hand_changed, _ = self.request('POST', '/game/{}/hand/{}'.format(g.id, h.id), hand_status.headers['ETag'], json={'token': token})
+
+            # Then
+            self.assertEqual(304, hand_not_modified.status_code, msg='Unchanged hand status should not be sent again!')
+            self.assertEqual(304, score_not_modified.status_code, msg='Unchanged game score should not be sent again!')
+            self.assertEqual(200, hand_changed.status_code, msg='Hand status should be sent again after bet!')
+            self.assertEqual(1, hand_changed.get_json()['players'][0]['betSize'], msg='Hand status should contain placed bet!')
+
+    def test_room_status(self):
+        with app.app_context():
+            # Given
+            r, g, users = seed_game()
+            h = seed_hand(g, users)
+            r.connect(users[0])
+            r.connect(users[1])
+            status, _ = self.request('GET', '/room/{}'.format(r.id))
+
+            # When
+            not_modified, not_modified_queries = self.request('GET', '/room/{}'.format(r.id), status.headers['ETag'])
+            r.ready(users[1])
+            changed, _ = self.request('GET', '/room/{}'.format(r.id), status.headers['ETag'])
+
+            # Then
+            self.assertEqual(304, not_modified.status_code, msg='Unchanged room status should not be sent again!')
+            self.assertEqual(1, not_modified_queries, msg='Not modified room status should cost single query ({} queries)!'.format(not_modified_queries))
+            self.assertEqual(200, changed.status_code, msg='Room status should be sent again after user is ready!')
+            self.assertEqual({'matroskin': True, 'pechkin': True}, {u['username']: u['ready'] for u in changed.get_json()['connectedUserList']},
+                             msg='Room status should contain readiness change!')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
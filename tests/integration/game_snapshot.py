@@ -0,0 +1,92 @@
+import unittest
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from app.models import Hand, DealtCards
+from app.game_state import get_hand_state, reset_hand_states
+from tests.base_case import BaseCase, count_statements, seed_game, seed_hand
+from config import get_settings, get_environment
+
+
+class GameSnapshotCase(BaseCase):
+
+    def play_game(self, players_count, turns_count):
+        r, g, users = seed_game(['player{}of{}'.format(i, players_count) for i in range(players_count)])
+        h = seed_hand(g, users)
+
+        state = get_hand_state(h.id)
+        for i in range(players_count):
+            state.place_bet(state.next_acting_player(), 0 if i else 1)
+        for i in range(turns_count * players_count):
+            actor = state.next_acting_player()
+            state.put_card(actor, state.get_user_cards(actor)[0])
+        return g, users[0].generate_auth_token()
+
+    def count_status_queries(self, game_id, token):
+        reset_hand_states()
+        with count_statements() as statements:
+            response = self.app.post('{base_path}/game/{game_id}'.format(
+                base_path=get_settings('API_BASE_PATH')[get_environment()], game_id=game_id), json={'token': token})
+        self.assertEqual(200, response.status_code, msg='Failed to get game status! Response code is {}'.format(response.status_code))
+        return len(statements)
+
+    def test_status_query_count(self):
+        with app.app_context():
+            # Given
+            small_game, small_game_token = self.play_game(players_count=3, turns_count=1)
+            big_game, big_game_token = self.play_game(players_count=6, turns_count=3)
+
+            # When
+            small_game_queries = self.count_status_queries(small_game.id, small_game_token)
+            big_game_queries = self.count_status_queries(big_game.id, big_game_token)
+
+            # Then
+            self.assertEqual(small_game_queries, big_game_queries,
+                             msg='Game status query count depends on number of players and turns ({} vs {})!'.format(small_game_queries, big_game_queries))
+            self.assertLessEqual(big_game_queries, 15, msg='Too many queries ({}) in game status!'.format(big_game_queries))
+
+    def count_deal_queries(self, players_count):
+        r, g, users = seed_game(['dealer{}of{}'.format(i, players_count) for i in range(players_count)])
+        with count_statements() as statements:
+            response = self.app.post('{base_path}/game/{game_id}/hand/deal'.format(
+                base_path=get_settings('API_BASE_PATH')[get_environment()], game_id=g.id), json={'token': users[0].generate_auth_token()})
+        self.assertEqual(200, response.status_code, msg='Failed to deal cards! Response code is {}'.format(response.status_code))
+        self.assertEqual(min(52 // players_count, 10) * players_count, DealtCards.query.filter_by(hand_id=response.get_json()['handId']).count(),
+                         msg='Wrong number of dealt cards!')
+        return len(statements)
+
+    def test_deal_query_count(self):
+        with app.app_context():
+            # When
+            small_deal_queries = self.count_deal_queries(players_count=3)
+            big_deal_queries = self.count_deal_queries(players_count=10)
+
+            # Then
+            self.assertEqual(small_deal_queries, big_deal_queries,
+                             msg='Deal query count depends on number of players ({} vs {})!'.format(small_deal_queries, big_deal_queries))
+
+    def catch_integrity_error(self, hand):
+        db.session.add(hand)
+        try:
+            db.session.flush()
+        except IntegrityError as error:
+            return error
+        finally:
+            db.session.rollback()
+
+    def test_hand_integrity_errors(self):
+        with app.app_context():
+            # Given
+            g, token = self.play_game(players_count=3, turns_count=0)
+            g_id = g.id
+
+            # When
+            duplicate_hand_error = self.catch_integrity_error(Hand(game_id=g_id, serial_no=1, trump='d', cards_per_player=5, is_closed=0))
+            hand_without_game_error = self.catch_integrity_error(Hand(game_id=None, serial_no=2, trump='d', cards_per_player=5, is_closed=0))
+
+            # Then
+            self.assertTrue(Hand.is_serial_no_conflict(duplicate_hand_error), msg='Duplicate hand should be recognized as deal conflict!')
+            self.assertFalse(Hand.is_serial_no_conflict(hand_without_game_error), msg='Other integrity errors are not deal conflicts!')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
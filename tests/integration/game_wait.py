@@ -0,0 +1,87 @@
+import unittest
+from threading import Thread
+from time import monotonic, sleep
+from app import app
+from app.game_state import get_hand_state
+from app.game_changes import game_changes
+from tests.base_case import BaseCase, seed_game, seed_hand
+from config import get_settings, get_environment
+
+
+class GameWaitCase(BaseCase):
+
+    def wait(self, game_id, since, token, timeout=5):
+        return self.app.get('{base_path}/game/{game_id}/wait?since={since}&timeout={timeout}'.format(
+            base_path=get_settings('API_BASE_PATH')[get_environment()], game_id=game_id, since=since, timeout=timeout),
+            headers={'Authorization': 'Bearer {}'.format(token)})
+
+    def test_wait_timeout(self):
+        with app.app_context():
+            # Given
+            r, g, users = seed_game()
+            h = seed_hand(g, users)
+            token = users[0].generate_auth_token()
+
+            # When
+            outdated = self.wait(g.id, -1, token)
+            started = monotonic()
+            up_to_date = self.wait(g.id, 0, token, timeout=0.2)
+            waited = monotonic() - started
+            unknown_game = self.wait(g.id + 1, 0, token)
+
+            # Then
+            self.assertEqual(200, outdated.status_code, msg='Failed to wait for game change! Response code is {}'.format(outdated.status_code))
+            self.assertFalse(outdated.get_json()['upToDate'], msg='Outdated client should get game status at once!')
+            self.assertEqual(g.id, outdated.get_json()['status']['gameId'], msg='Wrong game status!')
+            self.assertEqual('matroskin', outdated.get_json()['status']['myInHandInfo']['username'], msg='Status should be personal for authorized client!')
+            self.assertTrue(up_to_date.get_json()['upToDate'], msg='Client should be up to date after timeout!')
+            self.assertIsNone(up_to_date.get_json()['status'], msg='No status should be sent to up to date client!')
+            self.assertGreaterEqual(waited, 0.2, msg='Request should be parked until timeout!')
+            self.assertEqual(404, unknown_game.status_code, msg='Waiting for unknown game should fail!')
+            self.assertEqual('<GameChanges of 0 games>', repr(game_changes), msg='Finished waits should stop listening!')
+
+    def test_wait_invalid_timeout(self):
+        with app.app_context():
+            # Given
+            r, g, users = seed_game()
+            h = seed_hand(g, users)
+            token = users[0].generate_auth_token()
+
+            # When
+            started = monotonic()
+            responses = [self.wait(g.id, 0, token, timeout=timeout) for timeout in ['nan', 'inf', '-inf', 'soon']]
+            waited = monotonic() - started
+            negative_timeout = self.wait(g.id, 0, token, timeout=-5)
+
+            # Then
+            self.assertEqual([400, 400, 400, 400], [response.status_code for response in responses], msg='Non-finite timeout should be rejected!')
+            self.assertLess(waited, 1, msg='Rejected requests should not be parked!')
+            self.assertTrue(negative_timeout.get_json()['upToDate'], msg='Negative timeout should be treated as no wait!')
+
+    def test_wait_is_woken_by_change(self):
+        with app.app_context():
+            # Given
+            r, g, users = seed_game()
+            h = seed_hand(g, users)
+            token = users[0].generate_auth_token()
+            game_id = g.id
+            responses = []
+            waiter = Thread(target=lambda: responses.append(self.wait(game_id, 0, token, timeout=10)))
+            started = monotonic()
+            waiter.start()
+            sleep(0.2)
+
+            # When
+            get_hand_state(h.id).place_bet(users[0].id, 1)
+            waiter.join(10)
+            waited = monotonic() - started
+
+            # Then
+            self.assertEqual(1, len(responses), msg='Parked request was not woken by bet!')
+            self.assertLess(waited, 1, msg='Parked request should be woken by bet, not by recheck or timeout ({:.1f}s)!'.format(waited))
+            self.assertEqual(1, responses[0].get_json()['version'], msg='Woken request should get new state version!')
+            self.assertEqual(1, responses[0].get_json()['status']['players'][0]['betSize'], msg='Woken request should get status with bet!')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -1,7 +1,9 @@
 import unittest
-from app import app
+from app import app, db
+from app.models import User, Stats
+from app.cache import ratings_cache
 from tests.base_case import BaseCase
-from config import get_settings
+from config import get_settings, get_environment
 
 
 class GeneralMethodsCase(BaseCase):
@@ -22,6 +24,46 @@ class GeneralMethodsCase(BaseCase):
                          msg="Failed to get game info! Response code is {}".format(info_response.status_code))
         self.assertIsNotNone(info_response.json['info'], msg="Info field is empty in response!")
 
+    def test_ratings(self):
+        with app.app_context():
+            # Given
+            ratings_url = '{base_path}/ratings'.format(base_path=get_settings('API_BASE_PATH')[get_environment()])
+            results = {
+                'matroskin': (4, 2, 300),
+                'pechkin': (2, 2, 300),
+                'sharik': (2, 1, 300),
+                'galchonok': (1, 0, 120),
+                'fedor': (0, 0, 0)
+            }
+            for username, (games_played, games_won, total_score) in results.items():
+                u = User(email=username + '@prostokvashino.ussr', username=username)
+                db.session.add(u)
+                db.session.commit()
+                db.session.add(Stats(user_id=u.id, games_played=games_played, games_won=games_won, total_score=total_score, sum_of_bets=0, bonuses=0))
+            db.session.commit()
+            ratings_cache.clear()
+
+            # When
+            usernames = []
+            cursor = None
+            pages = 0
+            while True:
+                ratings_response = self.app.get(ratings_url, query_string={'limit': 2, 'cursor': cursor} if cursor else {'limit': 2})
+                self.assertEqual(200, ratings_response.status_code,
+                                 msg="Failed to get ratings! Response code is {}".format(ratings_response.status_code))
+                usernames += [rating['username'] for rating in ratings_response.json]
+                pages += 1
+                cursor = ratings_response.headers.get('X-Next-Cursor')
+                if not cursor:
+                    break
+
+            # Then
+            self.assertEqual(['pechkin', 'sharik', 'matroskin', 'galchonok'], usernames,
+                             msg="Ratings should be ordered by total score, win ratio and average score!")
+            self.assertEqual(2, pages, msg="Ratings are paginated incorrectly!")
+            self.assertEqual(400, self.app.get(ratings_url, query_string={'limit': 0}).status_code, msg="Zero limit should not be allowed!")
+            self.assertEqual(400, self.app.get(ratings_url, query_string={'cursor': 'wrong'}).status_code, msg="Invalid cursor should not be allowed!")
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
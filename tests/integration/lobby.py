@@ -0,0 +1,54 @@
+import unittest
+from app import app, db
+from app.models import User, Room, Game
+from tests.base_case import BaseCase, count_statements
+from config import get_settings, get_environment
+
+
+class LobbyCase(BaseCase):
+
+    def get_lobby(self):
+        with count_statements() as statements:
+            response = self.app.post('{base_path}/room/all'.format(base_path=get_settings('API_BASE_PATH')[get_environment()]), json={})
+        self.assertEqual(200, response.status_code, msg='Failed to get rooms list! Response code is {}'.format(response.status_code))
+        return response.get_json()['rooms'], len(statements)
+
+    def test_lobby(self):
+        with app.app_context():
+            # Given
+            users = []
+            for username in ['matroskin', 'pechkin', 'sharik']:
+                u = User(email=username + '@prostokvashino.ussr', username=username)
+                db.session.add(u)
+                users.append(u)
+            db.session.commit()
+            rooms = [Room(room_name='Prostokvashino', host=users[0]), Room(room_name='Post office', host=users[1])]
+            db.session.add_all(rooms)
+            db.session.commit()
+            rooms[0].connect(users[0])
+            rooms[0].connect(users[2])
+            rooms[1].connect(users[1])
+            db.session.add(Game(room=rooms[1]))
+            db.session.commit()
+
+            # When
+            lobby, lobby_queries = self.get_lobby()
+            cached_lobby, cached_lobby_queries = self.get_lobby()
+
+            # Then
+            self.assertEqual([('Prostokvashino', 'matroskin', 'open', 2), ('Post office', 'pechkin', 'started', 1)],
+                             [(r['roomName'], r['host'], r['status'], r['connectedUsers']) for r in lobby], msg='Wrong lobby rooms!')
+            self.assertEqual(1, lobby_queries, msg='Lobby should be loaded with single query!')
+            self.assertEqual(lobby, cached_lobby, msg='Cached lobby differs from loaded one!')
+            self.assertEqual(0, cached_lobby_queries, msg='Cached lobby should not query db!')
+
+            # When
+            rooms[0].disconnect(users[2])
+            lobby, lobby_queries = self.get_lobby()
+
+            # Then
+            self.assertEqual(1, lobby[0]['connectedUsers'], msg='Lobby should be refreshed after room change!')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
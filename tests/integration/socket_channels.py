@@ -0,0 +1,169 @@
+import unittest
+from unittest import mock
+from app import app, db, socketio
+from app.models import User, Room, Game, Player, Hand, DealtCards
+from app.socket import room_channel, game_channel
+from tests.base_case import BaseCase
+from config import get_settings, get_environment
+
+
+class SocketChannelsCase(BaseCase):
+
+    def seed_table(self, username, room_name):
+        u = User(email=username + '@prostokvashino.ussr', username=username)
+        db.session.add(u)
+        db.session.commit()
+        r = Room(room_name=room_name, host=u)
+        db.session.add(r)
+        db.session.commit()
+        r.connect(u)
+        g = Game(room=r)
+        db.session.add(g)
+        db.session.commit()
+        g.connect(u)
+        db.session.commit()
+        return u, r, g
+
+    def subscribers(self, namespace, channel):
+        return [eio_sid for sid, eio_sid in socketio.server.manager.get_participants(namespace, channel)]
+
+    def test_game_sockets_join_own_table_only(self):
+        with app.app_context():
+            # Given
+            matroskin, matroskin_room, matroskin_game = self.seed_table('matroskin', 'Prostokvashino')
+            pechkin, pechkin_room, pechkin_game = self.seed_table('pechkin', 'Post office')
+
+            # When
+            matroskin_socket = socketio.test_client(app, namespace='/game', auth={'token': matroskin.generate_auth_token()})
+            pechkin_socket = socketio.test_client(app, namespace='/game', auth={'token': pechkin.generate_auth_token()})
+            anonymous_socket = socketio.test_client(app, namespace='/game')
+
+            # Then
+            self.assertEqual([matroskin_socket.eio_sid], self.subscribers('/game', game_channel(matroskin_game.id)),
+                             msg='Only players of the table should be subscribed to game events!')
+            self.assertEqual([pechkin_socket.eio_sid], self.subscribers('/game', game_channel(pechkin_game.id)),
+                             msg='Only players of the table should be subscribed to game events!')
+
+            # When
+            anonymous_socket.emit('join_game', 'wrong token', matroskin_game.id, namespace='/game')
+            pechkin_socket.emit('join_game', pechkin.generate_auth_token(), matroskin_game.id, namespace='/game')
+
+            # Then
+            self.assertEqual([matroskin_socket.eio_sid], self.subscribers('/game', game_channel(matroskin_game.id)),
+                             msg='Users not connected to the room should not subscribe to its game events!')
+
+            matroskin_socket.disconnect(namespace='/game')
+            pechkin_socket.disconnect(namespace='/game')
+            anonymous_socket.disconnect(namespace='/game')
+
+    def test_room_channel_follows_rest_connection(self):
+        with app.app_context():
+            # Given
+            matroskin, matroskin_room, matroskin_game = self.seed_table('matroskin', 'Prostokvashino')
+            sharik = User(email='sharik@prostokvashino.ussr', username='sharik')
+            db.session.add(sharik)
+            db.session.commit()
+            sharik_token = sharik.generate_auth_token()
+            matroskin_socket = socketio.test_client(app, namespace='/room', auth={'token': matroskin.generate_auth_token()})
+            sharik_socket = socketio.test_client(app, namespace='/room', auth={'token': sharik_token})
+            room_url = '{base_path}/room/{room_id}'.format(base_path=get_settings('API_BASE_PATH')[get_environment()], room_id=matroskin_room.id)
+            channel = room_channel(matroskin_room.id)
+
+            # When
+            connect_response = self.app.post(room_url + '/connect', json={'token': sharik_token})
+
+            # Then
+            self.assertEqual(201, connect_response.status_code, msg='Failed to connect to room! Response code is {}'.format(connect_response.status_code))
+            self.assertEqual(sorted([matroskin_socket.eio_sid, sharik_socket.eio_sid]), sorted(self.subscribers('/room', channel)),
+                             msg='Connected user should be subscribed to room events!')
+
+            # When
+            self.app.post(room_url + '/disconnect', json={'token': sharik_token, 'username': 'sharik'})
+
+            # Then
+            self.assertEqual([matroskin_socket.eio_sid], self.subscribers('/room', channel),
+                             msg='Disconnected user should be unsubscribed from room events!')
+
+            matroskin_socket.disconnect(namespace='/room')
+            sharik_socket.disconnect(namespace='/room')
+
+    def test_moves_publish_game_deltas(self):
+        with app.app_context():
+            # Given
+            users = []
+            for username in ['matroskin', 'pechkin', 'sharik']:
+                u = User(email=username + '@prostokvashino.ussr', username=username)
+                db.session.add(u)
+                users.append(u)
+            db.session.commit()
+            r = Room(room_name='Prostokvashino', host=users[0])
+            db.session.add(r)
+            db.session.commit()
+            g = Game(room=r)
+            db.session.add(g)
+            db.session.commit()
+            for position, u in enumerate(users, start=1):
+                r.connect(u)
+                g.connect(u)
+                db.session.add(Player(game_id=g.id, user_id=u.id, position=position))
+            h = Hand(game_id=g.id, serial_no=1, trump='d', cards_per_player=1, starting_player=users[0].id)
+            db.session.add(h)
+            db.session.flush()
+            for u, card in zip(users, ['as', 'ks', 'jd']):
+                db.session.add(DealtCards(hand_id=h.id, player_id=u.id, card_id=card[:1], card_suit=card[1:]))
+            db.session.commit()
+            tokens = [u.generate_auth_token() for u in users]
+            turn_url = '{base_path}/game/{game_id}/hand/{hand_id}/turn'.format(base_path=get_settings('API_BASE_PATH')[get_environment()], game_id=g.id, hand_id=h.id)
+
+            # When
+            with mock.patch.object(socketio, 'emit') as emit:
+                bet_response = self.app.post(turn_url + '/bet', json={'token': tokens[0], 'betSize': 1})
+                self.app.post(turn_url + '/bet', json={'token': tokens[1], 'betSize': 1})
+                self.app.post(turn_url + '/bet', json={'token': tokens[2], 'betSize': 0})
+                put_response = self.app.post(turn_url + '/card/put/as', json={'token': tokens[0]})
+
+            # Then
+            self.assertEqual(200, bet_response.status_code, msg='Failed to make bet! Response code is {}'.format(bet_response.status_code))
+            self.assertEqual(200, put_response.status_code, msg='Failed to put card! Response code is {}'.format(put_response.status_code))
+            self.assertEqual(4, emit.call_count, msg='Every move should publish exactly one game event!')
+            bet_event, put_event = emit.call_args_list[0].args[1], emit.call_args_list[-1].args[1]
+            for call in emit.call_args_list:
+                self.assertEqual('refresh_game_table', call.args[0], msg='Game delta is published as wrong event!')
+                self.assertEqual(game_channel(g.id), call.kwargs['to'], msg='Game delta should be published to game table only!')
+            self.assertEqual(('make bet', 'matroskin', 1, 'pechkin'),
+                             (bet_event['event'], bet_event['actor'], bet_event['betSize'], bet_event['nextActingPlayer']), msg='Wrong bet delta!')
+            self.assertEqual(('put card', ['as'], None, 'pechkin'),
+                             (put_event['event'], [card['cardId'] for card in put_event['cardsOnTable']], put_event['tookPlayer'], put_event['nextActingPlayer']),
+                             msg='Wrong put card delta!')
+            self.assertEqual([1, 2, 3, 4], [call.args[1]['version'] for call in emit.call_args_list], msg='Game deltas should carry sequential state versions!')
+
+            # When
+            sync_url = '{base_path}/game/{game_id}/sync'.format(base_path=get_settings('API_BASE_PATH')[get_environment()], game_id=g.id)
+            stale_sync = self.app.post(sync_url, json={'token': tokens[0], 'version': 2}).get_json()
+            actual_sync = self.app.post(sync_url, json={'token': tokens[0], 'version': 4}).get_json()
+
+            # Then
+            self.assertEqual((4, False, 4), (stale_sync['version'], stale_sync['upToDate'], stale_sync['status']['version']),
+                             msg='Client with stale version should get full game status!')
+            self.assertEqual((True, None), (actual_sync['upToDate'], actual_sync['status']), msg='Client with actual version should not get game status!')
+
+    def test_client_moves_are_not_relayed(self):
+        with app.app_context():
+            # Given
+            matroskin, matroskin_room, matroskin_game = self.seed_table('matroskin', 'Prostokvashino')
+            actor_socket = socketio.test_client(app, namespace='/game', auth={'token': matroskin.generate_auth_token()})
+
+            # When
+            with mock.patch.object(socketio, 'emit') as emit:
+                actor_socket.emit('make_bet', matroskin_game.id, 1, 'matroskin', 1, False, 'pechkin', namespace='/game')
+                actor_socket.emit('put_card', matroskin_game.id, 1, 'matroskin', [], None, 'pechkin', False, namespace='/game')
+                actor_socket.emit('finish_game_in_room', 'matroskin', matroskin_game.id, matroskin_room.id, namespace='/game')
+
+            # Then
+            self.assertEqual([], emit.call_args_list, msg='Client moves should be published by server only!')
+
+            actor_socket.disconnect(namespace='/game')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
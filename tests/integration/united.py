@@ -2,6 +2,11 @@ from tests.integration.user import UserMethodsCase
 from tests.integration.room import RoomMethodsCase
 from tests.integration.game import GameMethodsCase
 from tests.integration.hand_turn import HandTurnMethodsCase
+from tests.integration.game_snapshot import GameSnapshotCase
+from tests.integration.socket_channels import SocketChannelsCase
+from tests.integration.lobby import LobbyCase
+from tests.integration.conditional_status import ConditionalStatusCase
+from tests.integration.game_wait import GameWaitCase
 import unittest
 
 
@@ -0,0 +1,32 @@
+import unittest
+from app import create_app, db
+from app.models import User
+
+
+class AppFactoryCase(unittest.TestCase):
+
+    def test_isolated_apps(self):
+        # Given
+        first_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True})
+        second_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True})
+        for test_app in [first_app, second_app]:
+            with test_app.app_context():
+                db.create_all()
+
+        # When
+        with first_app.app_context():
+            db.session.add(User(email='matroskin@prostokvashino.ussr', username='matroskin'))
+            db.session.commit()
+
+        # Then
+        with first_app.app_context():
+            self.assertEqual(1, User.query.count(), msg='User is not saved to app database!')
+        with second_app.app_context():
+            self.assertEqual(0, User.query.count(), msg='Apps should not share in-memory database!')
+        self.assertIn('game.status', second_app.view_functions, msg='Api resources are not registered!')
+        self.assertIn('index', second_app.view_functions, msg='Web routes are not registered!')
+        self.assertIn('scores', second_app.cli.commands, msg='Cli commands are not registered!')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,92 @@
+import unittest
+import random
+from app import cards
+
+
+class CardsCase(unittest.TestCase):
+
+    def test_encoding(self):
+        # Given
+        codes = [grade + suit for grade in '23456789tjqka' for suit in 'dhcs']
+
+        # When
+        encoded = [cards.encode(code) for code in codes]
+
+        # Then
+        self.assertEqual(list(range(52)), sorted(encoded), msg='Cards are not encoded to 0..51!')
+        self.assertEqual(codes, [cards.decode(card) for card in encoded], msg='Decoded cards differ from encoded ones!')
+        self.assertEqual(cards.encode('jd'), cards.encode('JD'), msg='Card encoding should be case insensitive!')
+        self.assertIsNone(cards.encode('1x'), msg='Invalid card should not be encoded!')
+
+    def test_highest_card(self):
+        # Given
+        cards_hierarchy = '23456789tjqka'
+        trump_hierarchy = '2345678tqka9j'
+        generator = random.Random(42)
+        for i in range(2000):
+            trump = generator.choice(['d', 'h', 'c', 's', None])
+            turn_cards = [cards.decode(card) for card in generator.sample(cards.DECK, generator.randint(1, 10))]
+
+            # When
+            highest_card = cards.decode(cards.highest([cards.encode(card) for card in turn_cards], cards.trump_index(trump)))
+
+            # Then
+            expected = turn_cards[0]
+            for card in turn_cards[1:]:
+                if card[1] == trump:
+                    if expected[1] != trump or trump_hierarchy.index(expected[0]) < trump_hierarchy.index(card[0]):
+                        expected = card
+                elif card[1] == turn_cards[0][1] and expected[1] != trump and cards_hierarchy.index(expected[0]) < cards_hierarchy.index(card[0]):
+                    expected = card
+            self.assertEqual(expected, highest_card, msg='Wrong highest card in turn {} with trump {}!'.format(turn_cards, trump))
+
+    def test_legal_moves(self):
+        # Given
+        trump_hierarchy = '2345678tqka9j'
+        generator = random.Random(42)
+        for i in range(2000):
+            trump = generator.choice(['d', 'h', 'c', 's', None])
+            hand_size = generator.randint(1, 10)
+            dealt = [cards.decode(card) for card in generator.sample(cards.DECK, hand_size + generator.randint(1, 5))]
+            hand, turn_cards = dealt[:hand_size], dealt[hand_size:]
+
+            # When
+            legal = cards.from_mask(cards.legal_moves(
+                cards.to_mask([cards.encode(card) for card in hand]),
+                [cards.encode(card) for card in turn_cards],
+                cards.trump_index(trump)
+            ))
+
+            # Then
+            highest_card = cards.decode(cards.highest([cards.encode(card) for card in turn_cards], cards.trump_index(trump)))
+            turn_suit = turn_cards[0][1]
+            expected = []
+            for card in hand:
+                allowed = len(hand) == 1 or card[1] == turn_suit
+                if not allowed and card[1] == trump:
+                    allowed = card[0] == 'j' or highest_card[1] != trump or \
+                        trump_hierarchy.index(card[0]) > trump_hierarchy.index(highest_card[0]) or \
+                        all(other[1] == trump and (other == card or other[0] == 'j' or trump_hierarchy.index(other[0]) <= trump_hierarchy.index(highest_card[0])) for other in hand)
+                elif not allowed:
+                    suitable_cards = [other for other in hand if other[1] == turn_suit]
+                    allowed = not suitable_cards or (turn_suit == trump and suitable_cards == ['j' + trump])
+                if allowed:
+                    expected.append(card)
+            self.assertEqual(sorted(expected), sorted(cards.decode(card) for card in legal),
+                             msg='Wrong legal cards for hand {} in turn {} with trump {}!'.format(hand, turn_cards, trump))
+
+    def test_sort_cards(self):
+        # Given
+        hand = [cards.encode(card) for card in ['9d', 'ah', 'jd', '2s', 'td', 'jh', '3c']]
+
+        # When
+        sorted_with_trump = [cards.decode(card) for card in cards.sort_cards(hand, cards.trump_index('d'))]
+        sorted_without_trump = [cards.decode(card) for card in cards.sort_cards(hand)]
+
+        # Then
+        self.assertEqual(['2s', '3c', 'jh', 'ah', 'td', '9d', 'jd'], sorted_with_trump, msg='Trump suit should be last and ordered by trump hierarchy!')
+        self.assertEqual(['2s', '3c', 'jh', 'ah', '9d', 'td', 'jd'], sorted_without_trump, msg='Cards are sorted incorrectly!')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
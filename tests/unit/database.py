@@ -0,0 +1,44 @@
+import unittest
+import os
+import tempfile
+from sqlalchemy import create_engine, text
+from app.database import engine_options, set_sqlite_pragmas
+
+
+class DatabaseCase(unittest.TestCase):
+
+    def test_engine_options(self):
+        # Given
+        database_cfg = {
+            'ENGINE_OPTIONS': {'pool_size': 20, 'max_overflow': 10, 'pool_recycle': 1800, 'pool_pre_ping': True},
+            'STATEMENT_TIMEOUT': 5000
+        }
+
+        # When
+        postgres_options = engine_options('postgresql://nigels@localhost/nigels', database_cfg)
+        memory_options = engine_options('sqlite://', database_cfg)
+
+        # Then
+        self.assertEqual((20, 10, 1800, True), tuple(postgres_options[option] for option in ['pool_size', 'max_overflow', 'pool_recycle', 'pool_pre_ping']),
+                         msg='Configured engine options are not passed!')
+        self.assertEqual('-c statement_timeout=5000', postgres_options['connect_args']['options'], msg='Statement timeout is not set!')
+        self.assertNotIn('pool_size', memory_options, msg='In-memory database pool has no size!')
+        self.assertNotIn('connect_args', memory_options, msg='Statement timeout is postgres only!')
+
+    def test_sqlite_pragmas(self):
+        # Given
+        path = os.path.join(tempfile.mkdtemp(), 'nigels.db')
+        engine = create_engine('sqlite:///' + path)
+        self.addCleanup(engine.dispose)
+
+        # When
+        set_sqlite_pragmas(engine)
+        with engine.connect() as conn:
+            pragmas = [conn.execute(text('PRAGMA ' + name)).scalar() for name in ['journal_mode', 'synchronous', 'busy_timeout']]
+
+        # Then
+        self.assertEqual(['wal', 1, 5000], pragmas, msg='Sqlite pragmas are not applied on connect!')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
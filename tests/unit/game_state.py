@@ -0,0 +1,258 @@
+import unittest
+from sqlalchemy import event
+from app import db, app, cards
+from app.models import User, Room, Game, Player, Hand, HandScore, GameScore, Stats, Turn, TurnCard
+from app.cache import ratings_cache
+from app.game_state import HandState, get_hand_state, load_hand, forget_hand_state, StateConflict
+from tests.base_case import BaseCase, seed_game, seed_hand
+from config import get_settings, get_environment
+
+
+class HandStateCase(BaseCase):
+
+    def deal(self, cards):
+        r, g, users = seed_game()
+        return users, seed_hand(g, users, cards)
+
+    def test_hand_flow(self):
+        with app.app_context():
+            # Given
+            users, h = self.deal([['9d', 'as'], ['ks', '2s'], ['jd', 'qs']])
+            state = get_hand_state(h.id)
+
+            # When
+            bettors = []
+            for bet_size in [1, 0, 0]:
+                bettor = state.next_acting_player()
+                bettors.append(bettor)
+                state.place_bet(bettor, bet_size)
+
+            # Then
+            self.assertEqual([users[0].id, users[1].id, users[2].id], bettors, msg='Bets are made in wrong order!')
+            self.assertTrue(state.all_bets_made(), msg='All bets should be made!')
+            self.assertEqual(['as', '9d'], state.get_user_current_hand(users[0].id, 'd'), msg='Hand is sorted incorrectly!')
+
+            # When
+            for card in ['as', 'ks', 'qs']:
+                state.put_card(state.next_acting_player(), cards.encode(card))
+
+            # Then
+            turn = state.get_last_turn()
+            self.assertEqual(users[0].id, turn.took_user_id, msg='Highest card owner should take the turn!')
+            self.assertEqual(users[0].id, Turn.query.filter_by(id=turn.id).first().took_user_id, msg='Turn taker is not saved to db!')
+            self.assertEqual(3, TurnCard.query.filter_by(hand_id=h.id).count(), msg='Turn cards are not saved to db!')
+            self.assertEqual(users[0].id, state.next_acting_player(), msg='Turn taker should start next turn!')
+
+            # When
+            for card in ['9d', '2s', 'jd']:
+                state.put_card(state.next_acting_player(), cards.encode(card))
+
+            # Then
+            self.assertEqual(1, state.is_closed, msg='Hand should be closed after last turn!')
+            self.assertIsNone(state.next_acting_player(), msg='Nobody acts in closed hand!')
+            forget_hand_state(h.id)
+            reloaded = get_hand_state(h.id)
+            self.assertEqual(1, reloaded.is_closed, msg='Hand closing is not saved to db!')
+            self.assertEqual(users[2].id, reloaded.get_last_turn().took_user_id, msg='J trump should take the turn!')
+            scores = {hs.player_id: (hs.score, hs.bonus) for hs in HandScore.query.filter_by(hand_id=h.id).all()}
+            self.assertEqual({users[0].id: (11, 1), users[1].id: (10, 1), users[2].id: (1, 0)}, scores, msg='Hand scores are calculated incorrectly!')
+
+    def test_scoreboard(self):
+        with app.app_context():
+            # Given
+            users, h = self.deal([['9d', 'as'], ['ks', '2s'], ['jd', 'qs']])
+            state = get_hand_state(h.id)
+            for bet_size in [1, 0, 0]:
+                state.place_bet(state.next_acting_player(), bet_size)
+
+            # When
+            for card in ['as', 'ks', 'qs', '9d', '2s', 'jd']:
+                state.put_card(state.next_acting_player(), cards.encode(card))
+
+            # Then
+            scoreboard = {gs.player_id: (gs.hands_played, gs.sum_of_bets, gs.bonuses, gs.total_score) for gs in GameScore.query.filter_by(game_id=h.game_id).all()}
+            self.assertEqual({users[0].id: (1, 1, 1, 11), users[1].id: (1, 0, 1, 10), users[2].id: (1, 0, 0, 1)}, scoreboard, msg='Scoreboard is not updated on hand closing!')
+            g = Game.query.filter_by(id=h.game_id).first()
+            totals = g.get_scores()['rows'][-1]['dataArray'][1:]
+            self.assertEqual([11, 10, 1], [total['score'] for total in totals], msg='Game scores totals differ from scoreboard!')
+
+            # When
+            GameScore.query.filter_by(game_id=h.game_id).delete()
+            db.session.commit()
+            result = app.test_cli_runner().invoke(args=['scores', 'rebuild', str(h.game_id)])
+
+            # Then
+            self.assertEqual(0, result.exit_code, msg='Scoreboard rebuild failed: {}'.format(result.output))
+            rebuilt = {gs.player_id: (gs.hands_played, gs.sum_of_bets, gs.bonuses, gs.total_score) for gs in GameScore.query.filter_by(game_id=h.game_id).all()}
+            self.assertEqual(scoreboard, rebuilt, msg='Rebuilt scoreboard differs from incrementally updated one!')
+
+    def test_game_finish_stats(self):
+        with app.app_context():
+            # Given
+            users, h = self.deal([['9d', 'as'], ['ks', '2s'], ['jd', 'qs']])
+            state = get_hand_state(h.id)
+            for bet_size in [1, 0, 0]:
+                state.place_bet(state.next_acting_player(), bet_size)
+            for card in ['as', 'ks', 'qs', '9d', '2s', 'jd']:
+                state.put_card(state.next_acting_player(), cards.encode(card))
+            g = Game.query.filter_by(id=h.game_id).first()
+
+            # When
+            g.finish()
+            db.session.commit()
+
+            # Then
+            self.assertIsNotNone(g.finished, msg='Game should be finished!')
+            self.assertEqual(users[0].id, g.winner_id, msg='Player with top score should win the game!')
+            stats = {s.user_id: (s.games_played, s.games_won, s.sum_of_bets, s.bonuses, s.total_score) for s in Stats.query.all()}
+            self.assertEqual({users[0].id: (1, 1, 1, 1, 11), users[1].id: (1, 0, 0, 1, 10), users[2].id: (1, 0, 0, 0, 1)}, stats, msg='Game results are not folded into stats!')
+
+            # When
+            result = app.test_cli_runner().invoke(args=['stats', 'rebuild'])
+
+            # Then
+            self.assertEqual(0, result.exit_code, msg='Stats rebuild failed: {}'.format(result.output))
+            rebuilt = {s.user_id: (s.games_played, s.games_won, s.sum_of_bets, s.bonuses, s.total_score) for s in Stats.query.all()}
+            self.assertEqual(stats, rebuilt, msg='Rebuilt stats differ from incrementally aggregated ones!')
+
+    def test_ratings_cache_dropped_on_commit(self):
+        with app.app_context():
+            # Given
+            users, h = self.deal([['9d', 'as'], ['ks', '2s'], ['jd', 'qs']])
+            ratings_cache.set((10, None), [])
+
+            # When
+            Stats.rebuild()
+            db.session.rollback()
+
+            # Then
+            self.assertEqual([], ratings_cache.get((10, None)), msg='Ratings should be kept when stats change is rolled back!')
+
+            # When
+            Stats.rebuild()
+
+            # Then
+            self.assertEqual([], ratings_cache.get((10, None)), msg='Ratings should be kept until stats change is committed!')
+
+            # When
+            db.session.commit()
+
+            # Then
+            self.assertIsNone(ratings_cache.get((10, None)), msg='Ratings should be dropped once stats change is committed!')
+
+    def test_manual_finish_stats(self):
+        with app.app_context():
+            # Given
+            users, h = self.deal([['9d', 'as'], ['ks', '2s'], ['jd', 'qs']])
+            state = get_hand_state(h.id)
+            for bet_size in [1, 0, 0]:
+                state.place_bet(state.next_acting_player(), bet_size)
+            for card in ['as', 'ks', 'qs', '9d', '2s', 'jd']:
+                state.put_card(state.next_acting_player(), cards.encode(card))
+            g = Game.query.filter_by(id=h.game_id).first()
+            fedor = User(email='fedor@prostokvashino.ussr', username='fedor')      # connected to room, not playing
+            db.session.add(fedor)
+            db.session.commit()
+            for u in users + [fedor]:
+                g.room.connect(u)
+            g.room.ready(users[1])
+            g.room.ready(fedor)
+            room_version = Room.get_state_version(g.room_id)
+
+            # When
+            response = self.app.post('{base_path}/game/finish'.format(base_path=get_settings('API_BASE_PATH')[get_environment()]),
+                                     json={'token': users[0].generate_auth_token()})
+
+            # Then
+            self.assertEqual(200, response.status_code, msg='Failed to finish game! Response code is {}'.format(response.status_code))
+            g = Game.query.filter_by(id=h.game_id).first()
+            self.assertIsNotNone(g.finished, msg='Game should be finished!')
+            self.assertEqual(users[0].id, g.winner_id, msg='Manually finished game should have winner!')
+            self.assertEqual(3, Stats.query.count(), msg='Manually finished game should be folded into stats!')
+            self.assertFalse(g.room.if_user_is_ready(users[1]) or g.room.if_user_is_ready(fedor), msg='Nobody should be ready after game finish!')
+            self.assertEqual(room_version + 1, Room.get_state_version(g.room_id), msg='Game finish should advance room version once!')
+
+    def test_last_hand_finishes_game(self):
+        with app.app_context():
+            # Given
+            users, h = self.deal([['9d', 'as'], ['ks', '2s'], ['jd', 'qs']])
+            for serial_no in range(2, 21):
+                db.session.add(Hand(game_id=h.game_id, serial_no=serial_no, trump='d', cards_per_player=1, starting_player=users[0].id, is_closed=1))
+            db.session.commit()
+            state = get_hand_state(h.id)
+            for bet_size in [1, 0, 0]:
+                state.place_bet(state.next_acting_player(), bet_size)
+            for card in ['as', 'ks', 'qs', '9d', '2s']:
+                state.put_card(state.next_acting_player(), cards.encode(card))
+            commits = []
+
+            def count(session):
+                commits.append(session)
+
+            event.listen(db.session, 'after_commit', count)
+
+            # When
+            try:
+                state.put_card(state.next_acting_player(), cards.encode('jd'))
+            finally:
+                event.remove(db.session, 'after_commit', count)
+
+            # Then
+            g = Game.query.filter_by(id=h.game_id).first()
+            self.assertTrue(state.finishes_game, msg='Last hand should finish the game!')
+            self.assertEqual(1, len(commits), msg='Hand close and game finish should be committed in one transaction!')
+            self.assertIsNotNone(g.finished, msg='Game should be finished!')
+            self.assertEqual(users[0].id, g.winner_id, msg='Player with top score should win the game!')
+            self.assertEqual(3 + 6 + 2 + 1, g.state_version, msg='Bets, cards, tricks and finish should advance state version!')
+
+    def test_state_version(self):
+        with app.app_context():
+            # Given
+            users, h = self.deal([['9d', 'as'], ['ks', '2s'], ['jd', 'qs']])
+            state = get_hand_state(h.id)
+
+            # When
+            for bet_size in [1, 0, 0]:
+                state.place_bet(state.next_acting_player(), bet_size)
+            for card in ['as', 'ks', 'qs']:
+                state.put_card(state.next_acting_player(), cards.encode(card))
+
+            # Then
+            self.assertEqual(7, state.version, msg='Every bet and card should advance state version and taken trick should advance it once more!')
+            self.assertEqual(7, Game.get_state_version(h.game_id), msg='State version is not saved to db!')
+
+            # When
+            Game.advance_state_version(h.game_id)      # change made by other process
+            db.session.commit()
+
+            # Then
+            with self.assertRaises(StateConflict, msg='Stale hand state should not be saved!'):
+                state.place_bet(users[0].id, 1)
+            self.assertEqual(8, Game.get_state_version(h.game_id), msg='Conflicting change should be rolled back!')
+            reloaded = get_hand_state(h.id)
+            self.assertIsNot(state, reloaded, msg='Stale hand state should be reloaded!')
+            self.assertEqual(8, reloaded.version, msg='Reloaded hand state has wrong version!')
+
+    def test_racing_cards(self):
+        with app.app_context():
+            # Given
+            users, h = self.deal([['9d', 'as'], ['ks', '2s'], ['jd', 'qs']])
+            state = get_hand_state(h.id)
+            for bet_size in [1, 0, 0]:
+                state.place_bet(state.next_acting_player(), bet_size)
+            winner, loser = HandState.load(load_hand(h.id)), HandState.load(load_hand(h.id))     # states of two processes
+
+            # When
+            winner.put_card(users[0].id, cards.encode('as'))
+
+            # Then
+            with self.assertRaises(StateConflict, msg='Card opening the same trick from stale state should conflict!'):
+                loser.put_card(users[0].id, cards.encode('9d'))
+            self.assertEqual(4, Game.get_state_version(h.game_id), msg='Conflicting card should be rolled back!')
+            self.assertEqual(1, Turn.query.filter_by(hand_id=h.id).count(), msg='Conflicting turn should be rolled back!')
+            self.assertEqual([('a', 's')], [(tc.card_id, tc.card_suit) for tc in TurnCard.query.filter_by(hand_id=h.id)],
+                             msg='Only card of the winner should be saved!')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
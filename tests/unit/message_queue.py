@@ -0,0 +1,118 @@
+import unittest
+import json
+from unittest import mock
+from flask import Flask
+from flask_socketio import SocketIO
+import socketio.redis_manager
+from queue import Queue
+from time import monotonic, sleep
+from socketio import Server, PubSubManager
+from app import socketio_options
+from app.channels import ChannelsMixin, change_user_channel, user_channel, ENTER_CHANNEL, LEAVE_CHANNEL
+
+
+class BrokerStandIn(object):
+    # in-process stand-in for redis server: records published messages
+
+    def __init__(self):
+        self.url = None
+        self.published = []
+
+    def from_url(self, url, **options):
+        self.url = url
+        return self
+
+    def publish(self, channel, message):
+        self.published.append((channel, json.loads(message)))
+        return 1
+
+    def pubsub(self, **options):
+        return mock.MagicMock()
+
+
+class QueueStandIn(object):
+    # in-process stand-in for message queue shared by workers: every published message is delivered to all listeners
+
+    def __init__(self):
+        self.listeners = []
+
+    def manager(self):
+        queue = self
+        inbox = Queue()
+        self.listeners.append(inbox)
+
+        class InProcessManager(ChannelsMixin, PubSubManager):
+
+            def _publish(self, data):
+                for listener in queue.listeners:
+                    listener.put(json.dumps(data))
+
+            def _listen(self):
+                while True:
+                    yield inbox.get()
+
+        return InProcessManager()
+
+
+class MessageQueueCase(unittest.TestCase):
+
+    def test_default_options(self):
+        # When
+        options = socketio_options({})
+
+        # Then
+        self.assertNotIn('message_queue', options, msg='Message queue should not be used unless configured!')
+        self.assertFalse(options['logger'] or options['engineio_logger'], msg='Socket logging should be off by default!')
+
+    def test_emits_are_published_to_queue(self):
+        # Given
+        broker = BrokerStandIn()
+        with mock.patch.object(socketio.redis_manager, 'redis', mock.Mock(Redis=broker)), \
+                mock.patch.object(socketio.redis_manager, 'RedisError', Exception):
+            options = socketio_options({'MESSAGE_QUEUE': 'redis://queue.prostokvashino.ussr:6379/0', 'CHANNEL': 'nigels-test'})
+            worker = SocketIO(Flask(__name__), **options)
+
+            # When
+            worker.emit('refresh_game_table', {'event': 'make bet', 'version': 1}, namespace='/game', to='game-1')
+
+        # Then
+        self.assertIsInstance(worker.server.manager, socketio.redis_manager.RedisManager, msg='Redis message queue is not used!')
+        self.assertEqual('redis://queue.prostokvashino.ussr:6379/0', broker.url, msg='Wrong message queue url!')
+        self.assertEqual(1, len(broker.published), msg='Emit should be published to other workers!')
+        channel, message = broker.published[0]
+        self.assertEqual('nigels-test', channel, msg='Emit is published to wrong channel!')
+        self.assertEqual(('refresh_game_table', '/game', 'game-1', [{'event': 'make bet', 'version': 1}]),
+                         (message['event'], message['namespace'], message['room'], message['data']), msg='Wrong published message!')
+
+    def test_channel_change_reaches_socket_worker(self):
+        # Given
+        queue = QueueStandIn()
+        workers = [Server(client_manager=queue.manager(), async_mode='threading') for i in range(2)]
+        for worker in workers:
+            worker.manager.initialize()
+        remote = workers[1].manager
+        remote_sid = remote.connect('matroskin-eio', '/game')
+        remote.enter_room(remote_sid, '/game', user_channel(1))
+
+        # When
+        change_user_channel(workers[0].manager, ENTER_CHANNEL, 1, 'game-5', '/game')
+        subscribed = self.wait_for(lambda: list(remote.get_participants('/game', 'game-5')))
+        change_user_channel(workers[0].manager, LEAVE_CHANNEL, 1, 'game-5', '/game')
+        unsubscribed = self.wait_for(lambda: not list(remote.get_participants('/game', 'game-5')))
+
+        # Then
+        self.assertEqual([(remote_sid, 'matroskin-eio')], subscribed, msg='Socket of other worker should enter game channel!')
+        self.assertTrue(unsubscribed, msg='Socket of other worker should leave game channel!')
+        self.assertEqual([], list(workers[0].manager.get_participants('/game', 'game-5')), msg='Channel change should not create sockets on other workers!')
+
+    def wait_for(self, condition, timeout=2):
+        deadline = monotonic() + timeout
+        result = condition()
+        while not result and monotonic() < deadline:
+            sleep(0.01)
+            result = condition()
+        return result
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,72 @@
+import unittest
+from app import create_app, db
+from app.models import User, Room, Game
+from app.metrics import Histogram, registry
+from app.socket import publish_game_event
+from config import get_settings, get_environment
+
+
+class MetricsCase(unittest.TestCase):
+
+    def setUp(self):
+        registry.clear()
+
+    def test_histogram_exposition(self):
+        # Given
+        histogram = Histogram('nigels_test_seconds', 'Test latency.', ['blueprint'], buckets=(0.1, 1))
+
+        # When
+        for value in [0.05, 0.5, 0.7, 5]:
+            histogram.observe(value, ('game',))
+
+        # Then
+        self.assertEqual([
+            '# HELP nigels_test_seconds Test latency.',
+            '# TYPE nigels_test_seconds histogram',
+            'nigels_test_seconds_bucket{blueprint="game",le="0.1"} 1',
+            'nigels_test_seconds_bucket{blueprint="game",le="1"} 3',
+            'nigels_test_seconds_bucket{blueprint="game",le="+Inf"} 4',
+            'nigels_test_seconds_sum{blueprint="game"} 6.25',
+            'nigels_test_seconds_count{blueprint="game"} 4'
+        ], histogram.exposition(), msg='Wrong histogram exposition!')
+
+    def test_metrics_endpoint(self):
+        # Given
+        metrics_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True, 'METRICS': {'ENABLED': True, 'TOKEN': 'prostokvashino'},
+                                 'PROFILING': {'ENABLED': True}})
+        plain_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True, 'METRICS': {}})
+        base_path = get_settings('API_BASE_PATH')[get_environment()]
+        with metrics_app.app_context():
+            db.create_all()
+            u = User(email='matroskin@prostokvashino.ussr', username='matroskin')
+            db.session.add(u)
+            db.session.commit()
+            r = Room(room_name='Prostokvashino', host=u)
+            db.session.add(r)
+            db.session.add(Game(room=r))
+            db.session.commit()
+            room_id = r.id
+            publish_game_event(1, 'bet', 1)
+        client = metrics_app.test_client()
+
+        # When
+        room = client.get('{base_path}/room/{room_id}'.format(base_path=base_path, room_id=room_id))
+        unauthorized = client.get('/metrics')
+        response = client.get('/metrics', headers={'Authorization': 'Bearer prostokvashino'})
+
+        # Then
+        self.assertEqual(401, unauthorized.status_code, msg='Metrics should be protected by configured token!')
+        self.assertEqual(200, response.status_code, msg='Failed to get metrics! Response code is {}'.format(response.status_code))
+        metrics = response.get_data(as_text=True).splitlines()
+        self.assertIn('nigels_http_request_duration_seconds_count{blueprint="room",method="GET",status="200"} 1', metrics, msg='Request latency is not measured!')
+        self.assertIn('nigels_http_request_db_duration_seconds_count{blueprint="room"} 1', metrics, msg='Request db time is not measured!')
+        self.assertIn('nigels_socketio_emits_total{namespace="/game",event="refresh_game_table"} 1', metrics, msg='Socket emit is not counted!')
+        self.assertIn('nigels_socketio_emit_fanout_bucket{namespace="/game",event="refresh_game_table",le="0"} 1', metrics, msg='Socket emit fan-out is not measured!')
+        self.assertIn('nigels_active_games 1', metrics, msg='Active games are not counted!')
+        self.assertEqual(2, len(metrics_app.extensions['query_observers']), msg='Metrics and profiling should share one sql timing hook!')
+        self.assertGreater(int(room.headers['X-Query-Count']), 0, msg='Profiling should observe queries along with metrics!')
+        self.assertNotIn('metrics', plain_app.view_functions, msg='Metrics should be opt-in!')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
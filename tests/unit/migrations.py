@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+from flask_migrate import upgrade
+from sqlalchemy import inspect, text
+from app import create_app, db
+from app.models import User, Room, Game, Hand, HandScore, Turn, TurnCard, GameScore
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), 'migrations')
+
+
+class MigrationsCase(unittest.TestCase):
+
+    def test_hand_surrogate_key(self):
+        # Given
+        migrated_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'migrated.db'), 'TESTING': True})
+        with migrated_app.app_context():
+            db.create_all()
+            # hand table of database created before surrogate key (composite primary key, id set by application)
+            db.session.execute(text('DROP TABLE hand'))
+            db.session.execute(text(
+                'CREATE TABLE hand (id INTEGER NOT NULL, game_id INTEGER NOT NULL, serial_no INTEGER NOT NULL, trump VARCHAR(1), '
+                'cards_per_player INTEGER, starting_player INTEGER, is_closed INTEGER NOT NULL, PRIMARY KEY (id, game_id, serial_no), '
+                'FOREIGN KEY(game_id) REFERENCES game (id), FOREIGN KEY(starting_player) REFERENCES user (id))'))
+            u = User(email='matroskin@prostokvashino.ussr', username='matroskin')
+            r = Room(room_name='Prostokvashino', host=u)
+            g = Game(room=r)
+            db.session.add_all([u, r, g])
+            db.session.commit()
+            db.session.execute(text('INSERT INTO hand (id, game_id, serial_no, trump, cards_per_player, is_closed) VALUES (7, :game_id, 1, \'d\', 5, 1)'), {'game_id': g.id})
+            db.session.commit()
+
+            # When
+            upgrade(directory=MIGRATIONS)
+            h = Hand(game_id=g.id, serial_no=2, trump='h', cards_per_player=5, is_closed=0)
+            db.session.add(h)
+            db.session.commit()
+
+            # Then
+            inspector = inspect(db.engine)
+            self.assertEqual(['id'], inspector.get_pk_constraint('hand')['constrained_columns'], msg='Hand id should be the only primary key!')
+            self.assertIn('uq_hand_game_serial_no', [c['name'] for c in inspector.get_unique_constraints('hand')], msg='Hand serial number should be unique in game!')
+            self.assertEqual([(7, 1), (8, 2)], [(hand.id, hand.serial_no) for hand in Hand.query.order_by(Hand.id)], msg='Existing hands should keep ids, new ones get next id!')
+            self.assertIn('hand', [fk['referred_table'] for fk in inspector.get_foreign_keys('dealt_cards')], msg='Foreign keys to hand should survive rebuild!')
+            self.assertEqual(['game', 'user'], sorted(fk['referred_table'] for fk in inspector.get_foreign_keys('hand')), msg='Hand foreign keys should be kept!')
+
+    def test_current_schema_is_kept(self):
+        # Given
+        current_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'current.db'), 'TESTING': True})
+        with current_app.app_context():
+            db.create_all()
+            u = User(email='matroskin@prostokvashino.ussr', username='matroskin')
+            r = Room(room_name='Prostokvashino', host=u)
+            g = Game(room=r)
+            db.session.add_all([u, r, g, Hand(game=g, serial_no=1, is_closed=0)])
+            db.session.commit()
+
+            # When
+            upgrade(directory=MIGRATIONS)
+
+            # Then
+            self.assertEqual(['id'], inspect(db.engine).get_pk_constraint('hand')['constrained_columns'], msg='Hand primary key should be kept!')
+            self.assertEqual(1, Hand.query.count(), msg='Upgrade of current schema should not change hands!')
+
+    def test_game_loop_indexes_and_state(self):
+        # Given
+        migrated_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'migrated.db'), 'TESTING': True})
+        with migrated_app.app_context():
+            db.create_all()
+            # schema before game loop indexes, state versions, seed and scoreboard
+            for name in ['ix_player_game_position', 'ix_dealt_cards_hand_player_suit', 'ix_hand_score_hand_player', 'ix_turn_hand_serial_no',
+                         'ix_turn_hand_took_user', 'ix_turn_card_turn_player', 'ix_turn_card_hand_player']:
+                db.session.execute(text('DROP INDEX {}'.format(name)))
+            db.session.execute(text('DROP TABLE game_score'))
+            for table, column in [('room', 'state_version'), ('game', 'state_version'), ('game', 'seed')]:
+                db.session.execute(text('ALTER TABLE {} DROP COLUMN {}'.format(table, column)))
+            for statement in [
+                "INSERT INTO user (id, username, email) VALUES (1, 'matroskin', 'matroskin@prostokvashino.ussr'), (2, 'pechkin', 'pechkin@prostokvashino.ussr')",
+                "INSERT INTO room (id, room_name, user_id) VALUES (1, 'Prostokvashino', 1)",
+                "INSERT INTO game (id, room_id) VALUES (1, 1)",
+                "INSERT INTO player (game_id, user_id, position) VALUES (1, 1, 1), (1, 2, 2)",
+                "INSERT INTO hand (id, game_id, serial_no, trump, cards_per_player, is_closed) VALUES (1, 1, 1, 'd', 1, 1)",
+                # bet and turn submitted twice by racing requests
+                "INSERT INTO hand_score (id, hand_id, player_id, bet_size, score, bonus) VALUES (1, 1, 1, 1, 11, 1), (2, 1, 2, 1, 0, 0), (3, 1, 2, 1, 0, 0)",
+                "INSERT INTO turn (id, hand_id, serial_no, took_user_id) VALUES (1, 1, 1, 1), (2, 1, 1, 1)",
+                "INSERT INTO turn_card (id, hand_id, turn_id, card_id, card_suit, player_id) VALUES (1, 1, 1, 'a', 'd', 1), (2, 1, 2, 'k', 'd', 2), (3, 1, 2, 'a', 'd', 1)"
+            ]:
+                db.session.execute(text(statement))
+            db.session.commit()
+
+            # When
+            upgrade(directory=MIGRATIONS)
+
+            # Then
+            inspector = inspect(db.engine)
+            indexes = {index['name']: index['unique'] for table in ['player', 'dealt_cards', 'hand_score', 'turn', 'turn_card'] for index in inspector.get_indexes(table)}
+            self.assertTrue(indexes['ix_turn_card_turn_player'] and indexes['ix_hand_score_hand_player'] and indexes['ix_turn_hand_serial_no'],
+                            msg='Unique game loop indexes should be created!')
+            self.assertFalse(indexes['ix_player_game_position'] or indexes['ix_dealt_cards_hand_player_suit'] or indexes['ix_turn_hand_took_user'] or indexes['ix_turn_card_hand_player'],
+                             msg='Lookup indexes should be created!')
+            self.assertEqual([1, 2], [hs.id for hs in HandScore.query.order_by(HandScore.id)], msg='Duplicate bet should be removed!')
+            self.assertEqual([1], [t.id for t in Turn.query.all()], msg='Duplicate turn should be removed!')
+            self.assertEqual([(1, 1, 1), (2, 1, 2)], [(tc.id, tc.turn_id, tc.player_id) for tc in TurnCard.query.order_by(TurnCard.id)],
+                             msg='Cards of duplicate turn should move to kept turn without duplicates!')
+            self.assertEqual((0, 0, None), (Room.query.first().state_version, Game.query.first().state_version, Game.query.first().seed),
+                             msg='State versions and seed should be added!')
+            self.assertEqual({1: (1, 1, 1, 11), 2: (1, 1, 0, 0)},
+                             {gs.player_id: (gs.hands_played, gs.sum_of_bets, gs.bonuses, gs.total_score) for gs in GameScore.query.filter_by(game_id=1)},
+                             msg='Scoreboard should be filled from closed hands!')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
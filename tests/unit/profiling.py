@@ -0,0 +1,75 @@
+import unittest
+from app import create_app, db
+from app.models import User, Room
+from config import get_settings, get_environment
+
+
+class ProfilingCase(unittest.TestCase):
+
+    def test_request_profile(self):
+        # Given
+        profiled_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True, 'PROFILING': {'ENABLED': True, 'SLOWEST_QUERIES': 2, 'TOKEN': 'prostokvashino'}})
+        plain_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True, 'PROFILING': {}})
+        base_path = get_settings('API_BASE_PATH')[get_environment()]
+        with plain_app.app_context():
+            db.create_all()
+        with profiled_app.app_context():
+            db.create_all()
+            u = User(email='matroskin@prostokvashino.ussr', username='matroskin')
+            db.session.add(u)
+            db.session.commit()
+            r = Room(room_name='Prostokvashino', host=u)
+            db.session.add(r)
+            db.session.commit()
+            r.connect(u)
+            room_id = r.id
+        client = profiled_app.test_client()
+
+        # When
+        responses = [client.get('{base_path}/room/{room_id}'.format(base_path=base_path, room_id=room_id)) for i in range(2)]
+        unauthorized = client.get('{base_path}/profiling'.format(base_path=base_path))
+        report = client.get('{base_path}/profiling'.format(base_path=base_path), headers={'Authorization': 'Bearer prostokvashino'}).get_json()['endpoints']
+
+        # Then
+        queries = int(responses[0].headers['X-Query-Count'])
+        self.assertGreater(queries, 0, msg='Queries of room status are not counted!')
+        self.assertEqual(2, len(responses[0].headers.getlist('Server-Timing')), msg='Response should carry db and app timings!')
+        self.assertTrue(responses[0].headers['Server-Timing'].startswith('db;dur='), msg='Wrong db timing {}!'.format(responses[0].headers['Server-Timing']))
+        self.assertEqual(['GET {}/room/<room_id>'.format(base_path)], [endpoint['endpoint'] for endpoint in report], msg='Wrong profiled endpoints!')
+        self.assertEqual(2, report[0]['requests'], msg='Wrong number of profiled requests!')
+        self.assertEqual(queries, report[0]['maxQueries'], msg='Wrong max queries of endpoint!')
+        self.assertEqual(2, len(report[0]['slowestQueries']), msg='Slowest queries should be limited by SLOWEST_QUERIES!')
+        self.assertEqual(401, unauthorized.status_code, msg='Profiling report should be protected by configured token!')
+        self.assertNotIn('X-Query-Count', plain_app.test_client().get('{}/room/1'.format(base_path)).headers, msg='Profiling should be opt-in!')
+        self.assertNotIn('profiling', plain_app.view_functions, msg='Profiling report should not be served unless enabled!')
+
+    def test_profiling_reset(self):
+        # Given
+        profiled_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True, 'PROFILING': {'ENABLED': True, 'TOKEN': 'prostokvashino'}})
+        open_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True, 'PROFILING': {'ENABLED': True}})
+        base_path = get_settings('API_BASE_PATH')[get_environment()]
+        headers = {'Authorization': 'Bearer prostokvashino'}
+        for test_app in [profiled_app, open_app]:
+            with test_app.app_context():
+                db.create_all()
+        client = profiled_app.test_client()
+        client.get('{base_path}/room/1'.format(base_path=base_path))
+
+        # When
+        get_reset = client.get('{base_path}/profiling?reset=y'.format(base_path=base_path), headers=headers)
+        unauthorized = client.post('{base_path}/profiling/reset'.format(base_path=base_path))
+        reset = client.post('{base_path}/profiling/reset'.format(base_path=base_path), headers=headers)
+        report = client.get('{base_path}/profiling'.format(base_path=base_path), headers=headers).get_json()['endpoints']
+        tokenless = open_app.test_client().post('{base_path}/profiling/reset'.format(base_path=base_path))
+
+        # Then
+        self.assertEqual(1, len(get_reset.get_json()['endpoints']), msg='Profile should not be reset by GET request!')
+        self.assertEqual(401, unauthorized.status_code, msg='Profiling reset should be protected by configured token!')
+        self.assertEqual(200, reset.status_code, msg='Failed to reset profiling! Response code is {}'.format(reset.status_code))
+        self.assertEqual(1, len(reset.get_json()['endpoints']), msg='Reset should return collected profile!')
+        self.assertEqual([], report, msg='Profile should be collected anew after reset!')
+        self.assertEqual(403, tokenless.status_code, msg='Profiling reset should not be available without token!')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
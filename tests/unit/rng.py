@@ -0,0 +1,50 @@
+import unittest
+import random
+from app import app
+from app.models import User, DealtCards
+from app.rng import game_random, derive_seed
+from tests.base_case import BaseCase, seed_game
+from config import get_settings, get_environment
+
+
+class RngCase(BaseCase):
+
+    def deal(self, g, users):
+        response = self.app.post('{base_path}/game/{game_id}/hand/deal'.format(
+            base_path=get_settings('API_BASE_PATH')[get_environment()], game_id=g.id), json={'token': users[0].generate_auth_token()})
+        self.assertEqual(200, response.status_code, msg='Failed to deal cards! Response code is {}'.format(response.status_code))
+        dealt_cards = DealtCards.query.filter_by(hand_id=response.get_json()['handId']).order_by(DealtCards.id).all()
+        return [(users.index(User.query.filter_by(id=dc.player_id).first()), dc.card_id + dc.card_suit) for dc in dealt_cards]
+
+    def test_game_random(self):
+        # Given
+        deck = list(range(52))
+
+        # When
+        first_deck, same_deck, other_hand_deck = list(deck), list(deck), list(deck)
+        game_random(42, 'deck', 1).shuffle(first_deck)
+        game_random(42, 'deck', 1).shuffle(same_deck)
+        game_random(42, 'deck', 2).shuffle(other_hand_deck)
+
+        # Then
+        self.assertEqual(first_deck, same_deck, msg='Same seed and stream should give same shuffle!')
+        self.assertNotEqual(first_deck, other_hand_deck, msg='Different streams should give different shuffles!')
+        self.assertIsInstance(game_random(None, 'deck', 1), random.SystemRandom, msg='Games without seed should use system randomness!')
+        self.assertTrue(0 <= derive_seed('any', 'parts') < 2 ** 63, msg='Derived seed should fit bigint column!')
+
+    def test_replay_deal(self):
+        with app.app_context():
+            # Given
+            r, recorded_game, recorded_users = seed_game(seed=42)
+            r, replayed_game, replayed_users = seed_game(['replayedmatroskin', 'replayedpechkin', 'replayedsharik'], seed=42)
+
+            # When
+            recorded_cards = self.deal(recorded_game, recorded_users)
+            replayed_cards = self.deal(replayed_game, replayed_users)
+
+            # Then
+            self.assertEqual(recorded_cards, replayed_cards, msg='Game with the same seed should get the same deal!')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
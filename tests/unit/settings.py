@@ -0,0 +1,56 @@
+import unittest
+import os
+import tempfile
+from config import Settings
+
+
+class SettingsCase(unittest.TestCase):
+
+    def write_config(self, content):
+        configfile = tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False)
+        configfile.write(content)
+        configfile.close()
+        self.addCleanup(os.remove, configfile.name)
+        return configfile.name
+
+    def test_environment_resolving(self):
+        # Given
+        path = self.write_config('\n'.join([
+            'ENVIRONMENT: TEST',
+            'GAME:',
+            '  MAX_PLAYERS:',
+            '    PROD: 10',
+            '    TEST: 4',
+            'AUTH:',
+            '  SECRET_KEY:',
+            '    PROD: prod-secret',
+            '    TEST: test-secret',
+            '  TEST:',
+            '    OAUTH_CREDENTIALS:',
+            '      facebook:',
+            '        ID: test-id',
+            '  PROD:',
+            '    OAUTH_CREDENTIALS:',
+            '      facebook:',
+            '        ID: prod-id',
+            'LANGS:',
+            '  SUPPORTED: [en, ru]'
+        ]))
+
+        # When
+        settings = Settings.load(path)
+
+        # Then
+        self.assertEqual('TEST', settings.environment, msg='Environment is not read from config!')
+        self.assertEqual(4, settings.GAME['MAX_PLAYERS'], msg='Value of current environment should be resolved!')
+        self.assertEqual(10, settings.raw['GAME']['MAX_PLAYERS']['PROD'], msg='Raw values should stay available!')
+        self.assertEqual('test-secret', settings.AUTH['SECRET_KEY'], msg='Nested environment value is not resolved!')
+        self.assertEqual('test-id', settings.AUTH['OAUTH_CREDENTIALS']['facebook']['ID'], msg='Environment section is not resolved!')
+        self.assertNotIn('PROD', settings.AUTH, msg='Other environments should not be present in resolved settings!')
+        self.assertEqual(('en', 'ru'), settings.LANGS['SUPPORTED'], msg='Lists should be frozen to tuples!')
+        with self.assertRaises(TypeError, msg='Settings should be read-only!'):
+            settings.GAME['MAX_PLAYERS'] = 6
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
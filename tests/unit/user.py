@@ -1,7 +1,8 @@
 import unittest
 from app import db, app
 from app.models import User
-from tests.base_case import BaseCase
+from app.cache import auth_cache
+from tests.base_case import BaseCase, count_statements
 
 
 class UserModelCase(BaseCase):
@@ -43,6 +44,67 @@ class UserModelCase(BaseCase):
             self.assertEqual(1, User.query.filter_by(email=email).count(), msg='User with specified email was not created in DB!')
             self.assertEqual(1, User.query.filter_by(username=username).count(), msg='User with specified username was not created in DB!')
 
+    def test_auth_token_cache(self):
+        with app.app_context():
+            # Given
+            u = User(email="matroskin@prostokvashino.ussr", username="Matroskin")
+            db.session.add(u)
+            db.session.commit()
+            token = u.generate_auth_token()
+
+            # When
+            User.verify_auth_token(token)
+            db.session.remove()
+            with count_statements() as statements:
+                cached_user = User.verify_auth_token(token)
+
+            # Then
+            self.assertEqual(0, len(statements), msg='Cached token should be resolved without queries!')
+            self.assertEqual(u.id, cached_user.id, msg='Token is resolved to wrong user!')
+            self.assertEqual("Matroskin", cached_user.username, msg='Token is resolved to wrong user!')
+
+            # When
+            cached_user.about_me = 'Cat'
+            db.session.commit()
+            db.session.remove()
+            with count_statements() as statements:
+                edited_user = User.verify_auth_token(token)
+
+            # Then
+            self.assertEqual(1, len(statements), msg='Edited user should be resolved from db again!')
+            self.assertEqual('Cat', edited_user.about_me, msg='Edited user is resolved from stale cache!')
+
+    def test_auth_cache_dropped_on_commit(self):
+        with app.app_context():
+            # Given
+            u = User(email="matroskin@prostokvashino.ussr", username="Matroskin")
+            db.session.add(u)
+            db.session.commit()
+            token = u.generate_auth_token()
+            User.verify_auth_token(token)
+
+            # When
+            u.about_me = 'Cat'
+            db.session.flush()
+
+            # Then
+            self.assertEqual(1, len(auth_cache), msg='Cached user should be kept until change is committed!')
+
+            # When
+            db.session.commit()
+
+            # Then
+            self.assertEqual(0, len(auth_cache), msg='Cached user should be dropped once change is committed!')
+
+            # When
+            User.verify_auth_token(token)
+            u.about_me = 'Dog'
+            db.session.flush()
+            db.session.rollback()
+
+            # Then
+            self.assertEqual('Cat', User.verify_auth_token(token).about_me, msg='Rolled back change is resolved from cache!')
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,7 @@
+from gevent import monkey
+monkey.patch_all()      # must run before any other import (sockets and threads used by db drivers and redis)
+
+from app import app, socketio
+
+# production entry point (debug off, gevent worker tuned by FLASK section of config.yml):
+# $ gunicorn -c gunicorn.conf.py wsgi:app